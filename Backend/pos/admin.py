@@ -185,11 +185,7 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ("name",)
     list_filter = ("category", "brand", "is_active")
     inlines = [ProductVariantInline]
-
-    @admin.display(description="Stock")
-    def total_stock(self, obj):
-        # Sum stock from all variants
-        return sum(v.stock_quantity for v in obj.variants.all())
+    readonly_fields = ("total_stock",)
 
 admin.site.register(Order)
 admin.site.register(OrderItem)
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Tabular report exports that do not hold the whole table in memory.
+
+Both writers take a header and an iterable of rows (sequences), normally a
+generator over `queryset.iterator()`:
+
+    csv_response("waste.csv", header, rows)
+    xlsx_response("waste.xlsx", "Waste", header, rows)
+
+CSV is streamed to the client as rows are produced. XLSX cannot be sent
+before the workbook is closed, so it is written with xlsxwriter's
+constant_memory mode into a temporary file, which is then streamed back.
+"""
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(filename, header, rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def xlsx_response(filename, sheet_name, header, rows):
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "strings_to_numbers": True,
+        "default_date_format": "yyyy-mm-dd",
+    })
+    sheet = workbook.add_worksheet(sheet_name)
+    sheet.write_row(0, 0, header)
+    for index, row in enumerate(rows, start=1):
+        sheet.write_row(index, 0, row)
+    workbook.close()
+
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+def export_response(export_type, basename, sheet_name, header, rows):
+    """CSV or XLSX download for ?export=csv|xlsx ("excel" is accepted for xlsx)."""
+    if export_type == "csv":
+        return csv_response(f"{basename}.csv", header, rows)
+    return xlsx_response(f"{basename}.xlsx", sheet_name, header, rows)
@@ -0,0 +1,342 @@
+"""
+Sales forecast and restock suggestions per variant.
+
+Forecasts are partitioned by shop. A shop's daily unit sales come out of
+one grouped query as compact NumPy arrays (variant id, day, quantity);
+variant_stats() expands them to a gap-filled daily series per variant with
+a single reindex and runs the 7-day rolling statistics and the restock
+formula as grouped column operations. It touches no database, so the
+nightly run (forecast_shops) fans shops out over a process pool, timing and
+isolating failures per shop; variant metadata is then loaded in one query
+restricted to the shop.
+purchase_orders() rolls a stored run up into draft purchase orders per
+supplier.
+
+The figures match the per-variant loop this replaced: a variant's series
+spans its first to last day with sales; the trend compares the mean of the
+last 7 and last 30 rolling means (capped at +-50%); the safety buffer scales
+with volatility (capped at 20%); the suggestion is capped at three average
+months and never drops below 3 for a variant that sold at all.
+"""
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+ROLLING_WINDOW = 7
+MIN_RESTOCK = 3
+
+
+def sales_arrays(shop_id, since):
+    """(variant ids, days, quantities) of one shop's unit sales per variant per day, one query."""
+    from .models import OrderItem
+
+    if shop_id is None:
+        raise ValueError("A shop is required to forecast.")
+
+    rows = list(
+        OrderItem.objects.filter(
+            order__shop_id=shop_id, order__created_at__gte=since, variant__isnull=False
+        )
+        .annotate(day=TruncDate("order__created_at"))
+        .values_list("variant_id", "day")
+        .annotate(quantity_sold=Sum("quantity"))
+        .order_by()
+    )
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype="datetime64[D]"), np.empty(0, dtype=np.int64)
+    variant_ids, days, quantities = zip(*rows)
+    return (
+        np.array(variant_ids, dtype=np.int64),
+        np.array(days, dtype="datetime64[D]"),
+        np.array(quantities, dtype=np.int64),
+    )
+
+
+def variant_stats(variant_ids, days, quantities, months_back, now):
+    """
+    Per-variant forecast columns (indexed by variant id) from sales_arrays().
+    `now` is a naive local datetime. Pure NumPy/pandas, safe to run in a worker process.
+    """
+    sales = pd.DataFrame({
+        "variant": variant_ids,
+        "day": days.astype("datetime64[ns]"),
+        "quantity_sold": quantities,
+    })
+
+    # every variant gets a gap-free daily series from its first to last sale, built as one
+    # (variant, day) grid and a single reindex rather than a resample per group
+    span = sales.groupby("variant")["day"].agg(["min", "max"])
+    lengths = ((span["max"] - span["min"]).dt.days + 1).to_numpy()
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    grid = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(span.index.to_numpy(), lengths),
+            pd.DatetimeIndex(np.repeat(span["min"].to_numpy(), lengths)) + pd.to_timedelta(offsets, unit="D"),
+        ],
+        names=["variant", "day"],
+    )
+    daily = (
+        sales.groupby(["variant", "day"])["quantity_sold"].sum()
+        .reindex(grid, fill_value=0)
+        .astype(float)
+        .reset_index()
+    )
+    rolling = daily.groupby("variant")["quantity_sold"].rolling(ROLLING_WINDOW, min_periods=1)
+    daily["rolling_mean"] = rolling.mean().reset_index(level=0, drop=True)
+    daily["rolling_std"] = rolling.std().reset_index(level=0, drop=True).fillna(0)
+
+    by_variant = daily.groupby("variant")
+    stats = by_variant.agg(
+        daily_avg=("quantity_sold", "mean"),
+        total_sold=("quantity_sold", "sum"),
+        std_mean=("rolling_std", "mean"),
+        last_sale=("day", "max"),
+    )
+    stats["last_7_avg"] = by_variant.tail(ROLLING_WINDOW).groupby("variant")["rolling_mean"].mean()
+    stats["last_30_avg"] = by_variant.tail(30).groupby("variant")["rolling_mean"].mean()
+
+    trend = (stats["last_7_avg"] - stats["last_30_avg"]) / np.maximum(1, stats["last_30_avg"])
+    stats["trend_factor"] = trend.clip(-0.5, 0.5)
+    stats["predicted_next_month"] = stats["daily_avg"] * 30 * (1 + stats["trend_factor"])
+    volatility = np.minimum(stats["std_mean"] / np.maximum(1, stats["daily_avg"]), 0.2)
+    stats["safety_buffer"] = stats["predicted_next_month"] * volatility
+    stats["avg_monthly_sold"] = stats["total_sold"] / months_back
+    stats["days_since_last_sale"] = (pd.Timestamp(now) - stats["last_sale"]).dt.days
+    return stats
+
+
+def forecast_rows(shop_id, stats):
+    """Forecast rows, best sellers first, for the variants in `stats` that belong to the shop."""
+    from .models import ProductVariant
+
+    variants = {
+        v.pk: v
+        for v in ProductVariant.objects.filter(shop_id=shop_id, pk__in=stats.index.tolist())
+        .select_related("product")
+        .only("id", "stock_quantity", "product__name")
+    }
+    stats = stats[stats.index.isin(list(variants))].copy()
+    if stats.empty:
+        return []
+    stats["current_stock"] = [variants[pk].stock_quantity or 0 for pk in stats.index]
+
+    raw = stats["predicted_next_month"] + stats["safety_buffer"] - stats["current_stock"]
+    suggested = np.ceil(np.maximum(0, np.minimum(raw, stats["avg_monthly_sold"] * 3)))
+    stats["suggested_restock"] = suggested.where(
+        ~((suggested < MIN_RESTOCK) & (stats["total_sold"] > 0)), MIN_RESTOCK
+    ).astype(int)
+
+    low_demand = stats["total_sold"] < 10
+    overstocked = stats["current_stock"] > stats["avg_monthly_sold"] * 2
+    stale = stats["days_since_last_sale"] > 45
+
+    # best sellers first; ties keep variant id order
+    order = np.lexsort((stats.index.to_numpy(), -stats["total_sold"].to_numpy()))
+    results = []
+    for pk, row, low, over, old in zip(
+        stats.index[order], stats.iloc[order].itertuples(), low_demand.iloc[order],
+        overstocked.iloc[order], stale.iloc[order],
+    ):
+        notes = []
+        if low:
+            notes.append("Low Demand")
+        if over:
+            notes.append("Overstocked")
+        if old:
+            notes.append("Consider Clearance / Discount")
+        variant = variants[pk]
+        results.append({
+            "variant_id": int(pk),
+            "product_name": variant.product.name,
+            "variant_name": str(variant),
+            "current_stock": int(row.current_stock),
+            "total_sold": int(row.total_sold),
+            "avg_monthly_sold": float(row.avg_monthly_sold),
+            "predicted_next_month_sales": float(row.predicted_next_month),
+            "safety_buffer": float(row.safety_buffer),
+            "suggested_restock": int(row.suggested_restock),
+            "notes": notes,
+        })
+    return results
+
+
+def _local(now):
+    return timezone.localtime(now).replace(tzinfo=None)
+
+
+def _window_start(now, months_back):
+    return now - timedelta(days=30 * months_back)
+
+
+def forecast(shop_id, months_back=2, now=None):
+    """
+    Forecast rows for every variant the shop sold in the last `months_back`
+    months (30-day months), best sellers first. Runs in this process.
+    Raises ValueError without a shop: forecasts never span tenants.
+    """
+    if shop_id is None:
+        raise ValueError("A shop is required to forecast.")
+    now = now or timezone.now()
+    arrays = sales_arrays(shop_id, _window_start(now, months_back))
+    if not len(arrays[0]):
+        return []
+    return forecast_rows(shop_id, variant_stats(*arrays, months_back, _local(now)))
+
+
+def _timed_variant_stats(*args):
+    """variant_stats() plus its own run time in ms, so pool queueing is not billed to the shop."""
+    clock = perf_counter()
+    stats = variant_stats(*args)
+    return stats, (perf_counter() - clock) * 1000
+
+
+def _elapsed_ms(clock):
+    return (perf_counter() - clock) * 1000
+
+
+def forecast_shops(shop_ids, months_back=2, workers=None):
+    """
+    Forecast several shops, yielding (shop_id, rows, started_at, duration_ms,
+    error) as each finishes. duration_ms counts only the shop's own work
+    (reading its sales, the statistics, building rows), not time spent
+    waiting for a worker. A shop that fails is yielded with rows None and the
+    exception, and the others carry on.
+
+    Sales are read here and the per-shop statistics run in a pool of
+    FORECAST_WORKERS processes (default: one per core), with at most two
+    shops per worker in flight so reads overlap the computation; with one
+    worker or one shop everything runs inline.
+    """
+    shop_ids = list(shop_ids)
+    workers = workers or getattr(settings, "FORECAST_WORKERS", None) or os.cpu_count() or 1
+
+    if workers <= 1 or len(shop_ids) <= 1:
+        for shop_id in shop_ids:
+            started_at, clock = timezone.now(), perf_counter()
+            try:
+                rows = forecast(shop_id, months_back, now=started_at)
+            except Exception as e:
+                yield shop_id, None, started_at, int(_elapsed_ms(clock)), e
+                continue
+            yield shop_id, rows, started_at, int(_elapsed_ms(clock)), None
+        return
+
+    pending = {}
+
+    def finish(future):
+        shop_id, started_at, spent_ms = pending.pop(future)
+        clock = perf_counter()
+        try:
+            stats, compute_ms = future.result()
+            rows = forecast_rows(shop_id, stats)
+        except Exception as e:
+            return shop_id, None, started_at, int(spent_ms + _elapsed_ms(clock)), e
+        return shop_id, rows, started_at, int(spent_ms + compute_ms + _elapsed_ms(clock)), None
+
+    # spawn, not fork: children must not inherit the parent's database connections
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers, len(shop_ids))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for shop_id in shop_ids:
+            # keep the pool busy without reading every shop's sales up front
+            while len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield finish(future)
+
+            started_at, clock = timezone.now(), perf_counter()
+            try:
+                arrays = sales_arrays(shop_id, _window_start(started_at, months_back))
+            except Exception as e:
+                yield shop_id, None, started_at, int(_elapsed_ms(clock)), e
+                continue
+            if not len(arrays[0]):
+                yield shop_id, [], started_at, int(_elapsed_ms(clock)), None
+                continue
+            future = pool.submit(_timed_variant_stats, *arrays, months_back, _local(started_at))
+            pending[future] = (shop_id, started_at, _elapsed_ms(clock))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield finish(future)
+
+
+# ===========================
+# Purchase suggestions
+# ===========================
+def purchase_orders(run, supplier_id=None):
+    """
+    Draft purchase orders from a ForecastRun, grouped by the product's
+    supplier; products without a supplier come last under supplier None.
+
+    A pack variant's suggestion is already a pack count and its
+    purchase_price is per pack, so it is ordered as is. A single variant's
+    suggestion is in units: it is rounded up to whole packs of its smallest
+    linked pack (linked_packs), if any, and costed per unit. One query.
+    """
+    from .models import ProductVariant
+
+    lines = run.forecasts.filter(suggested_restock__gt=0)
+    if supplier_id is not None:
+        lines = lines.filter(variant__product__supplier_id=supplier_id)
+    linked_pack_size = ProductVariant.objects.filter(
+        linked_single_variant=OuterRef("variant_id"), is_pack=True,
+    ).order_by("units_per_pack").values("units_per_pack")[:1]
+    rows = lines.annotate(linked_pack_size=Subquery(linked_pack_size)).values(
+        "variant_id", "suggested_restock", "linked_pack_size",
+        "variant__is_pack", "variant__units_per_pack", "variant__purchase_price", "variant__barcode",
+        "variant__product__name", "variant__color__name", "variant__size__name",
+        "variant__product__supplier_id", "variant__product__supplier__name",
+    ).order_by(
+        F("variant__product__supplier__name").asc(nulls_last=True),
+        "variant__product__supplier_id", "variant__product__name", "variant_id",
+    )
+
+    orders = []
+    for supplier, group in groupby(rows, key=lambda r: (r["variant__product__supplier_id"], r["variant__product__supplier__name"])):
+        order_lines = []
+        for r in group:
+            price = r["variant__purchase_price"] or Decimal("0.00")
+            if r["variant__is_pack"]:
+                pack = r["variant__units_per_pack"] or 1
+                packs = r["suggested_restock"]
+                pack_cost = price
+            else:
+                pack = r["linked_pack_size"] or 1
+                packs = -(-r["suggested_restock"] // pack)
+                pack_cost = price * pack
+            order_lines.append({
+                "variant_id": r["variant_id"],
+                "product_name": r["variant__product__name"],
+                "color_name": r["variant__color__name"],
+                "size_name": r["variant__size__name"],
+                "barcode": r["variant__barcode"],
+                "is_pack": r["variant__is_pack"],
+                "suggested_restock": r["suggested_restock"],
+                "units_per_pack": pack,
+                "packs": packs,
+                "order_units": packs * pack,
+                "pack_cost": f"{pack_cost:.2f}",
+                "line_cost": f"{packs * pack_cost:.2f}",
+            })
+        orders.append({
+            "supplier_id": supplier[0],
+            "supplier_name": supplier[1],
+            "line_count": len(order_lines),
+            "total_units": sum(line["order_units"] for line in order_lines),
+            "estimated_cost": f"{sum((Decimal(line['line_cost']) for line in order_lines), Decimal('0.00')):.2f}",
+            "lines": order_lines,
+        })
+    return orders
@@ -0,0 +1,169 @@
+"""
+In-process, DB-backed job queue for work that must not hold checkout locks.
+
+    enqueue("customer.recalculate_debt", customer_id=5)
+
+writes a BackgroundJob row in the caller's transaction and, once that
+transaction commits, runs the handler on a small thread pool. Handlers
+registered with a `pool` (e.g. long report builds) get their own executor so
+they cannot starve the checkout follow-ups. Jobs left behind by a crash or a
+failing handler are retried by `manage.py run_jobs`; a RUNNING job only counts
+as left behind once its handler's `stale_after` has passed.
+"""
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# A RUNNING job untouched for this long was orphaned by a crashed worker; the
+# default for short handlers, long ones register their own stale_after
+STALE_AFTER = timedelta(minutes=10)
+
+_handlers = {}
+_pools = {}
+_stale_after = {}
+_executors = {}
+
+
+def register(name, pool="default", stale_after=STALE_AFTER):
+    """
+    Decorator registering a job handler under `name`, run on the executor
+    `pool`. A RUNNING job is reclaimed once untouched for `stale_after`, which
+    must exceed the handler's longest run or it will run twice at once.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        _pools[name] = pool
+        _stale_after[name] = stale_after
+        return func
+    return decorator
+
+
+def enqueue(name, **payload):
+    """Persist a job and dispatch it after the current transaction commits."""
+    from .models import BackgroundJob
+
+    if name not in _handlers:
+        raise ValueError(f"Unknown job: {name}")
+    job = BackgroundJob.objects.create(name=name, payload=payload)
+    transaction.on_commit(lambda: _dispatch(job.pk, _pools[name]))
+    return job
+
+
+def _executor(pool):
+    if pool not in _executors:
+        sizes = getattr(settings, "JOB_QUEUE_POOLS", {})
+        _executors[pool] = ThreadPoolExecutor(
+            max_workers=sizes.get(pool, getattr(settings, "JOB_QUEUE_WORKERS", 2)),
+            thread_name_prefix=f"pos-jobs-{pool}",
+        )
+    return _executors[pool]
+
+
+def _dispatch(job_id, pool="default"):
+    if getattr(settings, "JOB_QUEUE_EAGER", False):
+        run_job(job_id)
+        return
+
+    _executor(pool).submit(_run_in_thread, job_id)
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        connection.close()
+
+
+def _runnable():
+    now = timezone.now()
+    names_by_window = {}
+    for name, window in _stale_after.items():
+        names_by_window.setdefault(window, []).append(name)
+    stale = reduce(or_, (
+        Q(name__in=names, updated_at__lt=now - window)
+        for window, names in names_by_window.items()
+    ))
+    return (
+        Q(status__in=["PENDING", "FAILED"]) | (Q(status="RUNNING") & stale)
+    ) & Q(attempts__lt=MAX_ATTEMPTS)
+
+
+def run_job(job_id):
+    """Claim and run one job. Returns True when it ran successfully."""
+    from .models import BackgroundJob
+
+    claimed = BackgroundJob.objects.filter(_runnable(), pk=job_id).update(
+        status="RUNNING", updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = BackgroundJob.objects.get(pk=job_id)
+    try:
+        with transaction.atomic():
+            _handlers[job.name](**job.payload)
+    except Exception:
+        logger.exception("Job %s failed", job)
+        BackgroundJob.objects.filter(pk=job_id).update(
+            status="FAILED",
+            attempts=job.attempts + 1,
+            last_error=traceback.format_exc(),
+            updated_at=timezone.now(),
+        )
+        return False
+
+    job.delete()
+    return True
+
+
+def run_pending(limit=500):
+    """Run queued and retryable jobs oldest-first. Returns (succeeded, failed)."""
+    from .models import BackgroundJob
+
+    ids = list(
+        BackgroundJob.objects.filter(_runnable())
+        .values_list("pk", flat=True)[:limit]
+    )
+    succeeded = sum(1 for job_id in ids if run_job(job_id))
+    return succeeded, len(ids) - succeeded
+
+
+# ===========================
+# Handlers
+# ===========================
+@register("customer.recalculate_debt")
+def recalculate_customer_debt(customer_id):
+    from .models import Customer
+
+    customer = Customer.objects.filter(pk=customer_id).first()
+    if customer:
+        customer.recalculate_debt()
+
+
+@register("sales.rollup")
+def refresh_sales_rollup(shop_id, day, variant_ids=None):
+    from datetime import date
+    from .reports import refresh_rollup
+
+    refresh_rollup(shop_id, date.fromisoformat(day), variant_ids)
+
+
+# a large shop's report can take well over the default window to build
+@register("report.build", pool="reports", stale_after=timedelta(hours=2))
+def build_report(report_id):
+    from .models import ReportJob
+
+    report = ReportJob.objects.filter(pk=report_id, status="PENDING").first()
+    if report:
+        report.run()
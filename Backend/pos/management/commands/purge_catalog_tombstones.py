@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pos.models import CatalogTombstone
+
+
+class Command(BaseCommand):
+    help = "Delete catalog sync tombstones older than CATALOG_TOMBSTONE_TTL. Schedule via cron."
+
+    def handle(self, *args, **options):
+        deleted = CatalogTombstone.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} catalog tombstone(s)."))
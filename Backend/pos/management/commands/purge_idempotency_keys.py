@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pos.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete checkout idempotency keys whose TTL has expired. Schedule via cron."
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyKey.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired idempotency key(s)."))
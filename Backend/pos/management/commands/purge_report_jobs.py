@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pos.models import ReportJob
+
+
+class Command(BaseCommand):
+    help = "Delete background report jobs and their stored payloads older than REPORT_JOB_TTL. Schedule via cron."
+
+    def handle(self, *args, **options):
+        deleted = ReportJob.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} report job(s)."))
@@ -0,0 +1,51 @@
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from pos.models import Order, WasteProduct
+from pos.reports import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild DailySalesRollup from orders and waste, one month per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop", type=int, help="Only rebuild this shop id.")
+        parser.add_argument("--start", help="First day (YYYY-MM-DD). Defaults to the oldest order or waste record.")
+        parser.add_argument("--end", help="Last day (YYYY-MM-DD). Defaults to today.")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else None
+            end = date.fromisoformat(options["end"]) if options["end"] else timezone.localdate()
+        except ValueError:
+            raise CommandError("Dates must be YYYY-MM-DD.")
+
+        if start is None:
+            orders, wastes = Order.objects.all(), WasteProduct.objects.all()
+            if options["shop"]:
+                orders, wastes = orders.filter(shop_id=options["shop"]), wastes.filter(shop_id=options["shop"])
+            oldest = [
+                timezone.localdate(moment)
+                for moment in (
+                    orders.aggregate(first=Min("created_at"))["first"],
+                    wastes.aggregate(first=Min("recorded_at"))["first"],
+                )
+                if moment
+            ]
+            if not oldest:
+                self.stdout.write("Nothing to roll up.")
+                return
+            start = min(oldest)
+
+        total = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + relativedelta(months=1) - relativedelta(days=1), end)
+            total += rebuild_rollup(chunk_start, chunk_end, shop_id=options["shop"])
+            chunk_start = chunk_end + relativedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} rollup row(s) for {start} to {end}."))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from pos.managers import refresh_low_stock
+from pos.models import Product, ProductVariant
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Repair drift between Product.total_stock and the sum of its variants' stock in bulk, "
+        "and rebuild the low-stock watchlist."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shop", type=int, help="Only reconcile products of this shop id.")
+        parser.add_argument("--dry-run", action="store_true", help="Report drifted products without fixing them.")
+
+    def handle(self, *args, **options):
+        variant_sum = Coalesce(
+            Subquery(
+                ProductVariant.objects.filter(product=OuterRef("pk"))
+                .values("product")
+                .annotate(total=Sum("stock_quantity"))
+                .values("total"),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+        products = Product.objects.all()
+        if options["shop"]:
+            products = products.filter(shop_id=options["shop"])
+
+        drifted = products.annotate(actual=variant_sum).exclude(total_stock=F("actual"))
+        drifted_ids = list(drifted.values_list("pk", flat=True))
+
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted_ids)} product(s) out of sync.")
+            return
+
+        # UPDATE ... SET total_stock = (SELECT SUM(...)) over the drifted rows, in batches
+        fixed = 0
+        for start in range(0, len(drifted_ids), BATCH_SIZE):
+            batch = drifted_ids[start:start + BATCH_SIZE]
+            fixed += Product.objects.filter(pk__in=batch).update(total_stock=variant_sum)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled total_stock on {fixed} product(s)."))
+
+        variants = ProductVariant.objects.all()
+        if options["shop"]:
+            variants = variants.filter(product__shop_id=options["shop"])
+        refresh_low_stock(variants)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the low-stock watchlist."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pos.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = "Run queued and failed background jobs (rollups left behind by crashes or errors)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=500, help="Maximum jobs to run in this pass.")
+
+    def handle(self, *args, **options):
+        succeeded, failed = run_pending(limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Ran {succeeded} job(s), {failed} failed."))
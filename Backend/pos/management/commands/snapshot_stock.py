@@ -0,0 +1,25 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pos.models import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = "Write per-variant closing stock snapshots for a day (default: yesterday). Schedule nightly via cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Day to snapshot (YYYY-MM-DD). Defaults to yesterday.")
+        parser.add_argument("--shop", type=int, help="Only snapshot this shop id.")
+
+    def handle(self, *args, **options):
+        if options["date"]:
+            try:
+                day = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError("Invalid --date, expected YYYY-MM-DD.")
+        else:
+            day = date.today() - timedelta(days=1)
+
+        written = StockSnapshot.take(day, shop_id=options["shop"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} stock snapshot(s) for {day}."))
@@ -48,4 +48,403 @@ class EmployeeManager(models.Manager):
 
         calculated_bonus = min(positive_kpi_count * BONUS_PER_POSITIVE_KPI, MAX_BONUS)
 
-        return calculated_bonus
\ No newline at end of file
+        return calculated_bonus
+
+# ===========================
+# ProductVariant stock engine
+# ===========================
+from collections import defaultdict
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from .scan import discard_on_commit
+
+# Max variants touched by a single conditional UPDATE (keeps the WHERE/CASE small)
+STOCK_UPDATE_BATCH = 200
+
+# Variant fields a product payload may not set directly
+PROTECTED_VARIANT_FIELDS = {"id", "product", "shop", "created_at", "updated_at"}
+
+
+def _delta_case(pairs):
+    """CASE pk WHEN .. THEN delta .. END for [(pk, delta), ...]."""
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in pairs],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def add_total_stock(product_deltas):
+    """Apply {product_id: signed delta} to Product.total_stock in set-based UPDATEs."""
+    from .models import Product
+
+    items = [(pk, d) for pk, d in product_deltas.items() if pk and d]
+    now = timezone.now()
+    for start in range(0, len(items), STOCK_UPDATE_BATCH):
+        chunk = items[start:start + STOCK_UPDATE_BATCH]
+        Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            total_stock=F("total_stock") + _delta_case(chunk),
+            updated_at=now,
+        )
+
+
+def record_movements(deltas, variants, reason, reference=None):
+    """Append one StockMovement per {variant_id: delta} in a single bulk insert."""
+    from .models import StockMovement
+
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            shop_id=variants[pk].product.shop_id,
+            variant_id=pk,
+            delta=delta,
+            reason=reason,
+            reference=reference,
+            unit_cost=variants[pk].purchase_price,
+        )
+        for pk, delta in deltas.items() if delta
+    ])
+
+
+def mark_low_stock(levels):
+    """
+    Apply {variant_id: (shop_id, is_low)} to the low-stock watchlist:
+    newly low variants are inserted, recovered ones deleted, one query each.
+    """
+    from .models import LowStockEntry
+
+    recovered = [pk for pk, (_, is_low) in levels.items() if not is_low]
+    if recovered:
+        LowStockEntry.objects.filter(variant_id__in=recovered).delete()
+    LowStockEntry.objects.bulk_create(
+        [LowStockEntry(shop_id=shop_id, variant_id=pk) for pk, (shop_id, is_low) in levels.items() if is_low],
+        ignore_conflicts=True,
+    )
+
+
+def refresh_low_stock(variants):
+    """Rebuild watchlist membership for a ProductVariant queryset from the stored stock."""
+    from .models import LowStockEntry
+
+    low = variants.filter(stock_quantity__lte=F("low_stock_threshold"))
+    LowStockEntry.objects.filter(variant__in=variants).exclude(variant__in=low).delete()
+    LowStockEntry.objects.bulk_create(
+        [LowStockEntry(shop_id=shop_id, variant_id=pk) for pk, shop_id in low.values_list("pk", "product__shop_id")],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+
+
+class ProductVariantManager(models.Manager):
+    """Set-based stock mutations, so a whole basket costs a constant number of queries."""
+
+    def lock_for_stock(self, variants):
+        """
+        Lock the given variants plus the linked single variant of every pack
+        with one ordered SELECT ... FOR UPDATE. Accepts ids or instances and
+        returns {id: locked_variant} with product/color/size already loaded.
+        """
+        pending = set()
+        for v in variants:
+            pending.add(getattr(v, "pk", v))
+            linked_id = getattr(v, "linked_single_variant_id", None)
+            if linked_id:
+                pending.add(linked_id)
+
+        locked = {}
+        while pending:
+            rows = (
+                self.select_for_update(of=("self",))
+                .select_related("product", "color", "size")
+                .filter(pk__in=pending)
+                .order_by("pk")
+            )
+            for row in rows:
+                locked[row.pk] = row
+            # A pack may have been re-linked since the caller read it
+            pending = {
+                row.linked_single_variant_id
+                for row in locked.values()
+                if row.is_pack and row.linked_single_variant_id
+            } - locked.keys()
+        return locked
+
+    @transaction.atomic
+    def apply_stock_deltas(self, deltas, variants=None, reason="ADJUSTMENT", reference=None):
+        """
+        Apply {variant_id: signed delta} as conditional set-based UPDATEs, carry
+        the same deltas onto Product.total_stock with F() expressions and append
+        one StockMovement per variant in a single bulk insert. Variants whose
+        stock crosses their low-stock threshold are moved on or off the watchlist.
+        A decrement only matches while the row still holds enough stock;
+        raises ValueError if any row did not match.
+        variants ({variant_id: variant with product loaded, stock as before the
+        deltas}) saves a lookup when the caller has them.
+        """
+        deltas = {pk: d for pk, d in deltas.items() if d}
+        if not deltas:
+            return deltas
+        if variants is None:
+            variants = self.select_related("product").in_bulk(deltas)
+        items = list(deltas.items())
+        now = timezone.now()
+
+        for start in range(0, len(items), STOCK_UPDATE_BATCH):
+            chunk = items[start:start + STOCK_UPDATE_BATCH]
+            guard = models.Q()
+            for pk, delta in chunk:
+                guard |= models.Q(pk=pk, stock_quantity__gte=-delta) if delta < 0 else models.Q(pk=pk)
+
+            updated = self.filter(guard).update(
+                stock_quantity=F("stock_quantity") + _delta_case(chunk),
+                updated_at=now,
+            )
+            if updated != len(chunk):
+                raise ValueError("Not enough stock: variants changed while updating stock")
+
+        product_deltas = defaultdict(int)
+        crossed = {}
+        for pk, delta in deltas.items():
+            variant = variants[pk]
+            product_deltas[variant.product_id] += delta
+            was_low = variant.stock_quantity <= variant.low_stock_threshold
+            is_low = variant.stock_quantity + delta <= variant.low_stock_threshold
+            if was_low != is_low:
+                crossed[pk] = (variant.product.shop_id, is_low)
+        add_total_stock(product_deltas)
+        record_movements(deltas, variants, reason, reference)
+        if crossed:
+            mark_low_stock(crossed)
+        discard_on_commit(variant_ids=deltas)
+
+        return deltas
+
+    @transaction.atomic
+    def reduce_stock_bulk(self, lines, reason="SALE", reference=None, locked=None):
+        """
+        Reduce stock for [(variant_or_id, quantity), ...] in one pass.
+        Packs also reduce their linked single variant by units_per_pack * quantity.
+        Pass `locked` (from lock_for_stock) when the caller already holds the rows.
+        Returns {id: locked_variant} with stock_quantity already updated.
+        """
+        lines = [(v, int(qty)) for v, qty in lines]
+        for _, qty in lines:
+            if qty <= 0:
+                raise ValueError("Quantity must be positive")
+
+        if locked is None:
+            locked = self.lock_for_stock(v for v, _ in lines)
+
+        deltas = defaultdict(int)
+        linked_ids = set()
+        for v, qty in lines:
+            pk = getattr(v, "pk", v)
+            variant = locked.get(pk)
+            if variant is None:
+                raise self.model.DoesNotExist(f"Variant {pk} does not exist")
+            deltas[pk] -= qty
+            if variant.is_pack and variant.linked_single_variant_id:
+                deltas[variant.linked_single_variant_id] -= qty * variant.units_per_pack
+                linked_ids.add(variant.linked_single_variant_id)
+
+        for pk, delta in deltas.items():
+            if -delta > locked[pk].stock_quantity:
+                if pk in linked_ids:
+                    raise ValueError(f"Not enough single stock for linked variant {pk}")
+                raise ValueError(f"Not enough stock for variant {pk}")
+
+        self.apply_stock_deltas(deltas, locked, reason, reference)
+        for pk, delta in deltas.items():
+            locked[pk].stock_quantity += delta
+            locked[pk]._saved_stock = locked[pk].stock_quantity
+        return locked
+
+    @transaction.atomic
+    def upsert_for_product(self, product, rows, reference=None):
+        """
+        Create or update a product's variants from payload dicts (with "id" for
+        existing ones) in one bulk_create and one bulk_update. Rows are checked
+        in memory against the field validators, the pack rules in
+        ProductVariant.clean and both unique constraints, then total_stock,
+        the low-stock watchlist and the stock journal are brought up to date
+        once. Ids that are not this product's variants are ignored.
+        Raises ValidationError listing every bad row.
+        Returns (created, updated).
+        """
+        from .models import Color, Size
+
+        opts = self.model._meta
+        existing = {v.pk: v for v in self.select_for_update().filter(product=product)}
+        previous_stock = {pk: v.stock_quantity for pk, v in existing.items()}
+        now = timezone.now()
+
+        to_create, to_update, changed_fields, errors = [], [], set(), {}
+        for index, data in enumerate(rows):
+            data = dict(data)
+            variant_id = data.pop("id", None)
+            if variant_id:
+                try:
+                    variant_id = int(variant_id)
+                except (TypeError, ValueError):
+                    errors.setdefault(index, []).append(f"id: '{variant_id}' is not a valid id.")
+                    continue
+                variant = existing.get(variant_id)
+                if variant is None:
+                    continue
+                to_update.append(variant)
+            else:
+                variant = self.model(product=product)
+                to_create.append(variant)
+            variant._row = index
+
+            for key, value in data.items():
+                try:
+                    field = opts.get_field(key)
+                except FieldDoesNotExist:
+                    field = None
+                if field is None or field.name in PROTECTED_VARIANT_FIELDS or not field.concrete:
+                    errors.setdefault(index, []).append(f"Unknown variant field '{key}'.")
+                    continue
+                if field.many_to_one and not hasattr(value, "pk"):
+                    # ids may arrive as strings ("3"); clean_fields skips foreign keys
+                    try:
+                        value = field.target_field.to_python(value) if value not in (None, "") else None
+                    except ValidationError:
+                        errors.setdefault(index, []).append(f"{key}: '{value}' is not a valid id.")
+                        continue
+                    setattr(variant, field.attname, value)
+                else:
+                    setattr(variant, key, value)
+                if variant.pk:
+                    changed_fields.add(field.name)
+
+        variants = to_update + to_create
+        related = [f for f in opts.concrete_fields if f.many_to_one]
+        for variant in variants:
+            try:
+                variant.clean_fields(exclude=[f.name for f in related])
+            except ValidationError as e:
+                errors.setdefault(variant._row, []).extend(
+                    f"{name}: {msg}" for name, msgs in e.message_dict.items() for msg in msgs
+                )
+                continue
+            # Same normalisation as ProductVariant.save
+            if variant.units_per_pack > 1 and not variant.is_pack:
+                variant.is_pack = True
+                if variant.pk:
+                    changed_fields.add("is_pack")
+            variant.shop_id = product.shop_id
+
+        # Foreign keys: one existence query per related table
+        def known(model, attname):
+            ids = {getattr(v, attname) for v in variants if getattr(v, attname) is not None}
+            return set(model.objects.filter(pk__in=ids).values_list("pk", flat=True)) if ids else set()
+
+        colors, sizes = known(Color, "color_id"), known(Size, "size_id")
+        linked_ids = {v.linked_single_variant_id for v in variants if v.linked_single_variant_id}
+        linked = dict(existing)
+        missing = linked_ids - linked.keys()
+        if missing:
+            linked.update(self.in_bulk(missing))
+
+        for variant in variants:
+            problems = []
+            if variant.color_id is not None and variant.color_id not in colors:
+                problems.append(f"Color {variant.color_id} does not exist.")
+            if variant.size_id is not None and variant.size_id not in sizes:
+                problems.append(f"Size {variant.size_id} does not exist.")
+            if variant.linked_single_variant_id:
+                single = linked.get(variant.linked_single_variant_id)
+                if single is None:
+                    problems.append(f"Variant {variant.linked_single_variant_id} does not exist.")
+                elif variant.pk and single.pk == variant.pk:
+                    problems.append("Variant cannot be linked to itself as the single variant.")
+                elif single.product_id != product.pk:
+                    problems.append("linked_single_variant must belong to the same product.")
+                elif single.is_pack:
+                    problems.append("linked_single_variant must NOT be a pack variant.")
+            if problems:
+                errors.setdefault(variant._row, []).extend(problems)
+
+        # Unique constraints, checked against the product's other variants and the rest of the payload
+        final = {pk: v for pk, v in existing.items()}
+        for constraint_fields in (("color_id", "size_id", "is_pack"), ("barcode",)):
+            seen = {}
+            for variant in list(final.values()) + to_create:
+                values = tuple(getattr(variant, f) for f in constraint_fields)
+                if any(value is None for value in values):
+                    continue
+                other = seen.setdefault(values, variant)
+                if other is not variant:
+                    row = getattr(variant, "_row", None)
+                    if row is None:
+                        row = getattr(other, "_row", None)
+                    label = "barcode" if constraint_fields == ("barcode",) else "color/size/pack"
+                    errors.setdefault(row, []).append(f"Another variant of this product has the same {label}.")
+
+        if errors:
+            raise ValidationError({
+                "variants_json": [f"Variant {index + 1}: {' '.join(msgs)}" for index, msgs in sorted(errors.items())]
+            })
+
+        created = self.bulk_create(to_create, batch_size=STOCK_UPDATE_BATCH)
+        if to_update and changed_fields:
+            for variant in to_update:
+                variant.updated_at = now
+            self.bulk_update(to_update, sorted(changed_fields | {"updated_at"}), batch_size=STOCK_UPDATE_BATCH)
+
+        # Derived state, once for the whole payload
+        for variant in variants:
+            variant.product = product
+        record_movements(
+            {v.pk: v.stock_quantity for v in created},
+            {v.pk: v for v in created}, "INITIAL", reference,
+        )
+        record_movements(
+            {v.pk: v.stock_quantity - previous_stock[v.pk] for v in to_update},
+            {v.pk: v for v in to_update}, "ADJUSTMENT", reference,
+        )
+        for variant in variants:
+            variant._saved_stock = variant.stock_quantity
+            variant._saved_low = variant.is_low_stock
+        product.recalculate_total_stock()
+        refresh_low_stock(self.filter(product=product))
+        discard_on_commit(product_id=product.pk)
+        return created, to_update
+
+
+class SupplierQuerySet(models.QuerySet):
+    """Supplier listings with their DebtToPay balances, one grouped query."""
+
+    def with_balances(self, shop_id=None, today=None):
+        """
+        Annotate outstanding_balance, overdue_balance (past due_date) and
+        last_payment_at (latest SupplierPayment). With shop_id, only that
+        shop's debts and payments count.
+        """
+        from django.db.models import DecimalField, OuterRef, Subquery, Sum
+        from django.db.models.functions import Coalesce
+        from .models import SupplierPayment
+
+        today = today or timezone.localdate()
+        open_debt = Q(debts_to_receive__remaining_amount__gt=0) & ~Q(debts_to_receive__status="PAID")
+        payments = SupplierPayment.objects.filter(supplier=OuterRef("pk"))
+        if shop_id is not None:
+            open_debt &= Q(debts_to_receive__shop_id=shop_id)
+            payments = payments.filter(shop_id=shop_id)
+
+        money = DecimalField(max_digits=14, decimal_places=2)
+        zero = Value(0, output_field=money)
+        return self.annotate(
+            outstanding_balance=Coalesce(
+                Sum("debts_to_receive__remaining_amount", filter=open_debt), zero, output_field=money
+            ),
+            overdue_balance=Coalesce(
+                Sum("debts_to_receive__remaining_amount", filter=open_debt & Q(debts_to_receive__due_date__lt=today)),
+                zero,
+                output_field=money,
+            ),
+            # a subquery, so the payments join cannot multiply the debt sums
+            last_payment_at=Subquery(payments.order_by("-created_at").values("created_at")[:1]),
+        )
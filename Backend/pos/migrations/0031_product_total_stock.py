@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_total_stock(apps, schema_editor):
+    Product = apps.get_model("pos", "Product")
+    ProductVariant = apps.get_model("pos", "ProductVariant")
+    Product.objects.update(total_stock=Coalesce(
+        Subquery(
+            ProductVariant.objects.filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("stock_quantity"))
+            .values("total"),
+            output_field=IntegerField(),
+        ),
+        0,
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0030_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_total_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Seed the ledger with each variant's current stock so sums start from a known balance."""
+    ProductVariant = apps.get_model("pos", "ProductVariant")
+    StockMovement = apps.get_model("pos", "StockMovement")
+    now = django.utils.timezone.now()
+    variants = ProductVariant.objects.exclude(stock_quantity=0).values_list(
+        "pk", "product__shop_id", "stock_quantity", "purchase_price"
+    )
+    batch = []
+    for pk, shop_id, quantity, cost in variants.iterator(chunk_size=1000):
+        batch.append(StockMovement(
+            shop_id=shop_id, variant_id=pk, delta=quantity,
+            reason="OPENING", unit_cost=cost, created_at=now,
+        ))
+        if len(batch) >= 1000:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0031_product_total_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('OPENING', 'Opening balance'), ('INITIAL', 'New variant'), ('SALE', 'Sale'), ('WASTE', 'Waste'), ('RESTOCK', 'Restock'), ('ADJUSTMENT', 'Adjustment')], default='ADJUSTMENT', max_length=20)),
+                ('reference', models.CharField(blank=True, help_text='e.g. order:42 or waste:7', max_length=50, null=True)),
+                ('unit_cost', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='pos.shop')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='pos.productvariant')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['shop', 'created_at'], name='pos_stockmo_shop_id_fa9cca_idx'), models.Index(fields=['variant', 'created_at'], name='pos_stockmo_variant_a5f9cc_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='pos.shop')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='pos.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'date'], name='pos_stocksn_shop_id_45dd3d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('variant', 'date'), name='unique_snapshot_per_variant_day')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
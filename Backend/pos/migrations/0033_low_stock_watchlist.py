@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def build_watchlist(apps, schema_editor):
+    ProductVariant = apps.get_model("pos", "ProductVariant")
+    LowStockEntry = apps.get_model("pos", "LowStockEntry")
+    low = ProductVariant.objects.filter(stock_quantity__lte=models.F("low_stock_threshold"))
+    LowStockEntry.objects.bulk_create(
+        [LowStockEntry(shop_id=shop_id, variant_id=pk) for pk, shop_id in low.values_list("pk", "product__shop_id")],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0032_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(default=10, help_text='Listed as low stock at or below this quantity.'),
+        ),
+        migrations.CreateModel(
+            name='LowStockEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(default=django.utils.timezone.now)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_entries', to='pos.shop')),
+                ('variant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='low_stock_entry', to='pos.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'since'], name='pos_lowstoc_shop_id_48dbe5_idx')],
+            },
+        ),
+        migrations.RunPython(build_watchlist, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_product_shop(apps, schema_editor):
+    ProductVariant = apps.get_model("pos", "ProductVariant")
+    Product = apps.get_model("pos", "Product")
+    ProductVariant.objects.update(
+        shop_id=models.Subquery(Product.objects.filter(pk=models.OuterRef("product_id")).values("shop_id")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0033_low_stock_watchlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='shop',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='pos.shop'),
+        ),
+        migrations.RunPython(copy_product_shop, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['shop', 'barcode'], name='pos_product_shop_id_75a174_idx'),
+        ),
+    ]
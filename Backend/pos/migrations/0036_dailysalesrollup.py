@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+from pos.reports import MONEY, line_cogs, line_revenue
+
+
+def build_rollup(apps, schema_editor):
+    """Fill the rollup from every completed sale and waste record, as reports.rebuild_rollup does."""
+    DailySalesRollup = apps.get_model("pos", "DailySalesRollup")
+    OrderItem = apps.get_model("pos", "OrderItem")
+    WasteProduct = apps.get_model("pos", "WasteProduct")
+
+    sales = (
+        OrderItem.objects.filter(order__status='COMPLETED', variant__isnull=False)
+        .annotate(day=TruncDate("order__created_at"))
+        .values("order__shop_id", "day", "variant_id")
+        .annotate(units=Sum("quantity"), revenue=Sum(line_revenue(), output_field=MONEY), cogs=Sum(line_cogs(), output_field=MONEY))
+        .order_by()
+    )
+    waste = (
+        WasteProduct.objects.filter(shop__isnull=False, variant__isnull=False)
+        .annotate(day=TruncDate("recorded_at"))
+        .values("shop_id", "day", "variant_id")
+        .annotate(units=Sum("quantity"), loss=Sum("waste_value"))
+        .order_by()
+    )
+
+    rows = {}
+    for row in sales.iterator(chunk_size=1000):
+        key = (row["order__shop_id"], row["day"], row["variant_id"])
+        rows[key] = DailySalesRollup(
+            shop_id=key[0], date=key[1], variant_id=key[2],
+            units=row["units"], revenue=row["revenue"], cogs=row["cogs"],
+        )
+    for row in waste.iterator(chunk_size=1000):
+        key = (row["shop_id"], row["day"], row["variant_id"])
+        rollup = rows.setdefault(key, DailySalesRollup(shop_id=key[0], date=key[1], variant_id=key[2]))
+        rollup.waste_units = row["units"]
+        rollup.waste_loss = row["loss"] or 0
+    DailySalesRollup.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0035_catalogtombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('waste_units', models.IntegerField(default=0)),
+                ('waste_loss', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='pos.shop')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='pos.productvariant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('shop', 'date', 'variant'), name='unique_rollup_per_shop_day_variant')],
+            },
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
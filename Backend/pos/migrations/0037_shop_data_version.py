@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0036_dailysalesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
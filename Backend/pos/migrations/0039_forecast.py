@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0038_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('months_back', models.PositiveSmallIntegerField(default=2)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('variant_count', models.PositiveIntegerField(default=0)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecast_runs', to='pos.shop')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VariantForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_stock', models.IntegerField(default=0)),
+                ('total_sold', models.PositiveIntegerField(default=0)),
+                ('avg_monthly_sold', models.FloatField(default=0)),
+                ('predicted_demand', models.FloatField(default=0)),
+                ('safety_buffer', models.FloatField(default=0)),
+                ('suggested_restock', models.PositiveIntegerField(default=0)),
+                ('notes', models.JSONField(blank=True, default=list)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='pos.forecastrun')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='pos.productvariant')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='forecastrun',
+            index=models.Index(fields=['shop', '-finished_at'], name='pos_forecas_shop_id_b4ae8c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='variantforecast',
+            index=models.Index(fields=['run', '-total_sold', 'variant'], name='pos_variant_run_id_edb72f_idx'),
+        ),
+    ]
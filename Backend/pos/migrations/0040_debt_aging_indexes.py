@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0039_forecast'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debttobepaid',
+            index=models.Index(fields=['shop', 'status', 'due_date'], name='pos_debttob_shop_id_03676c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debttopay',
+            index=models.Index(fields=['shop', 'status', 'due_date'], name='pos_debttop_shop_id_905210_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0040_debt_aging_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='debttobepaid',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='pos_debttob_custome_b63fce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='pos_order_custome_acf501_idx'),
+        ),
+        migrations.AddField(
+            model_name='customerpayment',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='pos.customer'),
+        ),
+        migrations.AddField(
+            model_name='customerpayment',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customer_payments', to='pos.shop'),
+        ),
+        migrations.AddIndex(
+            model_name='customerpayment',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='pos_custome_custome_656718_idx'),
+        ),
+    ]
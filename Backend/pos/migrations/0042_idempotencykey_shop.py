@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_shop(apps, schema_editor):
+    IdempotencyKey = apps.get_model("pos", "IdempotencyKey")
+    Order = apps.get_model("pos", "Order")
+    IdempotencyKey.objects.filter(order__isnull=False).update(
+        shop=Subquery(Order.objects.filter(pk=OuterRef("order_id")).values("shop_id")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0041_customer_statement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='pos.shop'),
+        ),
+        migrations.RunPython(backfill_shop, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='key',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('shop', 'key'), name='unique_idempotency_key_per_shop'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0042_idempotencykey_shop'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='debttobepaid',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:24
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def backfill_run_date(apps, schema_editor):
+    """Date existing jobs by submission and drop live duplicates left by concurrent submits."""
+    ReportJob = apps.get_model("pos", "ReportJob")
+    ReportJob.objects.update(run_date=TruncDate("created_at"))
+    seen = set()
+    duplicates = []
+    live = ReportJob.objects.filter(status__in=["PENDING", "DONE"]).order_by("status", "-created_at", "-pk")
+    for job in live.only("pk", "shop_id", "start_date", "end_date", "months", "data_version", "run_date"):
+        key = (job.shop_id, job.start_date, job.end_date, job.months, job.data_version, job.run_date)
+        if key in seen:
+            duplicates.append(job.pk)
+        seen.add(key)
+    ReportJob.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0043_sync_sale_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='run_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(backfill_run_date, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reportjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'DONE'])), fields=('shop', 'start_date', 'end_date', 'months', 'data_version', 'run_date'), name='unique_live_report_job'),
+        ),
+    ]
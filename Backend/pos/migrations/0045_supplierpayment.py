@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max, Sum
+
+
+def backfill_supplier_payments(apps, schema_editor):
+    """One payment per supplier and shop for what was paid before payments were recorded, dated at the last paid debt's update."""
+    DebtToPay = apps.get_model("pos", "DebtToPay")
+    SupplierPayment = apps.get_model("pos", "SupplierPayment")
+    paid = (
+        DebtToPay.objects.filter(paid_amount__gt=0)
+        .values("supplier_id", "shop_id")
+        .annotate(amount=Sum("paid_amount"), last=Max("updated_at"))
+        .order_by()
+    )
+    SupplierPayment.objects.bulk_create(
+        [
+            SupplierPayment(supplier_id=row["supplier_id"], shop_id=row["shop_id"], amount=row["amount"], created_at=row["last"])
+            for row in paid.iterator(chunk_size=1000)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0044_reportjob_run_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplierPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplier_payments', to='pos.shop')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='pos.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['supplier', 'shop', '-created_at'], name='pos_supplie_supplie_73ba10_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_supplier_payments, migrations.RunPython.noop),
+    ]
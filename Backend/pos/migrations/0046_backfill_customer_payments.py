@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Case, DecimalField, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_customer_payments(apps, schema_editor):
+    """
+    Record what customers paid before payments were recorded, so statement
+    closing balances agree with total_debt: one payment per customer and shop
+    for the debts' paid_amount not yet covered by a CustomerPayment, dated at
+    the last paid debt's update. An order's debt starts out with the order's
+    upfront payment, which the statement already credits on the order row, so
+    only what was paid beyond it counts.
+    """
+    DebtToBePaid = apps.get_model("pos", "DebtToBePaid")
+    CustomerPayment = apps.get_model("pos", "CustomerPayment")
+    recorded = {
+        (row["customer_id"], row["shop_id"]): row["amount"]
+        for row in CustomerPayment.objects.values("customer_id", "shop_id").annotate(amount=Sum("amount")).order_by()
+    }
+    paid_later = Case(
+        When(order__isnull=False, then=F("paid_amount") - Coalesce(F("order__paid_amount"), Value(Decimal("0.00")))),
+        default=F("paid_amount"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    paid = (
+        DebtToBePaid.objects.annotate(paid_later=paid_later)
+        .filter(paid_later__gt=0)
+        .values("customer_id", "shop_id")
+        .annotate(amount=Sum("paid_later"), last=Max("updated_at"))
+        .order_by()
+    )
+    payments = []
+    for row in paid.iterator(chunk_size=1000):
+        missing = row["amount"] - recorded.get((row["customer_id"], row["shop_id"]), 0)
+        if missing > 0:
+            payments.append(CustomerPayment(
+                customer_id=row["customer_id"], shop_id=row["shop_id"], amount=missing, created_at=row["last"],
+            ))
+    CustomerPayment.objects.bulk_create(payments, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0045_supplierpayment'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_customer_payments, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,12 @@ from django.db import models
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import hashlib
+import json
 class User(AbstractUser):
     class Roles(models.TextChoices):
         SUPER_ADMIN = "SUPER_ADMIN", "Super Admin"
@@ -58,19 +64,29 @@ class Shop(models.Model):
 
     is_active = models.BooleanField(default=True)
     expire_date = models.DateField(blank=True, null=True)
+    # Bumped whenever report inputs change; part of the shop report cache key.
+    # Only ever written by F() updates (reports.bump_report_version), never by save()
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
     def save(self, *args, **kwargs):
         # 👇 Set expire_date only if new shop and not manually set
         if not self.id and not self.expire_date:
             self.expire_date = date.today() + timedelta(days=30)
+        # A stale instance must not write an old data_version back over newer bumps
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = [name for name in update_fields if name != "data_version"]
+        elif not self._state.adding and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != "data_version"
+            ]
         super().save(*args, **kwargs)
     def is_expired(self):
         return self.expire_date and self.expire_date < date.today()
     def __str__(self):
         return f"{self.name} ({'Active' if self.is_active else 'Inactive'})"
     def total_waste_loss(self):
-            agg = self.waste_products.aggregate(
-                total_loss=Sum(F('quantity') * F('variant__purchase_price'), output_field=DecimalField())
-            )
+            # Read from the daily rollup (waste value as recorded)
+            agg = self.sales_rollups.aggregate(total_loss=Sum('waste_loss'))
             return agg['total_loss'] or 0
 
     def total_sales(self):
@@ -80,11 +96,8 @@ class Shop(models.Model):
         return agg['total'] or 0
 
     def total_cogs(self):
-        # Sum of quantity * purchase price for all sold items
-        from pos.models import OrderItem
-        agg = OrderItem.objects.filter(order__shop=self, order__status="COMPLETED").aggregate(
-            total_cogs=Sum(F('quantity') * F('variant__purchase_price'), output_field=DecimalField())
-        )
+        # Sum of quantity * purchase price for all sold items, read from the daily rollup
+        agg = self.sales_rollups.aggregate(total_cogs=Sum('cogs'))
         return agg['total_cogs'] or 0
 
     def total_expenses(self):
@@ -194,6 +207,9 @@ class Size(models.Model):
 # ===========================
 # Supplier
 # ===========================
+from .managers import SupplierQuerySet
+
+
 class Supplier(models.Model):
     shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="suppliers", blank=True, null=True)
     name = models.CharField(max_length=255)
@@ -201,11 +217,77 @@ class Supplier(models.Model):
     email = models.EmailField(blank=True, null=True)
     address = models.TextField(blank=True, null=True)
 
+    objects = SupplierQuerySet.as_manager()
+
     class Meta:
         unique_together = ("shop", "name")
 
     def __str__(self):
         return f"{self.name} ({self.shop.name})"
+
+    def apply_payment(self, amount, shop_id=None):
+        """
+        Allocate a payment to the open DebtToPay rows oldest first. The rows are
+        locked (so concurrent payments queue instead of double-allocating),
+        allocated in memory and written with one bulk_update. With shop_id only
+        that shop's debts are paid. The applied amount is recorded as one
+        SupplierPayment per shop paid. Returns (allocations, unallocated), one
+        allocation dict per debt touched.
+        """
+        amount = Decimal(amount)
+        if amount <= 0:
+            raise ValueError("Payment amount must be positive.")
+
+        debts = self.debts_to_receive.filter(remaining_amount__gt=0)
+        if shop_id is not None:
+            debts = debts.filter(shop_id=shop_id)
+
+        with transaction.atomic():
+            remaining = amount
+            now = timezone.now()
+            allocations, changed, paid_per_shop = [], [], {}
+            for debt in debts.select_for_update().order_by("created_at", "id"):
+                if remaining <= 0:
+                    break
+                applied = min(remaining, debt.remaining_amount)
+                remaining -= applied
+                debt.paid_amount = (debt.paid_amount or Decimal("0.00")) + applied
+                debt.remaining_amount -= applied
+                debt.status = "PAID" if debt.remaining_amount <= 0 else "PARTIAL"
+                debt.updated_at = now
+                changed.append(debt)
+                paid_per_shop[debt.shop_id] = paid_per_shop.get(debt.shop_id, Decimal("0.00")) + applied
+                allocations.append({
+                    "debt_id": debt.pk,
+                    "applied": applied,
+                    "paid_amount": debt.paid_amount,
+                    "remaining_amount": debt.remaining_amount,
+                    "status": debt.status,
+                })
+            DebtToPay.objects.bulk_update(
+                changed, ["paid_amount", "remaining_amount", "status", "updated_at"], batch_size=500
+            )
+            SupplierPayment.objects.bulk_create([
+                SupplierPayment(shop_id=shop, supplier=self, amount=paid, created_at=now)
+                for shop, paid in paid_per_shop.items()
+            ])
+        return allocations, remaining
+
+
+class SupplierPayment(models.Model):
+    """A payment applied to a supplier's debts; last_payment_at comes from these."""
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="supplier_payments")
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name="payments")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["supplier", "shop", "-created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.shop_id} paid {self.supplier_id} {self.amount}"
 class DebtToPay(models.Model):
     shop = models.ForeignKey("Shop", on_delete=models.CASCADE)
     supplier = models.ForeignKey("Supplier", on_delete=models.CASCADE)
@@ -220,9 +302,11 @@ class DebtToPay(models.Model):
 # ===========================
 # Product
 # ===========================
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.core.validators import MinValueValidator
 from django.utils.timezone import now
+from .managers import ProductVariantManager
+from .reports import schedule_rollup
 
 class Product(models.Model):
     shop = models.ForeignKey(
@@ -242,6 +326,8 @@ class Product(models.Model):
     supplier = models.ForeignKey("Supplier", on_delete=models.SET_NULL, null=True, blank=True)
     is_active = models.BooleanField(default=True)
     image = models.ImageField(upload_to="product_images/", null=True, blank=True)
+    # Denormalized SUM(variants.stock_quantity), kept in step with F() deltas; see reconcile_stock
+    total_stock = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -250,17 +336,19 @@ class Product(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["shop", "name"]),
+            models.Index(fields=["shop", "updated_at"]),
         ]
 
     def __str__(self):
         shop_name = getattr(self.shop, "name", None)
         return f"{self.name} ({shop_name})" if shop_name else self.name
 
-    # Convenience aggregated properties (read-only) — do not save to DB
-    @property
-    def total_stock(self) -> int:
-        return self.variants.aggregate(total=models.Sum("stock_quantity"))["total"] or 0
+    def recalculate_total_stock(self):
+        """Re-sync total_stock from the variants (repairs drift)."""
+        self.total_stock = self.variants.aggregate(total=models.Sum("stock_quantity"))["total"] or 0
+        self.save(update_fields=["total_stock", "updated_at"])
 
+    # Convenience aggregated properties (read-only) — do not save to DB
     @property
     def min_sale_price(self) -> Decimal:
         """Lowest effective_price among variants (useful for UI)."""
@@ -269,10 +357,13 @@ class Product(models.Model):
 
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="variants")
+    # Copied from product.shop on save so scans can use the (shop, barcode) index
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="variants", null=True, blank=True, editable=False)
     color = models.ForeignKey("Color", on_delete=models.SET_NULL, null=True, blank=True)
     size = models.ForeignKey("Size", on_delete=models.SET_NULL, null=True, blank=True)
     barcode = models.CharField(max_length=50, null=True, blank=True)  # uniqueness handled by constraint below
     stock_quantity = models.PositiveIntegerField(default=0)
+    low_stock_threshold = models.PositiveIntegerField(default=10, help_text="Listed as low stock at or below this quantity.")
     purchase_price = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)])
     sale_price = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)])
 
@@ -295,6 +386,15 @@ class ProductVariant(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductVariantManager()
+
+    # stock_quantity as last read from / written to the DB, for total_stock deltas
+    _saved_stock = None
+    # low-stock state as loaded, so saves only touch the watchlist when it flips
+    _saved_low = None
+    # (shop_id, barcode) as loaded, so a barcode change also drops the old scan record
+    _saved_scan_key = None
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=["product", "color", "size", "is_pack"], name="unique_variant_per_shape_pack"),
@@ -302,8 +402,18 @@ class ProductVariant(models.Model):
         ]
         indexes = [
             models.Index(fields=["product", "barcode"]),
+            models.Index(fields=["shop", "barcode"]),
+            models.Index(fields=["shop", "updated_at"]),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_stock = instance.__dict__.get("stock_quantity")
+        instance._saved_low = instance.is_low_stock
+        instance._saved_scan_key = (instance.__dict__.get("shop_id"), instance.__dict__.get("barcode"))
+        return instance
+
     def clean(self):
         # Prevent linking to self
         if self.linked_single_variant and self.linked_single_variant_id == self.id:
@@ -324,10 +434,20 @@ class ProductVariant(models.Model):
         # Some automatic normalization: set is_pack according to units_per_pack or explicit flag
         if self.units_per_pack > 1:
             self.is_pack = True
+        if self.product_id:
+            self.shop_id = self.product.shop_id
         # Call clean before saving to ensure invariants
         self.full_clean()
         return super().save(*args, **kwargs)
 
+    @property
+    def is_low_stock(self):
+        stock = self.__dict__.get("stock_quantity")
+        threshold = self.__dict__.get("low_stock_threshold")
+        if stock is None or threshold is None:
+            return None
+        return stock <= threshold
+
     @property
     def effective_price(self):
         """Return the correct sale price depending on pack/single preference."""
@@ -335,40 +455,208 @@ class ProductVariant(models.Model):
             return self.pack_sale_price if self.pack_sale_price is not None else self.sale_price
         return self.single_sale_price if self.single_sale_price is not None else self.sale_price
 
-    @transaction.atomic
     def reduce_stock(self, quantity: int):
         """
-        Reduce stock safely with select_for_update to avoid race conditions.
+        Reduce stock under a row lock via the set-based stock engine.
         If this is a pack, also reduce linked_single_variant by units_per_pack * quantity.
         """
+        locked = ProductVariant.objects.reduce_stock_bulk([(self, quantity)])
+        self.stock_quantity = locked[self.pk].stock_quantity
+        self._saved_stock = self.stock_quantity
+
+    def increase_stock(self, quantity: int):
+        """Add stock under a row lock, so the watchlist and journal see the current balance."""
         if quantity <= 0:
             raise ValueError("Quantity must be positive")
+        with transaction.atomic():
+            locked = ProductVariant.objects.lock_for_stock([self.pk])
+            if self.pk not in locked:
+                raise ProductVariant.DoesNotExist(f"Variant {self.pk} does not exist")
+            ProductVariant.objects.apply_stock_deltas({self.pk: quantity}, locked, reason="RESTOCK")
+            locked[self.pk].stock_quantity += quantity
+        self.stock_quantity = locked[self.pk].stock_quantity
+        self._saved_stock = self.stock_quantity
+# ===========================
+# Stock ledger
+# ===========================
+class StockMovement(models.Model):
+    """
+    Append-only journal of every stock change. Written in bulk by the stock
+    engine (pos.managers) and the variant save signal; never updated.
+    """
+    REASON_CHOICES = [
+        ("OPENING", "Opening balance"),
+        ("INITIAL", "New variant"),
+        ("SALE", "Sale"),
+        ("WASTE", "Waste"),
+        ("RESTOCK", "Restock"),
+        ("ADJUSTMENT", "Adjustment"),
+    ]
 
-        # Lock this row
-        locked_self = ProductVariant.objects.select_for_update().get(pk=self.pk)
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="stock_movements", null=True, blank=True)
+    variant = models.ForeignKey("ProductVariant", on_delete=models.SET_NULL, related_name="movements", null=True, blank=True)
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default="ADJUSTMENT")
+    reference = models.CharField(max_length=50, blank=True, null=True, help_text="e.g. order:42 or waste:7")
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
 
-        if quantity > locked_self.stock_quantity:
-            raise ValueError(f"Not enough stock for variant {locked_self.pk}")
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [
+            models.Index(fields=["shop", "created_at"]),
+            models.Index(fields=["variant", "created_at"]),
+        ]
 
-        locked_self.stock_quantity -= quantity
-        locked_self.save(update_fields=["stock_quantity"])
+    def __str__(self):
+        return f"{self.variant_id} {self.delta:+d} ({self.reason})"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Stock movements are append-only.")
+        super().save(*args, **kwargs)
+
+
+def end_of_day(day):
+    """Aware datetime of the midnight that closes `day`."""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+
+class StockSnapshot(models.Model):
+    """Per-variant closing stock for a day; the base for stock-on-date replays."""
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="stock_snapshots", null=True, blank=True)
+    variant = models.ForeignKey("ProductVariant", on_delete=models.CASCADE, related_name="snapshots")
+    date = models.DateField()
+    quantity = models.IntegerField()
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["variant", "date"], name="unique_snapshot_per_variant_day"),
+        ]
+        indexes = [
+            models.Index(fields=["shop", "date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.variant_id} @ {self.date}: {self.quantity}"
+
+    @classmethod
+    def stock_on(cls, day, shop_id=None):
+        """
+        {variant_id: quantity} at the close of `day`: the latest snapshot on or
+        before that day plus the movements recorded after it.
+        """
+        snapshots = cls.objects.filter(date__lte=day)
+        movements = StockMovement.objects.filter(created_at__lt=end_of_day(day), variant__isnull=False)
+        if shop_id is not None:
+            snapshots = snapshots.filter(shop_id=shop_id)
+            movements = movements.filter(shop_id=shop_id)
+
+        base_date = snapshots.aggregate(latest=models.Max("date"))["latest"]
+        levels = {}
+        if base_date:
+            levels = dict(snapshots.filter(date=base_date).values_list("variant_id", "quantity"))
+            movements = movements.filter(created_at__gte=end_of_day(base_date))
+
+        for row in movements.values("variant_id").annotate(total=models.Sum("delta")):
+            levels[row["variant_id"]] = levels.get(row["variant_id"], 0) + row["total"]
+        return levels
+
+    @classmethod
+    def take(cls, day, shop_id=None):
+        """
+        Write closing snapshots for `day` from current stock minus the
+        movements recorded since. Replaces any snapshot already taken for that day.
+        """
+        variants = ProductVariant.objects.all()
+        later = StockMovement.objects.filter(created_at__gte=end_of_day(day), variant__isnull=False)
+        if shop_id is not None:
+            variants = variants.filter(product__shop_id=shop_id)
+            later = later.filter(shop_id=shop_id)
+
+        since = dict(later.values("variant_id").annotate(total=models.Sum("delta")).values_list("variant_id", "total"))
+        rows = [
+            cls(
+                shop_id=shop,
+                variant_id=pk,
+                date=day,
+                quantity=stock - since.get(pk, 0),
+                unit_cost=cost,
+            )
+            for pk, shop, stock, cost in variants.values_list(
+                "pk", "product__shop_id", "stock_quantity", "purchase_price"
+            ).iterator()
+        ]
+
+        with transaction.atomic():
+            existing = cls.objects.filter(date=day)
+            if shop_id is not None:
+                existing = existing.filter(shop_id=shop_id)
+            existing.delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+# ===========================
+# Low stock watchlist
+# ===========================
+class LowStockEntry(models.Model):
+    """
+    One row per variant at or below its low_stock_threshold, kept in step by
+    the stock engine and the variant save signal so reports read a small table.
+    """
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="low_stock_entries", null=True, blank=True)
+    variant = models.OneToOneField("ProductVariant", on_delete=models.CASCADE, related_name="low_stock_entry")
+    since = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "since"]),
+        ]
+
+    def __str__(self):
+        return f"Low stock: {self.variant_id}"
+
+
+# ===========================
+# Catalog sync tombstones
+# ===========================
+class CatalogTombstone(models.Model):
+    """
+    Marks a deleted product or variant so terminals syncing the catalog by
+    updated_at watermark can drop it locally. Kept for CATALOG_TOMBSTONE_TTL.
+    """
+    KIND_CHOICES = [
+        ("product", "Product"),
+        ("variant", "Variant"),
+    ]
+
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="catalog_tombstones", null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "deleted_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted"
+
+    @classmethod
+    def retention_start(cls):
+        """Oldest watermark that can still be served as a delta."""
+        return timezone.now() - getattr(settings, "CATALOG_TOMBSTONE_TTL", timedelta(days=30))
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete tombstones past their TTL. Returns the number of rows removed."""
+        deleted, _ = cls.objects.filter(deleted_at__lt=cls.retention_start()).delete()
+        return deleted
 
-        # If pack, reduce the linked single variant accordingly (also locked)
-        if locked_self.is_pack and locked_self.linked_single_variant_id:
-            linked = ProductVariant.objects.select_for_update().get(pk=locked_self.linked_single_variant_id)
-            total_units = quantity * locked_self.units_per_pack
-            if total_units > linked.stock_quantity:
-                raise ValueError(f"Not enough single stock for linked variant {linked.pk}")
-            linked.stock_quantity -= total_units
-            linked.save(update_fields=["stock_quantity"])
 
-    @transaction.atomic
-    def increase_stock(self, quantity: int):
-        if quantity <= 0:
-            raise ValueError("Quantity must be positive")
-        locked_self = ProductVariant.objects.select_for_update().get(pk=self.pk)
-        locked_self.stock_quantity += quantity
-        locked_self.save(update_fields=["stock_quantity"])
 # ===========================
 # WasteProduct (lost/damaged)
 # ===========================
@@ -396,24 +684,108 @@ class WasteProduct(models.Model):
     size_name = models.CharField(max_length=100, null=True, blank=True)
     waste_value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
-    def save(self, *args, **kwargs):
-        if self.variant:
-            # snapshot color/size names
-            self.color_name = self.variant.color.name if self.variant.color else None
-            self.size_name = self.variant.size.name if self.variant.size else None
+    # quantity/variant as loaded, so edits only move stock by the difference
+    _saved_quantity = 0
+    _saved_variant_id = None
 
-            # check and reduce stock
-            if self.variant.stock_quantity >= self.quantity:
-                self.variant.stock_quantity -= self.quantity
-                self.variant.save()
-            else:
-                raise ValueError(f"Not enough stock to mark as waste for {self.variant}")
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_quantity = instance.__dict__.get("quantity", 0)
+        instance._saved_variant_id = instance.__dict__.get("variant_id")
+        return instance
+
+    def _snapshot(self, variant):
+        # snapshot color/size names and waste value at save time
+        self.color_name = variant.color.name if variant.color else None
+        self.size_name = variant.size.name if variant.size else None
+        if variant.purchase_price:
+            self.waste_value = Decimal(self.quantity) * variant.purchase_price
+
+    @staticmethod
+    def _move_stock(deltas, reference, locked=None):
+        """Apply {variant_id: delta} to the locked variants in one set-based pass."""
+        deltas = {pk: d for pk, d in deltas.items() if pk and d}
+        if locked is None:
+            locked = ProductVariant.objects.lock_for_stock(deltas)
+        for pk, delta in deltas.items():
+            if -delta > locked[pk].stock_quantity:
+                raise ValueError(f"Not enough stock to mark as waste for {locked[pk]}")
+        ProductVariant.objects.apply_stock_deltas(deltas, locked, reason="WASTE", reference=reference)
+        for pk, delta in deltas.items():
+            locked[pk].stock_quantity += delta
+            locked[pk]._saved_stock = locked[pk].stock_quantity
+        return locked
 
-            # snapshot waste value at save time
-            if self.variant.purchase_price:  # <- correct field name
-                self.waste_value = Decimal(self.quantity) * self.variant.purchase_price
+    def save(self, *args, **kwargs):
+        deltas = defaultdict(int)
+        if self._saved_variant_id:
+            deltas[self._saved_variant_id] += self._saved_quantity
+        if self.variant_id:
+            deltas[self.variant_id] -= self.quantity
+
+        with transaction.atomic():
+            locked = ProductVariant.objects.lock_for_stock(
+                {pk for pk, d in deltas.items() if d} | ({self.variant_id} if self.variant_id else set())
+            )
+            if self.variant_id:
+                self.variant = locked[self.variant_id]
+                self._snapshot(self.variant)
+            super().save(*args, **kwargs)
+            self._move_stock(deltas, f"waste:{self.pk}", locked)
+            schedule_rollup(self.shop_id, self.recorded_at, [self._saved_variant_id, self.variant_id])
+
+        self._saved_quantity = self.quantity
+        self._saved_variant_id = self.variant_id
+
+    def delete(self, *args, **kwargs):
+        # Removing a waste record puts its stock back
+        with transaction.atomic():
+            if self._saved_variant_id:
+                self._move_stock({self._saved_variant_id: self._saved_quantity}, reference=f"waste:{self.pk}")
+            schedule_rollup(self.shop_id, self.recorded_at, [self._saved_variant_id])
+            return super().delete(*args, **kwargs)
 
-        super().save(*args, **kwargs)
+    @classmethod
+    @transaction.atomic
+    def record_bulk(cls, shop, lines):
+        """
+        Record many waste lines [(variant_id, quantity, reason), ...] at once:
+        one lock query, one guarded stock UPDATE and one insert per table,
+        however many lines there are. Every variant must belong to `shop`.
+        Raises ValueError if any line cannot be recorded.
+        """
+        if shop is None:
+            raise ValueError("A shop is required to record waste.")
+        deltas = defaultdict(int)
+        for variant_id, quantity, _ in lines:
+            if quantity <= 0:
+                raise ValueError("Quantity must be positive")
+            deltas[variant_id] -= quantity
+
+        locked = ProductVariant.objects.lock_for_stock(deltas)
+        unknown = [
+            pk for pk in deltas
+            if pk not in locked or locked[pk].product.shop_id != shop.pk
+        ]
+        if unknown:
+            raise ValueError(f"Unknown variant(s): {', '.join(map(str, unknown))}")
+
+        wastes = []
+        for variant_id, quantity, reason in lines:
+            waste = cls(shop=shop, variant=locked[variant_id], quantity=quantity, reason=reason)
+            waste._snapshot(waste.variant)
+            wastes.append(waste)
+
+        cls._move_stock(deltas, "waste-bulk", locked)
+        wastes = cls.objects.bulk_create(wastes)
+        for waste in wastes:
+            # bulk_create skips from_db; later edits must only move stock by the difference
+            waste._saved_quantity = waste.quantity
+            waste._saved_variant_id = waste.variant_id
+        if wastes:
+            schedule_rollup(shop.pk, wastes[0].recorded_at, deltas)
+        return wastes
 
     def __str__(self):
         return f"{self.variant} - {self.quantity} wasted ({self.shop.name if self.shop else 'No Shop'})"
@@ -425,7 +797,8 @@ class WasteProduct(models.Model):
 # ========================New Function Debt ==================
 from decimal import Decimal
 from django.db import models
-from django.db.models import Sum, F, DecimalField
+from django.db.models import Sum, F, DecimalField, Value
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
 
@@ -479,6 +852,70 @@ class Customer(models.Model):
 
         self.total_debt = total
         self.save(update_fields=["total_debt"])
+
+    def apply_payment(self, amount):
+        """
+        Allocate a payment to the open debts oldest first (FIFO). The debts are
+        locked and read once, allocated in memory, written with one bulk_update,
+        and total_debt moves by the applied amount in one UPDATE. Returns the
+        amount applied; anything beyond the open balance is not applied.
+        """
+        amount = Decimal(amount)
+        if amount <= 0:
+            raise ValueError("Payment amount must be positive.")
+
+        with transaction.atomic():
+            debts = list(
+                self.debts_to_be_paid.select_for_update()
+                .exclude(status="PAID")
+                .order_by("created_at", "id")
+            )
+            remaining_payment = amount
+            now = timezone.now()
+            changed = []
+            for debt in debts:
+                if remaining_payment <= Decimal("0.00"):
+                    break
+                apply_amount = min(remaining_payment, debt.remaining_amount)
+                debt.paid_amount += apply_amount
+                debt.remaining_amount -= apply_amount
+                remaining_payment -= apply_amount
+                if debt.remaining_amount <= Decimal("0.00"):
+                    debt.status = "PAID"
+                    debt.remaining_amount = Decimal("0.00")
+                else:
+                    debt.status = "PARTIAL"
+                debt.updated_at = now
+                changed.append(debt)
+
+            # bulk_update skips post_save, so no per-debt total_debt recalculation is queued
+            DebtToBePaid.objects.bulk_update(
+                changed, ["paid_amount", "remaining_amount", "status", "updated_at"], batch_size=500
+            )
+            applied = amount - remaining_payment
+            if applied:
+                Customer.objects.filter(pk=self.pk).update(
+                    total_debt=Greatest(F("total_debt") - applied, Value(Decimal("0.00")))
+                )
+                CustomerPayment.objects.create(shop_id=self.shop_id, customer=self, amount=applied)
+            self.total_debt = Customer.objects.values_list("total_debt", flat=True).get(pk=self.pk)
+        return applied
+
+
+class CustomerPayment(models.Model):
+    """A payment applied to a customer's debts; the credit side of the customer statement."""
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="customer_payments")
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="payments")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["customer", "created_at", "id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} paid {self.amount}"
 #         =========================================
 # ======================
 class Order(models.Model):
@@ -487,7 +924,8 @@ class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add: offline sync records the terminal's sale time
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     STATUS_CHOICES = [
         ("PENDING", "Pending"),
@@ -496,6 +934,11 @@ class Order(models.Model):
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Completed")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["customer", "created_at", "id"]),
+        ]
+
     @property
     def debt_amount(self):
         return self.total_price - self.paid_amount
@@ -503,6 +946,177 @@ class Order(models.Model):
     def __str__(self):
         return f"Order #{self.id} - {self.shop.name}"
 
+class IdempotencyKey(models.Model):
+    """
+    Stored response for a client-supplied Idempotency-Key, so a retried
+    checkout replays the original order instead of selling twice.
+    """
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="idempotency_keys", null=True, blank=True)
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="idempotency_keys")
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(default=201)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        # Keys are chosen by clients, so they are only unique within a shop
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "key"], name="unique_idempotency_key_per_shop"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} -> Order #{self.order_id}"
+
+    @staticmethod
+    def hash_payload(data):
+        raw = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @classmethod
+    def default_expiry(cls):
+        ttl = getattr(settings, "IDEMPOTENCY_KEY_TTL", timedelta(hours=24))
+        return timezone.now() + ttl
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete keys past their TTL. Returns the number of rows removed."""
+        deleted, _ = cls.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+class BackgroundJob(models.Model):
+    """
+    Durable post-commit work (debt and report rollups). Rows are written inside
+    the business transaction and handed to pos.jobs once it commits; a job row
+    is deleted when it succeeds.
+    """
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("RUNNING", "Running"),
+        ("FAILED", "Failed"),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class ReportJob(models.Model):
+    """
+    A shop report built off the request thread. The "report.build" job fills
+    `result` once; later downloads of the same shop, range, data_version and
+    run_date reuse the stored payload instead of building it again.
+    """
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("DONE", "Done"),
+        ("FAILED", "Failed"),
+    ]
+
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="report_jobs")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    period = models.CharField(max_length=10, default="custom")
+    start_date = models.DateField()
+    end_date = models.DateField()
+    months = models.PositiveSmallIntegerField(default=6)
+    # Shop.data_version at submit time; a newer version means the inputs have changed since
+    data_version = models.PositiveBigIntegerField(default=0)
+    # "today" for the report: the monthly comparison runs up to this date
+    run_date = models.DateField(default=timezone.localdate)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    result = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["shop", "start_date", "end_date", "data_version"]),
+        ]
+        constraints = [
+            # at most one live job per set of inputs, so concurrent submits share it
+            models.UniqueConstraint(
+                fields=["shop", "start_date", "end_date", "months", "data_version", "run_date"],
+                condition=models.Q(status__in=["PENDING", "DONE"]),
+                name="unique_live_report_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Report {self.shop_id} {self.start_date}..{self.end_date} ({self.status})"
+
+    @classmethod
+    def submit(cls, shop_id, start_date, end_date, months=6, period="custom", user=None):
+        """
+        Return (job, created). A pending or finished job for the same inputs at the
+        shop's current data_version, built today, is reused; otherwise a new one
+        is queued. Concurrent submits meet on unique_live_report_job.
+        """
+        from .jobs import enqueue
+
+        version = Shop.objects.filter(pk=shop_id).values_list("data_version", flat=True).first()
+        if version is None:
+            raise ValueError("Shop not found.")
+        inputs = dict(
+            shop_id=shop_id, start_date=start_date, end_date=end_date, months=months,
+            data_version=version, run_date=timezone.localdate(),
+        )
+        live = cls.objects.filter(status__in=["PENDING", "DONE"], **inputs)
+        existing = live.first()
+        if existing:
+            return existing, False
+
+        try:
+            with transaction.atomic():
+                job = cls.objects.create(requested_by=user, period=period, **inputs)
+                enqueue("report.build", report_id=job.pk)
+        except IntegrityError:
+            existing = live.first()
+            if existing is None:
+                raise
+            return existing, False
+        return job, True
+
+    def run(self):
+        """Build and store the payload. Failures are recorded on the row; resubmitting starts over."""
+        from .reports import build_shop_report
+
+        try:
+            # savepoint, so a failed query does not poison the job's transaction
+            with transaction.atomic():
+                self.result = build_shop_report(
+                    self.shop_id, self.start_date, self.end_date, self.months, today=self.run_date
+                )
+            self.status = "DONE"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.status = "FAILED"
+        self.finished_at = timezone.now()
+        self.save(update_fields=["result", "status", "error", "finished_at"])
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete jobs older than REPORT_JOB_TTL. Returns the number removed."""
+        cutoff = timezone.now() - getattr(settings, "REPORT_JOB_TTL", timedelta(days=7))
+        deleted, _ = cls.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     variant = models.ForeignKey('ProductVariant', on_delete=models.SET_NULL, null=True, blank=True)
@@ -524,6 +1138,124 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 
+# ===========================
+# Reporting rollups
+# ===========================
+class DailySalesRollup(models.Model):
+    """
+    Per (shop, day, variant) totals of completed sales and waste, kept current
+    by the "sales.rollup" job and rebuilt with `manage.py rebuild_sales_rollup`.
+    Revenue uses the report pricing in pos.reports.line_revenue.
+    """
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="sales_rollups")
+    date = models.DateField()
+    variant = models.ForeignKey("ProductVariant", on_delete=models.CASCADE, related_name="sales_rollups")
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cogs = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    waste_units = models.IntegerField(default=0)
+    waste_loss = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "date", "variant"], name="unique_rollup_per_shop_day_variant"),
+        ]
+
+    def __str__(self):
+        return f"{self.shop_id} {self.date} variant {self.variant_id}"
+
+
+class ForecastRun(models.Model):
+    """
+    One computation of pos.forecast for a shop and history window
+    (months_back), written by `manage.py compute_forecasts`. The best-selling
+    endpoint reads the latest finished run for the window it is asked for;
+    older runs of the same shop and window are removed when a new one completes.
+    """
+    shop = models.ForeignKey("Shop", on_delete=models.CASCADE, related_name="forecast_runs")
+    months_back = models.PositiveSmallIntegerField(default=2)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    variant_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "-finished_at"]),
+        ]
+
+    def __str__(self):
+        return f"Forecast {self.shop_id} @ {self.finished_at:%Y-%m-%d %H:%M}"
+
+    @classmethod
+    def latest_for(cls, shop_id, months_back=2):
+        return cls.objects.filter(shop_id=shop_id, months_back=months_back).order_by("-finished_at").first()
+
+    @classmethod
+    def compute(cls, shop_id, months_back=2):
+        """Forecast every variant the shop sold in the window and store it as its latest run."""
+        from time import perf_counter
+        from .forecast import forecast
+
+        started_at = timezone.now()
+        clock = perf_counter()
+        rows = forecast(shop_id, months_back=months_back, now=started_at)
+        return cls.record(shop_id, rows, months_back, started_at, int((perf_counter() - clock) * 1000))
+
+    @classmethod
+    def record(cls, shop_id, rows, months_back, started_at, duration_ms):
+        """Store pos.forecast rows as the shop's latest run for the window, replacing older ones."""
+        with transaction.atomic():
+            run = cls.objects.create(
+                shop_id=shop_id,
+                months_back=months_back,
+                started_at=started_at,
+                finished_at=timezone.now(),
+                duration_ms=duration_ms,
+                variant_count=len(rows),
+            )
+            VariantForecast.objects.bulk_create(
+                [
+                    VariantForecast(
+                        run=run,
+                        variant_id=row["variant_id"],
+                        current_stock=row["current_stock"],
+                        total_sold=row["total_sold"],
+                        avg_monthly_sold=row["avg_monthly_sold"],
+                        predicted_demand=row["predicted_next_month_sales"],
+                        safety_buffer=row["safety_buffer"],
+                        suggested_restock=row["suggested_restock"],
+                        notes=row["notes"],
+                    )
+                    for row in rows
+                ],
+                batch_size=1000,
+            )
+            cls.objects.filter(shop_id=shop_id, months_back=months_back).exclude(pk=run.pk).delete()
+        return run
+
+
+class VariantForecast(models.Model):
+    """A variant's forecast within a ForecastRun, ranked by total_sold."""
+    run = models.ForeignKey(ForecastRun, on_delete=models.CASCADE, related_name="forecasts")
+    variant = models.ForeignKey("ProductVariant", on_delete=models.CASCADE, related_name="forecasts")
+    current_stock = models.IntegerField(default=0)
+    total_sold = models.PositiveIntegerField(default=0)
+    avg_monthly_sold = models.FloatField(default=0)
+    predicted_demand = models.FloatField(default=0)
+    safety_buffer = models.FloatField(default=0)
+    suggested_restock = models.PositiveIntegerField(default=0)
+    notes = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["run", "-total_sold", "variant"]),
+        ]
+
+    def __str__(self):
+        return f"Forecast {self.run_id} variant {self.variant_id}"
+
+
 from django.db import models
 from django.core.validators import MinValueValidator
 # Assuming the following models are available via import or defined earlier:
@@ -804,9 +1536,15 @@ class DebtToBePaid(models.Model):
     due_date = models.DateField(blank=True, null=True)
     note = models.TextField(blank=True, null=True)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "status", "due_date"]),
+            models.Index(fields=["customer", "created_at", "id"]),
+        ]
+
     def __str__(self):
         return f"{self.customer.name} owes {self.amount} ({self.status})"
 
@@ -856,6 +1594,11 @@ class DebtToPay(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["shop", "status", "due_date"]),
+        ]
+
     def __str__(self):
         return f"{self.shop.name} owes {self.supplier.name} {self.remaining_amount} ({self.status})"
 
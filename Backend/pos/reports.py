@@ -0,0 +1,580 @@
+"""
+SQL building blocks and payload builders for the shop reports.
+
+Sales lines are priced the same way ShopReportView always priced them in
+Python: a pack line sells whole packs at pack_sale_price and the remainder
+at the single price; any other line sells every unit at the single price
+(single_sale_price, else sale_price). The expressions below push that into
+the database so a report can group and sum in one query.
+"""
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Mod, NullIf, TruncDate, TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Value(Decimal("0.00"), output_field=MONEY)
+
+
+def _money(expression):
+    return Coalesce(expression, ZERO, output_field=MONEY)
+
+
+def line_revenue(prefix=""):
+    """Revenue of one OrderItem row; prefix reaches it through a relation (e.g. "items__")."""
+    quantity = F(f"{prefix}quantity")
+    variant = f"{prefix}variant__"
+    units = F(f"{variant}units_per_pack")
+    # `or` in the old Python code also skipped a 0 price, hence NullIf
+    single_price = _money(Coalesce(
+        NullIf(F(f"{variant}single_sale_price"), ZERO),
+        NullIf(F(f"{variant}sale_price"), ZERO),
+    ))
+    leftover = Mod(quantity, units)
+    packs = (quantity - leftover) / units
+
+    return Case(
+        When(
+            **{f"{variant}is_pack": True},
+            then=packs * _money(F(f"{variant}pack_sale_price")) + leftover * single_price,
+        ),
+        default=quantity * single_price,
+        output_field=MONEY,
+    )
+
+
+def line_cogs(prefix=""):
+    """Purchase cost of one OrderItem row at the variant's current purchase price."""
+    return F(f"{prefix}quantity") * _money(F(f"{prefix}variant__purchase_price"))
+
+
+def monthly_comparison(shop_id, months=6, today=None):
+    """
+    Revenue and profit for the last `months` calendar months (oldest first),
+    grouped by month over DailySalesRollup in a single query. Months without
+    sales are zero.
+    """
+    from .models import DailySalesRollup
+
+    today = today or date.today()
+    first = today.replace(day=1) - relativedelta(months=months - 1)
+    last = today.replace(day=1) + relativedelta(months=1) - timedelta(days=1)
+
+    rows = (
+        DailySalesRollup.objects.filter(shop_id=shop_id, date__range=(first, last))
+        .annotate(month=TruncMonth("date"))
+        .values("month")
+        .annotate(revenue=Sum("revenue"), cogs=Sum("cogs"))
+        .order_by()
+    )
+    totals = {row["month"]: row for row in rows}
+
+    comparison = []
+    for i in range(months):
+        month_start = first + relativedelta(months=i)
+        row = totals.get(month_start, {})
+        revenue = row.get("revenue") or Decimal("0.00")
+        gross = revenue - (row.get("cogs") or Decimal("0.00"))
+        comparison.append({
+            'month_name': month_start.strftime('%b'),
+            'revenue': float(revenue),
+            'gross_profit': float(gross),
+            'net_profit': float(gross),  # can subtract expenses if needed
+        })
+    return comparison
+
+
+def report_range(period, start=None, end=None, today=None):
+    """(start_date, end_date) of a report period; ValueError says what is wrong with the input."""
+    today = today or date.today()
+    if period == 'daily':
+        return today, today
+    if period == 'monthly':
+        return today.replace(day=1), today
+    if period == 'yearly':
+        return today.replace(month=1, day=1), today
+    if period == 'custom':
+        if not (start and end):
+            raise ValueError("Custom requires start_date and end_date.")
+        try:
+            return date.fromisoformat(start), date.fromisoformat(end)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid date format.") from None
+    raise ValueError("Invalid period.")
+
+
+# ===========================
+# P&L and waste tables
+# ===========================
+PL_COLUMNS = [
+    'product_name', 'sku', 'quantity_sold', 'unit_sale_price', 'unit_cogs',
+    'waste_qty', 'waste_loss', 'revenue', 'cogs', 'profit',
+]
+WASTE_COLUMNS = [
+    'date', 'product_name', 'sku', 'category', 'quantity',
+    'unit_purchase_price', 'loss_value', 'reason',
+]
+
+
+def _product_rollups(shop_id, start_date, end_date):
+    from .models import DailySalesRollup
+
+    return (
+        DailySalesRollup.objects.filter(shop_id=shop_id, date__range=(start_date, end_date))
+        .values('variant__product_id', 'variant__product__name')
+        .annotate(
+            sold=Sum('units'), revenue=Sum('revenue'), cogs=Sum('cogs'),
+            waste_qty=Sum('waste_units'), waste_loss=Sum('waste_loss'),
+        )
+        .order_by('variant__product__name', 'variant__product_id')
+    )
+
+
+def _waste_records(shop_id, start_date, end_date):
+    from .models import WasteProduct
+
+    return WasteProduct.objects.filter(
+        shop_id=shop_id, recorded_at__date__range=(start_date, end_date)
+    ).select_related('variant__product__category').order_by('recorded_at', 'pk')
+
+
+def _pl_row(d):
+    revenue = d['revenue']
+    cogs = d['cogs']
+    waste_loss = d['waste_loss']
+    profit = revenue - (cogs + waste_loss)
+    sold = d['sold']
+    return {
+        'product_name': d['variant__product__name'],
+        'sku': str(d['variant__product_id']),
+        'quantity_sold': sold,
+        'unit_sale_price': f"{(revenue / sold) if sold else 0:.2f}",
+        'unit_cogs': f"{(cogs / sold) if sold else 0:.2f}",
+        'waste_qty': d['waste_qty'],
+        'waste_loss': f"{waste_loss:.2f}",
+        'revenue': f"{revenue:.2f}",
+        'cogs': f"{cogs:.2f}",
+        'profit': f"{profit:.2f}",
+    }
+
+
+def _waste_row(r):
+    variant = getattr(r, 'variant', None)
+    product = getattr(variant, 'product', None) if variant else None
+    unit_price = getattr(product, 'purchase_price', Decimal('0.00')) if product else Decimal('0.00')
+    return {
+        'date': r.recorded_at.date(),
+        'product_name': product.name if product else f"Variant {variant.id}",
+        'sku': product.id if product else f"variant_{variant.id}",
+        'category': getattr(getattr(product, 'category', None), 'name', 'N/A') if product else 'N/A',
+        'quantity': r.quantity,
+        'unit_purchase_price': f"{unit_price:.2f}",
+        'loss_value': f"{r.quantity * unit_price:.2f}",
+        'reason': r.reason,
+    }
+
+
+def pl_rows(shop_id, start_date, end_date, chunk_size=2000):
+    """P&L table rows (lists in PL_COLUMNS order) streamed from a server-side cursor."""
+    for d in _product_rollups(shop_id, start_date, end_date).iterator(chunk_size=chunk_size):
+        row = _pl_row(d)
+        yield [row[column] for column in PL_COLUMNS]
+
+
+def waste_rows(shop_id, start_date, end_date, chunk_size=2000):
+    """Waste table rows (lists in WASTE_COLUMNS order) streamed from a server-side cursor."""
+    for r in _waste_records(shop_id, start_date, end_date).iterator(chunk_size=chunk_size):
+        row = _waste_row(r)
+        yield [row[column] for column in WASTE_COLUMNS]
+
+
+def build_shop_report(shop_id, start_date, end_date, months=6, today=None):
+    """
+    Full P&L payload of ShopReportView for a shop and date range, serialized.
+    The monthly comparison covers the `months` months up to `today`.
+    """
+    from .models import Adjustment, Expense
+    from .serializers import ShopReportSerializer
+
+    # --- FETCH SALES (daily rollup, grouped per product) ---
+    product_rollups = _product_rollups(shop_id, start_date, end_date)
+
+    # --- FETCH WASTE ---
+    waste_records = _waste_records(shop_id, start_date, end_date)
+
+    # --- FETCH EXPENSES & ADJUSTMENTS ---
+    total_expenses = Expense.objects.filter(
+        shop_id=shop_id, date__range=(start_date, end_date)
+    ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
+
+    total_adjustments = Adjustment.objects.filter(
+        shop_id=shop_id, date__range=(start_date, end_date)
+    ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
+
+    # --- TOTALS ---
+    product_rollups = list(product_rollups)
+    total_revenue = sum((d['revenue'] for d in product_rollups), Decimal('0.00'))
+    total_cogs = sum((d['cogs'] for d in product_rollups), Decimal('0.00'))
+    total_waste_loss = sum((d['waste_loss'] for d in product_rollups), Decimal('0.00'))
+    gross_profit = total_revenue - total_cogs - total_waste_loss
+    net_profit = gross_profit - total_expenses + total_adjustments
+
+    # --- PROFIT & PL DETAILS ---
+    pl_details = [_pl_row(d) for d in product_rollups]
+
+    best_selling = sorted(pl_details, key=lambda x: x['quantity_sold'], reverse=True)[:10]
+    low_selling = sorted(pl_details, key=lambda x: x['quantity_sold'])[:10]
+
+    # --- WASTE DETAILS ---
+    waste_details = [_waste_row(r) for r in waste_records]
+
+    # --- MONTHLY COMPARISON (last N months, one grouped query) ---
+    comparison = monthly_comparison(shop_id, months, today)
+
+    # --- RESPONSE ---
+    response_data = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'total_revenue': f"{total_revenue:.2f}",
+        'total_cogs': f"{total_cogs:.2f}",
+        'total_waste_loss': f"{total_waste_loss:.2f}",
+        'total_expenses': f"{total_expenses:.2f}",
+        'total_adjustments': f"{total_adjustments:.2f}",
+        'gross_profit': f"{gross_profit:.2f}",
+        'net_profit': f"{net_profit:.2f}",
+        'waste_details': waste_details,
+        'pl_details': pl_details,
+        'best_selling': best_selling,
+        'low_selling': low_selling,
+        'monthly_comparison': comparison,
+    }
+
+    return ShopReportSerializer(response_data).data
+
+
+# ===========================
+# Daily sales rollup
+# ===========================
+ROLLUP_FIELDS = ["units", "revenue", "cogs", "waste_units", "waste_loss"]
+
+
+def _rollup_rows(items, wastes):
+    """DailySalesRollup objects from OrderItem and WasteProduct querysets, one grouped query each."""
+    from .models import DailySalesRollup
+
+    sales = (
+        items.filter(order__status='COMPLETED', variant__isnull=False)
+        .annotate(day=TruncDate("order__created_at"))
+        .values("order__shop_id", "day", "variant_id")
+        .annotate(units=Sum("quantity"), revenue=Sum(line_revenue(), output_field=MONEY), cogs=Sum(line_cogs(), output_field=MONEY))
+        .order_by()
+    )
+    waste = (
+        wastes.filter(shop__isnull=False, variant__isnull=False)
+        .annotate(day=TruncDate("recorded_at"))
+        .values("shop_id", "day", "variant_id")
+        .annotate(units=Sum("quantity"), loss=Sum("waste_value"))
+        .order_by()
+    )
+
+    rows = {}
+    for row in sales:
+        key = (row["order__shop_id"], row["day"], row["variant_id"])
+        rows[key] = DailySalesRollup(
+            shop_id=key[0], date=key[1], variant_id=key[2],
+            units=row["units"], revenue=row["revenue"], cogs=row["cogs"],
+        )
+    for row in waste:
+        key = (row["shop_id"], row["day"], row["variant_id"])
+        rollup = rows.setdefault(key, DailySalesRollup(shop_id=key[0], date=key[1], variant_id=key[2]))
+        rollup.waste_units = row["units"]
+        rollup.waste_loss = row["loss"] or Decimal("0.00")
+    return list(rows.values())
+
+
+def refresh_rollup(shop_id, day, variant_ids=None):
+    """
+    Recompute one shop-day (optionally only some variants) from the raw rows and
+    upsert it. Idempotent, so a retried job cannot double count.
+    """
+    from .models import DailySalesRollup, OrderItem, WasteProduct
+
+    items = OrderItem.objects.filter(order__shop_id=shop_id, order__created_at__date=day)
+    wastes = WasteProduct.objects.filter(shop_id=shop_id, recorded_at__date=day)
+    existing = DailySalesRollup.objects.filter(shop_id=shop_id, date=day)
+    if variant_ids is not None:
+        items = items.filter(variant_id__in=variant_ids)
+        wastes = wastes.filter(variant_id__in=variant_ids)
+        existing = existing.filter(variant_id__in=variant_ids)
+
+    rows = _rollup_rows(items, wastes)
+    DailySalesRollup.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["shop", "date", "variant"],
+        update_fields=ROLLUP_FIELDS,
+    )
+    existing.exclude(variant_id__in=[r.variant_id for r in rows]).delete()
+    bump_report_version(shop_id)
+    return len(rows)
+
+
+@transaction.atomic
+def rebuild_rollup(start, end, shop_id=None):
+    """Replace the rollup rows dated start..end (inclusive) from the raw rows."""
+    from .models import DailySalesRollup, OrderItem, WasteProduct
+
+    items = OrderItem.objects.filter(order__created_at__date__range=(start, end))
+    wastes = WasteProduct.objects.filter(recorded_at__date__range=(start, end))
+    existing = DailySalesRollup.objects.filter(date__range=(start, end))
+    if shop_id is not None:
+        items = items.filter(order__shop_id=shop_id)
+        wastes = wastes.filter(shop_id=shop_id)
+        existing = existing.filter(shop_id=shop_id)
+
+    existing.delete()
+    rows = DailySalesRollup.objects.bulk_create(_rollup_rows(items, wastes), batch_size=1000)
+    bump_report_version(shop_id)
+    return len(rows)
+
+
+def schedule_rollup(shop_id, when, variant_ids):
+    """Queue a post-commit refresh of the shop-day containing `when` for these variants."""
+    from .jobs import enqueue
+
+    variant_ids = sorted({pk for pk in variant_ids if pk})
+    if not shop_id or not variant_ids:
+        return None
+    day = timezone.localdate(when) if isinstance(when, datetime) else when
+    return enqueue("sales.rollup", shop_id=shop_id, day=day.isoformat(), variant_ids=variant_ids)
+
+
+# ===========================
+# Report cache
+# ===========================
+def bump_report_version(shop_id=None):
+    """Invalidate cached reports of one shop (or every shop) by moving its data_version on."""
+    from .models import Shop
+
+    shops = Shop.objects.all() if shop_id is None else Shop.objects.filter(pk=shop_id)
+    shops.update(data_version=F("data_version") + 1)
+
+
+def report_cache_key(shop_id, *parts):
+    """
+    Cache key for a report of `shop_id` under the shop's current data_version,
+    so any write that bumps the version makes older entries unreachable.
+    """
+    from .models import Shop
+
+    version = Shop.objects.filter(pk=shop_id).values_list("data_version", flat=True).first()
+    return ":".join(str(part) for part in ("shop_report", shop_id, version, *parts))
+
+
+def cached_report(key, compute):
+    """Return the cached payload for `key`, computing and storing it on a miss."""
+    payload = cache.get(key)
+    if payload is None:
+        payload = compute()
+        cache.set(key, payload, getattr(settings, "REPORT_CACHE_TTL", 3600))
+    return payload
+
+
+# ===========================
+# Aging
+# ===========================
+AGING_BUCKETS = ["0_30", "31_60", "61_90", "90_plus"]
+
+
+def aging(side, shop_id=None, today=None):
+    """
+    Outstanding remaining_amount per customer ("receivables", DebtToBePaid) or
+    supplier ("payables", DebtToPay), bucketed by days past due_date (created_at
+    when there is none) with conditional aggregation in one grouped query.
+    Debts not yet due count as 0-30.
+    """
+    from .models import DebtToBePaid, DebtToPay
+
+    if side == "receivables":
+        model, party = DebtToBePaid, "customer"
+    elif side == "payables":
+        model, party = DebtToPay, "supplier"
+    else:
+        raise ValueError("side must be receivables or payables.")
+
+    today = today or timezone.localdate()
+    debts = model.objects.filter(remaining_amount__gt=0).exclude(status="PAID")
+    if shop_id is not None:
+        debts = debts.filter(shop_id=shop_id)
+
+    # bucket edges as dates, so the comparisons work on every backend
+    edges = {days: today - timedelta(days=days) for days in (30, 60, 90)}
+    buckets = {
+        "0_30": Q(reference__gte=edges[30]),
+        "31_60": Q(reference__lt=edges[30], reference__gte=edges[60]),
+        "61_90": Q(reference__lt=edges[60], reference__gte=edges[90]),
+        "90_plus": Q(reference__lt=edges[90]),
+    }
+    rows = (
+        debts.annotate(reference=Coalesce("due_date", TruncDate("created_at")))
+        .values(f"{party}_id", f"{party}__name")
+        .annotate(**{
+            f"bucket_{name}": _money(Sum("remaining_amount", filter=condition))
+            for name, condition in buckets.items()
+        }, total=_money(Sum("remaining_amount")))
+        .order_by(f"{party}__name", f"{party}_id")
+    )
+
+    totals = dict.fromkeys(AGING_BUCKETS + ["total"], Decimal("0.00"))
+    parties = []
+    for row in rows:
+        entry = {"id": row[f"{party}_id"], "name": row[f"{party}__name"]}
+        for name in AGING_BUCKETS:
+            entry[name] = f"{row[f'bucket_{name}']:.2f}"
+            totals[name] += row[f"bucket_{name}"]
+        entry["total"] = f"{row['total']:.2f}"
+        totals["total"] += row["total"]
+        parties.append(entry)
+
+    return {
+        "totals": {name: f"{value:.2f}" for name, value in totals.items()},
+        party + "s": parties,
+    }
+
+
+# ===========================
+# Customer statement
+# ===========================
+# position is the rank that orders entries sharing a timestamp: charges before payments
+STATEMENT_KINDS = ["order", "debt", "payment"]
+
+
+def _cents(value):
+    # raw cursors hand back Decimal, float or int depending on the backend
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+
+def _statement_arms(customer_id, cursor, descending, limit=None):
+    """
+    SELECT per entry kind, each narrowed to the rows past the keyset cursor.
+    With `limit` each arm walks its (customer, created_at, id) index and stops
+    there, so a page never reads more than `limit` rows per kind.
+    """
+    from django.db import connection
+
+    from .models import CustomerPayment, DebtToBePaid, Order
+
+    if cursor is not None:
+        # the backend's own datetime format, so the keyset comparison is exact
+        at = connection.ops.adapt_datetimefield_value(parse_datetime(cursor["at"]))
+    arms = [
+        (Order, "total_price", "paid_amount", "UPPER(status) <> 'CANCELLED'"),
+        (DebtToBePaid, "amount", "0", "order_id IS NULL"),  # order debts are already in the order rows
+        (CustomerPayment, "0", "amount", None),
+    ]
+    sql, params = [], []
+    for rank, (model, debit, credit, condition) in enumerate(arms):
+        where, where_params = ["customer_id = %s"], [customer_id]
+        if condition:
+            where.append(condition)
+        if cursor is not None:
+            # (created_at, rank, id) strictly past the cursor; rank is constant within an arm
+            after = "<" if descending else ">"
+            if rank == cursor["rank"]:
+                where.append(f"(created_at {after} %s OR (created_at = %s AND id {after} %s))")
+                where_params += [at, at, cursor["id"]]
+            else:
+                ahead = rank < cursor["rank"] if descending else rank > cursor["rank"]
+                where.append(f"created_at {after}{'=' if ahead else ''} %s")
+                where_params.append(at)
+        arm = (
+            f"SELECT created_at, {rank} AS kind, id, {debit} AS debit, {credit} AS credit "
+            f"FROM {model._meta.db_table} WHERE {' AND '.join(where)}"
+        )
+        if limit is not None:
+            direction = "DESC" if descending else "ASC"
+            arm = f"SELECT * FROM ({arm} ORDER BY created_at {direction}, id {direction} LIMIT %s) arm_{rank}"
+            where_params.append(limit)
+        sql.append(arm)
+        params += where_params
+    return sql, params
+
+
+def statement_opening(customer_id):
+    """Balance after every entry of the customer's statement; where a newest-first walk starts."""
+    from django.db import connection
+
+    arms, params = _statement_arms(customer_id, None, False)
+    with connection.cursor() as db:
+        db.execute(f"SELECT COALESCE(SUM(debit - credit), 0) FROM ({' UNION ALL '.join(arms)}) entries", params)
+        return _cents(db.fetchone()[0])
+
+
+def customer_statement(customer_id, cursor=None, limit=50, descending=False):
+    """
+    One page of a customer's statement: orders (debit total, credit paid),
+    debts not tied to an order, and payments, ordered by (created_at, kind, id).
+    The running balance is a window SUM over the page, started from the
+    balance carried in `cursor`, so a page costs the same however deep it is.
+    `cursor` is None for the first page or the dict a previous page returned
+    as "next"; returns (rows, next_cursor or None).
+    """
+    from django.db import connection
+
+    if cursor is None:
+        cursor_key = None
+        start = statement_opening(customer_id) if descending else Decimal("0.00")
+    else:
+        cursor_key, start = cursor, Decimal(cursor["balance"])
+
+    arms, params = _statement_arms(customer_id, cursor_key, descending, limit + 1)
+    direction = "DESC" if descending else "ASC"
+    order = f"created_at {direction}, kind {direction}, id {direction}"
+    # newest first: a row's balance is the start less every newer row on the page
+    frame = "ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING" if descending else "ROWS UNBOUNDED PRECEDING"
+    sign = "-" if descending else "+"
+    query = (
+        f"SELECT created_at, kind, id, debit, credit, "
+        f"%s {sign} COALESCE(SUM(debit - credit) OVER (ORDER BY {order} {frame}), 0) AS balance "
+        f"FROM (SELECT * FROM ({' UNION ALL '.join(arms)}) entries ORDER BY {order} LIMIT %s) page "
+        f"ORDER BY {order}"
+    )
+    with connection.cursor() as db:
+        db.execute(query, [start, *params, limit + 1])
+        fetched = db.fetchall()
+
+    rows = []
+    for created_at, rank, pk, debit, credit, balance in fetched[:limit]:
+        debit, credit, balance = (_cents(value) for value in (debit, credit, balance))
+        if isinstance(created_at, str):
+            created_at = parse_datetime(created_at)
+        if settings.USE_TZ and timezone.is_naive(created_at):
+            created_at = created_at.replace(tzinfo=dt_timezone.utc)
+        rows.append({
+            "date": created_at,
+            "type": STATEMENT_KINDS[rank],
+            "reference": pk,
+            "debit": debit,
+            "credit": credit,
+            "balance": balance,
+        })
+
+    next_cursor = None
+    if len(fetched) > limit and rows:
+        last = rows[-1]
+        next_cursor = {
+            "at": last["date"].isoformat(),
+            "rank": STATEMENT_KINDS.index(last["type"]),
+            "id": last["reference"],
+            # the balance the next page starts from
+            "balance": str(last["balance"] - (last["debit"] - last["credit"]) if descending else last["balance"]),
+        }
+    return rows, next_cursor
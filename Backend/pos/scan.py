@@ -0,0 +1,140 @@
+"""
+Barcode lookups for scanner checkout.
+
+Scans resolve (shop, barcode) through the ProductVariant (shop, barcode)
+index and keep a compact record of the hit in a per-process LRU cache.
+The variant save signal, the stock engine and product updates discard the
+records they touch once their transaction commits (discard_on_commit), so
+a scan racing the write cannot leave the old row cached. Other worker
+processes only see those changes once SCAN_CACHE_TTL expires, so the
+cached stock is a hint; checkout re-checks it under lock.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+
+class ScanCache:
+    """Thread-safe LRU of {(shop_id, barcode): record} with a TTL and a variant index."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_variant = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def set(self, key, record):
+        with self._lock:
+            self._pop(key)
+            # a variant has one barcode: drop a record cached under its previous one
+            previous = self._keys_by_variant.get(record["id"])
+            if previous is not None:
+                self._pop(previous)
+            self._entries[key] = (time.monotonic() + self.ttl, record)
+            self._keys_by_variant[record["id"]] = key
+            while len(self._entries) > self.maxsize:
+                self._pop(next(iter(self._entries)))
+
+    def discard_variants(self, variant_ids):
+        with self._lock:
+            for pk in variant_ids:
+                key = self._keys_by_variant.get(pk)
+                if key is not None:
+                    self._pop(key)
+
+    def discard_keys(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def discard_product(self, product_id):
+        with self._lock:
+            for key in [k for k, (_, r) in self._entries.items() if r["product_id"] == product_id]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_variant.clear()
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._keys_by_variant.pop(entry[1]["id"], None)
+
+
+scan_cache = ScanCache(
+    maxsize=getattr(settings, "SCAN_CACHE_SIZE", 2048),
+    ttl=getattr(settings, "SCAN_CACHE_TTL", 60),
+)
+
+
+def discard_on_commit(variant_ids=(), keys=(), product_id=None):
+    """
+    Drop the records of these variants, (shop_id, barcode) keys and/or
+    product once the current transaction commits; nothing happens on rollback.
+    """
+    variant_ids, keys = list(variant_ids), [key for key in keys if key]
+
+    def discard():
+        scan_cache.discard_variants(variant_ids)
+        scan_cache.discard_keys(keys)
+        if product_id is not None:
+            scan_cache.discard_product(product_id)
+
+    transaction.on_commit(discard)
+
+
+def variant_record(variant):
+    """The fields a till needs to turn a scan into an order line."""
+    return {
+        "id": variant.pk,
+        "product_id": variant.product_id,
+        "product_name": variant.product.name,
+        "barcode": variant.barcode,
+        "color_name": variant.color.name if variant.color else None,
+        "size_name": variant.size.name if variant.size else None,
+        "price": str(variant.effective_price),
+        "is_pack": variant.is_pack,
+        "units_per_pack": variant.units_per_pack,
+        "linked_single_variant": variant.linked_single_variant_id,
+        "stock_quantity": variant.stock_quantity,
+    }
+
+
+def lookup(shop_id, barcode):
+    """Compact record for the variant scanned at a shop, or None."""
+    key = (shop_id, barcode)
+    record = scan_cache.get(key)
+    if record is not None:
+        return record
+
+    from .models import ProductVariant
+
+    variant = (
+        ProductVariant.objects.select_related("product", "color", "size")
+        .filter(shop_id=shop_id, barcode=barcode, product__is_active=True)
+        .order_by("pk")
+        .first()
+    )
+    if variant is None:
+        return None
+    record = variant_record(variant)
+    scan_cache.set(key, record)
+    return record
@@ -4,10 +4,13 @@ from django.contrib.auth import get_user_model
 from .models import (
     Shop, Content, Banner,
     Category, Brand, Color, Size, Supplier,
-    Product, WasteProduct, Order, OrderItem, ProductVariant, DebtToPay
+    Product, WasteProduct, Order, OrderItem, ProductVariant, DebtToPay, StockMovement, ReportJob,
+    ForecastRun, VariantForecast
 )
 import json  # <-- ADD THIS IMPORT
 from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .reports import schedule_rollup
 User = get_user_model()
 
 
@@ -117,16 +120,35 @@ class SupplierSerializer(serializers.ModelSerializer):
         queryset=Shop.objects.all(), source="shop", write_only=True
     )
     remaining_amount = serializers.SerializerMethodField()
+    overdue_amount = serializers.SerializerMethodField()
+    last_payment_at = serializers.SerializerMethodField()
 
     class Meta:
         model = Supplier
-        fields = ["id", "name", "phone", "email", "address", "shop", "shop_id", "remaining_amount"]
+        fields = [
+            "id", "name", "phone", "email", "address", "shop", "shop_id",
+            "remaining_amount", "overdue_amount", "last_payment_at",
+        ]
+
+    def _balances(self, obj):
+        # Listings come from Supplier.objects.with_balances(); a bare instance
+        # (e.g. just created) is annotated here with one query
+        if not hasattr(obj, "outstanding_balance"):
+            annotated = Supplier.objects.with_balances(shop_id=obj.shop_id).get(pk=obj.pk)
+            obj.outstanding_balance = annotated.outstanding_balance
+            obj.overdue_balance = annotated.overdue_balance
+            obj.last_payment_at = annotated.last_payment_at
+        return obj
 
     def get_remaining_amount(self, obj):
-        # obj is a Supplier instance
-        return DebtToPay.objects.filter(supplier=obj).aggregate(
-            total=Sum('remaining_amount')
-        )['total'] or 0
+        return self._balances(obj).outstanding_balance
+
+    def get_overdue_amount(self, obj):
+        return self._balances(obj).overdue_balance
+
+    def get_last_payment_at(self, obj):
+        value = self._balances(obj).last_payment_at
+        return serializers.DateTimeField().to_representation(value) if value else None
 
 
 class DebtToPaySerializer(serializers.ModelSerializer):
@@ -134,6 +156,18 @@ class DebtToPaySerializer(serializers.ModelSerializer):
         model = DebtToPay
         fields = "__all__"
 
+
+class SupplierLedgerEntrySerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True, default=None)
+
+    class Meta:
+        model = DebtToPay
+        fields = [
+            "id", "shop", "product", "product_name", "total_amount", "paid_amount",
+            "remaining_amount", "status", "due_date", "note", "created_at", "updated_at",
+        ]
+        read_only_fields = fields
+
     # ---------------- ProductVariant Serializer (Remains the same) ----------------
 class ProductVariantSerializer(serializers.ModelSerializer):
     color_name = serializers.CharField(source='color.name', read_only=True)
@@ -164,7 +198,7 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         model = ProductVariant
         fields = [
             "id", "color", "color_name", "size", "size_name",
-            "stock_quantity", "barcode",
+            "stock_quantity", "low_stock_threshold", "barcode",
             "sale_price", "single_sale_price", "pack_sale_price",
             "is_pack", "units_per_pack", "linked_single_variant",
             "effective_price"
@@ -175,7 +209,7 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 # Product Serializer
 # ===========================
 class ProductSerializer(serializers.ModelSerializer):
-    # Dynamic total stock
+    # Denormalized total stock (Product.total_stock)
     stock_quantity = serializers.SerializerMethodField(read_only=True)
 
     # Keep slugs, write-only ids, variants, colors/sizes as before
@@ -215,7 +249,7 @@ class ProductSerializer(serializers.ModelSerializer):
         return min(prices) if prices else None
 
     def get_stock_quantity(self, obj):
-        return sum(v.stock_quantity for v in obj.variants.all())
+        return obj.total_stock
 
 
     # ===========================================
@@ -227,13 +261,11 @@ class ProductSerializer(serializers.ModelSerializer):
         except json.JSONDecodeError:
             raise serializers.ValidationError("Invalid variants_json payload.")
 
-    def _create_or_update_variant(self, product, v_data):
-        variant_id = v_data.pop("id", None)
-
-        if variant_id:
-            ProductVariant.objects.filter(id=variant_id, product=product).update(**v_data)
-        else:
-            ProductVariant.objects.create(product=product, **v_data)
+    def _upsert_variants(self, product, variants):
+        try:
+            ProductVariant.objects.upsert_for_product(product, variants, reference=f"product:{product.pk}")
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.message_dict)
 
     # ===========================================
     # Create
@@ -256,7 +288,8 @@ class ProductSerializer(serializers.ModelSerializer):
         for v_data in variants:
             v_data.setdefault("purchase_price", product.purchase_price)
             v_data.setdefault("sale_price", product.sale_price)
-            ProductVariant.objects.create(product=product, **v_data)
+        if variants:
+            self._upsert_variants(product, variants)
 
         return product
 
@@ -280,10 +313,30 @@ class ProductSerializer(serializers.ModelSerializer):
 
         variants = self._parse_variants(variants_raw)
 
-        for v_data in variants:
-            self._create_or_update_variant(instance, v_data)
+        if variants:
+            self._upsert_variants(instance, variants)
 
         return instance
+# ===========================
+# Catalog sync Serializers
+# ===========================
+class CatalogProductSerializer(ProductSerializer):
+    """Product row for delta catalog sync; variants travel separately."""
+
+    class Meta(ProductSerializer.Meta):
+        fields = [
+            "id", "name", "stock_quantity",
+            "category", "brand", "supplier",
+            "colors", "sizes",
+            "image", "shop", "is_active", "updated_at"
+        ]
+
+
+class CatalogVariantSerializer(ProductVariantSerializer):
+    class Meta(ProductVariantSerializer.Meta):
+        fields = ProductVariantSerializer.Meta.fields + ["product", "updated_at"]
+
+
 # ===========================
 # Waste Product Serializer
 # ===========================
@@ -319,6 +372,58 @@ class WasteProductSerializer(serializers.ModelSerializer):
         ]
 
 
+class WasteBulkLineSerializer(serializers.Serializer):
+    """One line of an end-of-day waste count; variants are resolved in bulk by the view."""
+    variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    reason = serializers.CharField(max_length=255, required=False, allow_blank=True, allow_null=True)
+
+
+# ===========================
+# Stock Movement Serializer
+# ===========================
+class StockMovementSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="variant.product.name", read_only=True, default=None)
+
+    class Meta:
+        model = StockMovement
+        fields = ["id", "shop", "variant", "product_name", "delta", "reason", "reference", "unit_cost", "created_at"]
+        read_only_fields = fields
+
+
+# ===========================
+# Forecast Serializers
+# ===========================
+class ForecastRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ForecastRun
+        fields = ["id", "shop", "months_back", "started_at", "finished_at", "duration_ms", "variant_count"]
+        read_only_fields = fields
+
+
+class VariantForecastSerializer(serializers.ModelSerializer):
+    variant_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(source="variant.product.name", read_only=True)
+    variant_name = serializers.CharField(source="variant", read_only=True)
+    # names the best-selling endpoint used before forecasts were precomputed
+    predicted_next_month_sales = serializers.FloatField(source="predicted_demand", read_only=True)
+
+    class Meta:
+        model = VariantForecast
+        fields = [
+            "variant_id", "product_name", "variant_name", "current_stock", "total_sold", "avg_monthly_sold",
+            "predicted_demand", "predicted_next_month_sales", "safety_buffer", "suggested_restock", "notes",
+        ]
+        read_only_fields = fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # e.g. total_sold_last_2_months, which the app still reads
+        months = self.context.get("months_back", 2)
+        data[f"total_sold_last_{months}_months"] = data["total_sold"]
+        return data
+
+
 # ===========================
 # Low Stock Serializer
 # ===========================
@@ -329,7 +434,7 @@ class LowStockVariantSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProductVariant
-        fields = ['id', 'product_name', 'color_name', 'size_name', 'stock_quantity']
+        fields = ['id', 'product_name', 'color_name', 'size_name', 'stock_quantity', 'low_stock_threshold', 'purchase_price']
 
 
 # ===========================
@@ -363,59 +468,72 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["total_price", "status", "created_at", "customer_name"]
 
+    @staticmethod
+    def price_line(variant, qty):
+        """
+        Unit price and line total for qty of a variant.
+        A full pack sells at pack price and is counted as a whole; otherwise single price * qty.
+        """
+        if qty == variant.units_per_pack and variant.is_pack:
+            price = Decimal(variant.pack_sale_price)
+            return price, price
+        price = Decimal(variant.single_sale_price)
+        return price, price * qty
+
+    @staticmethod
+    def build_item(order, variant, qty, price):
+        """Unsaved OrderItem snapshotting the variant's pack size and color/size names."""
+        return OrderItem(
+            order=order,
+            variant=variant,
+            quantity=qty,
+            units_per_pack=variant.units_per_pack if variant.is_pack else 1,
+            price=price,
+            color_name=variant.color.name if variant.color else None,
+            size_name=variant.size.name if variant.size else None,
+        )
+
     @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
         user = validated_data.pop("user", None)
-        customer_id = validated_data.pop("customer_id", None)
-        paid_amount = validated_data.get("paid_amount", Decimal("0"))
+        validated_data.pop("customer_id", None)
 
-        order = Order.objects.create(user=user, **validated_data)
+        # Attach customer if the view didn't resolve one
+        if validated_data.get("customer") is None:
+            customer_id = self.initial_data.get("customer_id")
+            if customer_id:
+                validated_data["customer"] = Customer.objects.filter(
+                    id=customer_id, shop=validated_data.get("shop")
+                ).first()
 
+        # Lock every variant in the basket once
+        locked = ProductVariant.objects.lock_for_stock(item_data["variant"] for item_data in items_data)
+
+        # Price the basket first so the order row is written once, with its total
+        order = Order(user=user, **validated_data)
         total_price = Decimal("0")
+        order_items = []
 
         for item_data in items_data:
-            variant = item_data["variant"]
+            variant = locked[item_data["variant"].pk]
             qty = int(item_data["quantity"])
 
-            # Determine correct price
-            if qty == variant.units_per_pack and variant.is_pack:
-                price = Decimal(variant.pack_sale_price)
-            else:
-                price = Decimal(variant.single_sale_price)
-
-            # Reduce stock
-            variant.reduce_stock(qty)
-
-            OrderItem.objects.create(
-                order=order,
-                variant=variant,
-                quantity=qty,
-                units_per_pack=variant.units_per_pack if variant.is_pack else 1,
-                price=price,
-                color_name=variant.color.name if variant.color else None,
-                size_name=variant.size.name if variant.size else None,
-            )
-
-            # Add price * quantity only for single units; pack already counted as whole
-            if qty == variant.units_per_pack and variant.is_pack:
-                total_price += price
-            else:
-                total_price += price * qty
+            price, line_total = self.price_line(variant, qty)
+            order_items.append(self.build_item(order, variant, qty, price))
+            total_price += line_total
 
         order.total_price = total_price
-
-        # Attach customer if provided
-        customer_id = self.initial_data.get("customer_id")
-        if customer_id:
-            try:
-                customer = Customer.objects.get(id=customer_id, shop=order.shop)
-                order.customer = customer
-            except Customer.DoesNotExist:
-                pass
-
-
         order.save()
+
+        # Decrement set-based and journal the movements against this order
+        ProductVariant.objects.reduce_stock_bulk(
+            [(item_data["variant"], item_data["quantity"]) for item_data in items_data],
+            reference=f"order:{order.pk}",
+            locked=locked,
+        )
+        OrderItem.objects.bulk_create(order_items)
+        schedule_rollup(order.shop_id, order.created_at, [item.variant_id for item in order_items])
         return order
 
 
@@ -536,6 +654,18 @@ class ShopReportSerializer(serializers.Serializer):
     monthly_comparison = serializers.ListField()  # <-- ADD THIS
     # Note: Sales Summary is typically calculated from total_revenue
 
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Status of a background shop report; the payload itself comes from the download action."""
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            "id", "shop", "period", "start_date", "end_date", "months",
+            "status", "error", "created_at", "finished_at",
+        ]
+        read_only_fields = fields
+
 #==============
 # Employee
 #==================
@@ -2,17 +2,61 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import WasteProduct, Product
 from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import ProductVariant, Product, OrderItem, WasteProduct
+from django.utils import timezone
+from .models import ProductVariant, Product, OrderItem, WasteProduct, CatalogTombstone
+from .managers import add_total_stock, mark_low_stock, record_movements
+from .scan import discard_on_commit
+
+# Carry a variant's stock change onto Product.total_stock as an F() delta and journal it
+@receiver(post_save, sender=ProductVariant)
+def update_product_stock(sender, instance, created, **kwargs):
+    previous = 0 if created else instance._saved_stock
+    if previous is not None and instance.stock_quantity != previous:
+        delta = instance.stock_quantity - previous
+        add_total_stock({instance.product_id: delta})
+        reason = getattr(instance, "_stock_reason", None) or ("INITIAL" if created else "ADJUSTMENT")
+        record_movements({instance.pk: delta}, {instance.pk: instance}, reason)
+    instance._saved_stock = instance.stock_quantity
+
+    # Only touch the watchlist when the variant flips in or out of low stock
+    is_low = instance.is_low_stock
+    if is_low != instance._saved_low and (is_low or not created):
+        mark_low_stock({instance.pk: (instance.product.shop_id, is_low)})
+    instance._saved_low = is_low
+    # a barcode or shop change also retires the record cached under the old key
+    scan_key = (instance.shop_id, instance.barcode)
+    stale_keys = [instance._saved_scan_key] if instance._saved_scan_key != scan_key else []
+    discard_on_commit(variant_ids=[instance.pk], keys=stale_keys)
+    instance._saved_scan_key = scan_key
+
+
+@receiver(post_delete, sender=ProductVariant)
+def remove_product_stock(sender, instance, **kwargs):
+    if instance._saved_stock:
+        add_total_stock({instance.product_id: -instance._saved_stock})
+    discard_on_commit(variant_ids=[instance.pk], keys=[instance._saved_scan_key])
+
 
-# Update product stock when a variant changes
-@receiver([post_save, post_delete], sender=ProductVariant)
-def update_product_stock(sender, instance, **kwargs):
-    product = instance.product
-    total_stock = product.variants.aggregate(total=models.Sum('stock_quantity'))['total'] or 0
-    product.stock_quantity = total_stock
-    product.save()
+# Keep the variants' copied shop in step and drop stale scan records
+@receiver(post_save, sender=Product)
+def sync_product_variants(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= {"total_stock", "updated_at"}):
+        return
+    instance.variants.exclude(shop_id=instance.shop_id).update(shop_id=instance.shop_id, updated_at=timezone.now())
+    discard_on_commit(product_id=instance.pk)
+
+
+# Tombstones let delta catalog sync tell terminals about deletions
+@receiver(post_delete, sender=Product)
+def tombstone_product(sender, instance, **kwargs):
+    CatalogTombstone.objects.create(shop_id=instance.shop_id, kind="product", object_id=instance.pk)
+
+
+@receiver(post_delete, sender=ProductVariant)
+def tombstone_variant(sender, instance, **kwargs):
+    CatalogTombstone.objects.create(shop_id=instance.shop_id, kind="variant", object_id=instance.pk)
 
 # # Reduce variant stock when an order is created
 # @receiver(post_save, sender=OrderItem)
@@ -24,22 +68,6 @@ def update_product_stock(sender, instance, **kwargs):
 #             variant.stock_quantity = 0
 #         variant.save()
 
-# Reduce variant stock for waste
-@receiver(post_save, sender=WasteProduct)
-def adjust_variant_stock_waste(sender, instance, created, **kwargs):
-    variant = instance.variant
-    if created:
-        variant.stock_quantity -= instance.quantity
-    else:
-        # Fetch previous quantity from DB
-        old_instance = WasteProduct.objects.get(pk=instance.pk)
-        diff = instance.quantity - old_instance.quantity
-        variant.stock_quantity -= diff
-    if variant.stock_quantity < 0:
-        variant.stock_quantity = 0
-    variant.save()
-
-
 ###################
 # Employee
 #####################
@@ -56,7 +84,38 @@ from django.dispatch import receiver
 from .models import DebtToBePaid
 
 
+from .jobs import enqueue
+
+
 @receiver([post_save, post_delete], sender=DebtToBePaid)
 def update_customer_total_debt(sender, instance, **kwargs):
-    """Recalculate customer total debt whenever a debt record changes."""
-    instance.customer.recalculate_debt()
+    """Queue a post-commit recalculation of the customer's total debt whenever a debt record changes."""
+    enqueue("customer.recalculate_debt", customer_id=instance.customer_id)
+
+
+from .models import Order
+from .reports import schedule_rollup
+
+# Status changes and deletions move an order in or out of the sales rollup
+@receiver(post_save, sender=Order)
+def refresh_order_rollup(sender, instance, created, **kwargs):
+    if not created:
+        schedule_rollup(instance.shop_id, instance.created_at, instance.items.values_list("variant_id", flat=True))
+
+
+@receiver(pre_delete, sender=Order)
+def refresh_deleted_order_rollup(sender, instance, **kwargs):
+    schedule_rollup(instance.shop_id, instance.created_at, instance.items.values_list("variant_id", flat=True))
+
+
+# Expenses and adjustments feed the shop report directly, so they invalidate its cache
+from .models import Expense, Adjustment
+from .reports import bump_report_version
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Adjustment)
+@receiver(post_delete, sender=Adjustment)
+def bump_shop_report_version(sender, instance, **kwargs):
+    bump_report_version(instance.shop_id)
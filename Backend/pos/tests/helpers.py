@@ -0,0 +1,33 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from pos.models import Category, Color, Product, ProductVariant, Shop, User
+
+
+def make_shop(name="Shop"):
+    return Shop.objects.create(name=name, expire_date=timezone.localdate() + timedelta(days=30))
+
+
+def make_owner(shop, username="owner"):
+    return User.objects.create_user(username=username, password="x", role="OWNER", shop=shop)
+
+
+def make_catalog(shop, n=3, stock=10, name="P"):
+    """A product with n single variants (one colour each) holding `stock` units apiece."""
+    category = Category.objects.create(shop=shop, name=f"C-{name}")
+    product = Product.objects.create(shop=shop, name=name, category=category)
+    variants = [
+        ProductVariant.objects.create(
+            product=product,
+            color=Color.objects.create(name=f"{name}-c{i}"),
+            stock_quantity=stock,
+            purchase_price=Decimal("2.00"),
+            sale_price=Decimal("5.00"),
+            single_sale_price=Decimal("5.00"),
+            barcode=f"{name}-{i}",
+        )
+        for i in range(n)
+    ]
+    return product, variants
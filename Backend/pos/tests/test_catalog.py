@@ -0,0 +1,43 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from pos.models import Color, ProductVariant, Size
+from pos.tests.helpers import make_catalog, make_shop
+
+
+class VariantUpsertTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=1, stock=5)
+        self.color = Color.objects.create(name="red")
+        self.size = Size.objects.create(name="L")
+
+    def test_ids_sent_as_strings_are_accepted(self):
+        rows = [
+            {"id": str(self.variants[0].pk), "stock_quantity": 7},
+            {"color": str(self.color.pk), "size": str(self.size.pk), "stock_quantity": 3, "barcode": "new",
+             "purchase_price": "2", "sale_price": "5"},
+        ]
+        created, updated = ProductVariant.objects.upsert_for_product(self.product, json.loads(json.dumps(rows)))
+
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(updated), 1)
+        variant = ProductVariant.objects.get(barcode="new")
+        self.assertEqual((variant.color_id, variant.size_id), (self.color.pk, self.size.pk))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.total_stock, 10)
+
+    def test_bad_ids_are_reported_per_row(self):
+        rows = [
+            {"color": "abc", "barcode": "x", "purchase_price": "2", "sale_price": "5"},
+            {"size": "999", "barcode": "y", "purchase_price": "2", "sale_price": "5"},
+        ]
+        with self.assertRaises(ValidationError) as raised:
+            ProductVariant.objects.upsert_for_product(self.product, rows)
+
+        messages = raised.exception.message_dict["variants_json"]
+        self.assertEqual(len(messages), 2)
+        self.assertIn("not a valid id", messages[0])
+        self.assertIn("Size 999 does not exist", messages[1])
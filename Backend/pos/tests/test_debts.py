@@ -0,0 +1,137 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos.models import Customer, CustomerPayment, DebtToBePaid, DebtToPay, Supplier, SupplierPayment
+from pos.tests.helpers import make_owner, make_shop
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class CustomerPaymentTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.customer = Customer.objects.create(shop=self.shop, name="Customer", phone="1")
+        now = timezone.now()
+        # created out of order so FIFO has to follow created_at, not the primary key
+        with self.captureOnCommitCallbacks(execute=True):
+            self.newest, self.oldest, self.middle = [
+                DebtToBePaid.objects.create(
+                    shop=self.shop, customer=self.customer, amount=Decimal("10.00"),
+                    remaining_amount=Decimal("10.00"), created_at=now - timedelta(days=days),
+                )
+                for days in (1, 3, 2)
+            ]
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def pay(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/api/customers/{self.customer.pk}/pay/", {"amount": amount}, format="json")
+
+    def test_pays_the_oldest_debts_first(self):
+        response = self.pay("15")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["payment_applied"], response.data["remaining_debt"]), ("15.00", "15.00"))
+
+        self.oldest.refresh_from_db()
+        self.middle.refresh_from_db()
+        self.newest.refresh_from_db()
+        self.assertEqual((self.oldest.status, self.oldest.remaining_amount), ("PAID", Decimal("0.00")))
+        self.assertEqual((self.middle.status, self.middle.remaining_amount), ("PARTIAL", Decimal("5.00")))
+        self.assertEqual((self.newest.status, self.newest.remaining_amount), ("UNPAID", Decimal("10.00")))
+        self.assertEqual(list(CustomerPayment.objects.values_list("amount", flat=True)), [Decimal("15.00")])
+
+    def test_overpayment_applies_only_the_open_balance(self):
+        response = self.pay("100")
+        self.assertEqual((response.data["payment_applied"], response.data["remaining_debt"]), ("30.00", "0.00"))
+        self.assertFalse(DebtToBePaid.objects.exclude(status="PAID").exists())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_debt, Decimal("0.00"))
+
+    def test_rejects_a_non_positive_amount(self):
+        self.assertEqual(self.pay("-1").status_code, 400)
+        self.assertFalse(CustomerPayment.objects.exists())
+
+
+class SupplierBalanceTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.supplier = Supplier.objects.create(shop=self.shop, name="Acme")
+        self.debt = DebtToPay.objects.create(
+            shop=self.shop, supplier=self.supplier, total_amount=Decimal("100.00"),
+            paid_amount=Decimal("0.00"), remaining_amount=Decimal("100.00"),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def listed(self):
+        data = self.client.get("/api/suppliers/").json()
+        return (data if isinstance(data, list) else data["results"])[0]
+
+    def test_last_payment_is_the_latest_recorded_payment(self):
+        self.assertIsNone(self.listed()["last_payment_at"])
+        response = self.client.post(f"/api/suppliers/{self.supplier.pk}/pay/", {"amount": "40"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        payment = SupplierPayment.objects.get()
+        self.assertEqual((payment.shop_id, payment.amount), (self.shop.pk, Decimal("40.00")))
+        paid_at = self.listed()["last_payment_at"]
+        self.assertIsNotNone(paid_at)
+
+        # editing a debt that has payments on it is not a payment
+        self.debt.refresh_from_db()
+        self.debt.note = "invoice 12"
+        self.debt.save()
+        row = self.listed()
+        self.assertEqual(row["last_payment_at"], paid_at)
+        self.assertEqual(Decimal(row["remaining_amount"]), Decimal("60.00"))
+
+    def test_other_shops_payments_do_not_count(self):
+        other = make_shop("Other")
+        SupplierPayment.objects.create(shop=other, supplier=self.supplier, amount=Decimal("5.00"))
+        self.assertIsNone(self.listed()["last_payment_at"])
+
+
+class SupplierPaymentTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.other = make_shop("Other")
+        self.supplier = Supplier.objects.create(shop=self.shop, name="Acme")
+        now = timezone.now()
+        self.newest, self.oldest, self.middle, self.elsewhere = [
+            DebtToPay.objects.create(
+                shop=shop, supplier=self.supplier, total_amount=Decimal("10.00"),
+                paid_amount=Decimal("0.00"), remaining_amount=Decimal("10.00"),
+            )
+            for shop in (self.shop, self.shop, self.shop, self.other)
+        ]
+        # created_at is auto_now_add; move it afterwards so FIFO has to follow it, not the primary key
+        for debt, days in ((self.newest, 1), (self.oldest, 4), (self.middle, 2), (self.elsewhere, 5)):
+            DebtToPay.objects.filter(pk=debt.pk).update(created_at=now - timedelta(days=days))
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def pay(self, amount):
+        return self.client.post(f"/api/suppliers/{self.supplier.pk}/pay/", {"amount": amount}, format="json")
+
+    def test_pays_the_shops_oldest_debts_first(self):
+        response = self.pay("15")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(a["debt_id"], a["applied"], a["status"]) for a in response.data["allocations"]],
+            [(self.oldest.pk, "10.00", "PAID"), (self.middle.pk, "5.00", "PARTIAL")],
+        )
+        self.assertEqual(response.data["remaining_unallocated"], "0.00")
+        self.newest.refresh_from_db()
+        self.elsewhere.refresh_from_db()
+        self.assertEqual(self.newest.remaining_amount, Decimal("10.00"))
+        self.assertEqual(self.elsewhere.remaining_amount, Decimal("10.00"))
+
+    def test_overpayment_is_left_unallocated(self):
+        response = self.pay("100")
+        self.assertEqual(response.data["remaining_unallocated"], "70.00")
+        self.assertFalse(DebtToPay.objects.filter(shop=self.shop).exclude(status="PAID").exists())
+        self.assertEqual(SupplierPayment.objects.get().amount, Decimal("30.00"))
+        self.assertEqual(self.pay("5").data["message"], "No outstanding debts")
@@ -0,0 +1,125 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos import forecast as forecasting
+from pos.forecast import forecast, forecast_shops, purchase_orders, sales_arrays
+from pos.models import ForecastRun, ProductVariant
+from pos.serializers import OrderSerializer
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+class ForecastScopeTests(TestCase):
+    def test_a_shop_is_required(self):
+        make_shop()
+        with self.assertRaises(ValueError):
+            forecast(None)
+        with self.assertRaises(ValueError):
+            list(sales_arrays(None, None))
+
+
+class PurchaseOrderTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        product, (self.single, self.pack, self.loose) = make_catalog(self.shop, n=3)
+        ProductVariant.objects.filter(pk=self.pack.pk).update(
+            is_pack=True, units_per_pack=12, purchase_price=Decimal("30.00"), linked_single_variant=self.single,
+        )
+
+    def lines(self, suggestions):
+        rows = [
+            {"variant_id": variant.pk, "current_stock": 0, "total_sold": 1, "avg_monthly_sold": 1,
+             "predicted_next_month_sales": 1, "safety_buffer": 0, "suggested_restock": restock, "notes": []}
+            for variant, restock in suggestions
+        ]
+        run = ForecastRun.record(self.shop.pk, rows, 2, timezone.now(), 0)
+        return {line["variant_id"]: line for line in purchase_orders(run)[0]["lines"]}
+
+    def test_a_pack_suggestion_is_a_pack_count(self):
+        line = self.lines([(self.pack, 8)])[self.pack.pk]
+        self.assertEqual((line["packs"], line["order_units"]), (8, 96))
+        self.assertEqual((line["pack_cost"], line["line_cost"]), ("30.00", "240.00"))
+
+    def test_singles_round_up_to_the_linked_pack(self):
+        lines = self.lines([(self.single, 13), (self.loose, 5)])
+        single, loose = lines[self.single.pk], lines[self.loose.pk]
+        self.assertEqual((single["units_per_pack"], single["packs"], single["order_units"]), (12, 2, 24))
+        self.assertEqual(single["line_cost"], "48.00")
+        self.assertEqual((loose["units_per_pack"], loose["packs"], loose["order_units"]), (1, 5, 5))
+        self.assertEqual(loose["line_cost"], "10.00")
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class BestSellingTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=3, stock=50)
+        for variant, quantity in zip(self.variants, (5, 1, 3)):
+            serializer = OrderSerializer(data={"shop": self.shop.pk, "items": [{"variant": variant.pk, "quantity": quantity}]})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def get(self, query=""):
+        return self.client.get(f"/api/orders/best-selling/{query}")
+
+    def test_keeps_the_original_lists_next_to_the_pages(self):
+        response = self.get("?top=2")
+        self.assertEqual(response.status_code, 200, response.data)
+
+        self.assertEqual([r["variant_id"] for r in response.data["results"]], [v.pk for v in (self.variants[0], self.variants[2], self.variants[1])])
+        best, low = response.data["best_selling"], response.data["low_selling"]
+        self.assertEqual([r["total_sold_last_2_months"] for r in best], [5, 3])
+        self.assertEqual([r["total_sold_last_2_months"] for r in low], [3, 1])
+        self.assertIn("variant_name", best[0])
+        self.assertIn("predicted_next_month_sales", best[0])
+
+    def test_months_selects_the_history_window(self):
+        response = self.get("?months=3")
+        self.assertEqual(response.status_code, 200, response.data)
+
+        self.assertEqual(response.data["run"]["months_back"], 3)
+        self.assertIn("total_sold_last_3_months", response.data["best_selling"][0])
+        self.get()
+        self.assertEqual(sorted(ForecastRun.objects.values_list("months_back", flat=True)), [2, 3])
+        self.assertEqual(self.get("?months=abc").status_code, 400)
+        self.assertEqual(self.get("?months=0").status_code, 400)
+
+
+class ForecastShopsTests(TestCase):
+    def setUp(self):
+        self.shops = [make_shop(f"S{i}") for i in range(3)]
+
+    def failing_for(self, broken):
+        real = forecasting.forecast
+
+        def fake(shop_id, *args, **kwargs):
+            if shop_id == broken.pk:
+                raise RuntimeError("boom")
+            return real(shop_id, *args, **kwargs)
+        return mock.patch("pos.forecast.forecast", side_effect=fake)
+
+    def test_a_failing_shop_does_not_stop_the_others(self):
+        with self.failing_for(self.shops[1]):
+            results = list(forecast_shops([shop.pk for shop in self.shops], workers=1))
+
+        self.assertEqual([r[0] for r in results], [shop.pk for shop in self.shops])
+        self.assertIsInstance(results[1][4], RuntimeError)
+        self.assertIsNone(results[1][1])
+        self.assertEqual([r[4] for r in (results[0], results[2])], [None, None])
+
+    def test_command_records_the_rest_and_reports_failures(self):
+        stderr = StringIO()
+        with self.failing_for(self.shops[0]), self.assertRaises(CommandError):
+            call_command("compute_forecasts", "--workers", "1", stdout=StringIO(), stderr=stderr)
+
+        self.assertIn("boom", stderr.getvalue())
+        self.assertEqual(
+            set(ForecastRun.objects.values_list("shop_id", flat=True)), {self.shops[1].pk, self.shops[2].pk}
+        )
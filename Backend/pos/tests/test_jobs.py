@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from pos import jobs
+from pos.models import BackgroundJob
+
+
+class StaleJobTests(TestCase):
+    def running(self, name, minutes_ago, **payload):
+        job = BackgroundJob.objects.create(name=name, payload=payload)
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status="RUNNING", updated_at=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+        return job
+
+    def runnable(self):
+        return set(BackgroundJob.objects.filter(jobs._runnable()).values_list("pk", flat=True))
+
+    def test_stale_window_is_per_handler(self):
+        short = self.running("customer.recalculate_debt", 30, customer_id=0)
+        report = self.running("report.build", 30, report_id=0)
+        self.assertEqual(self.runnable(), {short.pk})
+
+        BackgroundJob.objects.filter(pk=report.pk).update(updated_at=timezone.now() - timedelta(hours=3))
+        self.assertEqual(self.runnable(), {short.pk, report.pk})
+
+    def test_a_live_short_job_is_not_reclaimed(self):
+        self.running("customer.recalculate_debt", 5, customer_id=0)
+        self.assertEqual(self.runnable(), set())
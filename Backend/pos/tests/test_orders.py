@@ -0,0 +1,50 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from pos.models import IdempotencyKey, Order, ProductVariant
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class IdempotentCheckoutTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=2, stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def checkout(self, key, quantity=2, client=None):
+        body = {"shop": self.shop.pk, "items": [{"variant": self.variants[0].pk, "quantity": quantity}]}
+        return (client or self.client).post("/api/orders/", body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.checkout("k1")
+        self.assertEqual(first.status_code, 201, first.data)
+        retry = self.checkout("k1")
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json()["id"], first.json()["id"])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 8)
+
+    def test_reused_key_with_another_payload_is_rejected(self):
+        self.checkout("k1")
+        conflict = self.checkout("k1", quantity=3)
+
+        self.assertEqual(conflict.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_scoped_to_the_shop(self):
+        self.checkout("k1")
+        other_shop = make_shop("Other")
+        _, other_variants = make_catalog(other_shop, n=1, stock=5, name="Q")
+        other = APIClient()
+        other.force_authenticate(make_owner(other_shop, "other"))
+        body = {"shop": other_shop.pk, "items": [{"variant": other_variants[0].pk, "quantity": 1}]}
+        response = other.post("/api/orders/", body, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Order.objects.get(pk=response.json()["id"]).shop, other_shop)
+        self.assertEqual(IdempotencyKey.objects.filter(key="k1").count(), 2)
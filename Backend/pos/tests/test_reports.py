@@ -0,0 +1,134 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos.models import Customer, DebtToBePaid, DebtToPay, ReportJob, Shop, Supplier, User
+from pos.reports import aging, bump_report_version, report_cache_key
+from pos.tests.helpers import make_owner, make_shop
+
+
+class ReportVersionTests(TestCase):
+    def version(self, shop):
+        return Shop.objects.values_list("data_version", flat=True).get(pk=shop.pk)
+
+    def test_stale_save_keeps_newer_bumps(self):
+        shop = make_shop()
+        stale = Shop.objects.get(pk=shop.pk)
+        bump_report_version(shop.pk)
+        bump_report_version(shop.pk)
+
+        stale.name = "Renamed"
+        stale.save()
+        stale.save(update_fields=["name", "data_version"])
+
+        self.assertEqual(self.version(shop), 2)
+        self.assertEqual(Shop.objects.get(pk=shop.pk).name, "Renamed")
+
+    def test_bump_changes_the_cache_key(self):
+        shop = make_shop()
+        before = report_cache_key(shop.pk, "2026-01-01")
+        bump_report_version(shop.pk)
+
+        self.assertNotEqual(report_cache_key(shop.pk, "2026-01-01"), before)
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class ReportJobTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.inputs = (self.shop.pk, date(2026, 1, 1), date(2026, 1, 31))
+
+    def test_identical_submits_share_a_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job, created = ReportJob.submit(*self.inputs)
+        again, created_again = ReportJob.submit(*self.inputs)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).status, "DONE")
+
+    def test_a_new_day_builds_a_new_job(self):
+        job, _ = ReportJob.submit(*self.inputs)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch("django.utils.timezone.localdate", return_value=tomorrow):
+            later, created = ReportJob.submit(*self.inputs)
+
+        self.assertTrue(created)
+        self.assertNotEqual(later.pk, job.pk)
+        self.assertEqual(later.run_date, tomorrow)
+
+    def test_only_one_live_job_per_inputs(self):
+        job, _ = ReportJob.submit(*self.inputs)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(
+                shop=self.shop, start_date=job.start_date, end_date=job.end_date,
+                months=job.months, data_version=job.data_version, run_date=job.run_date,
+            )
+        ReportJob.objects.filter(pk=job.pk).update(status="FAILED")
+
+        retry, created = ReportJob.submit(*self.inputs)
+        self.assertTrue(created)
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class AgingTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.today = timezone.localdate()
+        self.customer = Customer.objects.create(shop=self.shop, name="Customer", phone="1")
+        with self.captureOnCommitCallbacks(execute=True):
+            # days past due -> amount; -5 is not yet due, 30/31, 60/61 and 90/91 sit on the bucket edges
+            for days, amount in [(-5, 1), (30, 2), (31, 4), (60, 8), (61, 16), (90, 32), (91, 64)]:
+                DebtToBePaid.objects.create(
+                    shop=self.shop, customer=self.customer, amount=amount,
+                    remaining_amount=amount, due_date=self.today - timedelta(days=days),
+                )
+            undated = DebtToBePaid.objects.create(shop=self.shop, customer=self.customer, amount=128, remaining_amount=128)
+            DebtToBePaid.objects.create(
+                shop=self.shop, customer=self.customer, amount=256, remaining_amount=0,
+                status="PAID", due_date=self.today - timedelta(days=300),
+            )
+            other = make_shop("Other")
+            DebtToBePaid.objects.create(
+                shop=other, customer=Customer.objects.create(shop=other, name="Elsewhere", phone="2"),
+                amount=512, remaining_amount=512, due_date=self.today - timedelta(days=100),
+            )
+        # no due date: aged from created_at
+        DebtToBePaid.objects.filter(pk=undated.pk).update(created_at=timezone.now() - timedelta(days=45))
+        supplier = Supplier.objects.create(shop=self.shop, name="Acme")
+        DebtToPay.objects.create(
+            shop=self.shop, supplier=supplier, total_amount=5, remaining_amount=5,
+            due_date=self.today - timedelta(days=95),
+        )
+
+    def test_buckets_by_days_past_due(self):
+        receivables = aging("receivables", shop_id=self.shop.pk, today=self.today)
+        self.assertEqual(receivables["customers"], [{
+            "id": self.customer.pk, "name": "Customer",
+            "0_30": "3.00", "31_60": "140.00", "61_90": "48.00", "90_plus": "64.00", "total": "255.00",
+        }])
+        self.assertEqual(receivables["totals"]["total"], "255.00")
+        self.assertEqual(aging("payables", shop_id=self.shop.pk, today=self.today)["totals"]["90_plus"], "5.00")
+
+    def test_endpoint_scopes_to_the_users_shop(self):
+        client = APIClient()
+        client.force_authenticate(make_owner(self.shop))
+        response = client.get("/api/aging/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["as_of"], self.today)
+        self.assertEqual(response.data["receivables"]["totals"]["total"], "255.00")
+        self.assertEqual(client.get("/api/aging/?side=nope").status_code, 400)
+
+    def test_super_admin_shop_id_must_be_an_integer(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="admin", password="x", role="SUPER_ADMIN"))
+        self.assertEqual(client.get("/api/aging/?shop_id=abc").status_code, 400)
+        response = client.get(f"/api/aging/?side=receivables&shop_id={self.shop.pk}")
+        self.assertEqual(response.data["receivables"]["totals"]["total"], "255.00")
+        self.assertEqual(client.get("/api/aging/?side=receivables").data["receivables"]["totals"]["total"], "767.00")
@@ -0,0 +1,54 @@
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from pos.models import ProductVariant
+from pos.scan import scan_cache
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+class ScanTests(TestCase):
+    def setUp(self):
+        scan_cache.clear()
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=2, stock=12)
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def scan(self, barcode):
+        return self.client.get(f"/api/product-variants/scan/?barcode={barcode}")
+
+    def test_hits_are_cached_and_dropped_on_commit(self):
+        self.assertEqual(self.scan("P-0").data["stock_quantity"], 12)
+        with CaptureQueriesContext(connection) as ctx:
+            self.scan("P-0")
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variants[0].reduce_stock(2)
+        self.assertEqual(self.scan("P-0").data["stock_quantity"], 10)
+
+    def test_rollback_keeps_the_cached_record(self):
+        self.scan("P-0")
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.variants[0].reduce_stock(2)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.scan("P-0").data["stock_quantity"], 12)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_barcode_change_retires_the_old_key(self):
+        self.scan("P-0")
+        variant = ProductVariant.objects.get(pk=self.variants[0].pk)
+        variant.barcode = "NEW"
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.save()
+
+        self.assertEqual(self.scan("P-0").status_code, 404)
+        self.assertEqual(self.scan("NEW").data["id"], variant.pk)
@@ -0,0 +1,144 @@
+from datetime import timedelta
+import sys
+from decimal import Decimal
+
+from django.apps import apps
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos.models import Customer, CustomerPayment, DebtToBePaid, Order
+from pos.reports import STATEMENT_KINDS, statement_opening
+from pos.tests.helpers import make_owner, make_shop
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class StatementPaginationTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.customer = Customer.objects.create(shop=self.shop, name="Customer", phone="1")
+        other = Customer.objects.create(shop=self.shop, name="Other", phone="2")
+        base = timezone.now() - timedelta(days=30)
+        entries = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(23):
+                at = base + timedelta(hours=i // 2)  # pairs share a timestamp, so ties break on kind and id
+                order = Order.objects.create(
+                    shop=self.shop, customer=self.customer, total_price=Decimal("10.50"), paid_amount=Decimal("4.00"),
+                    created_at=at,
+                )
+                entries.append((at, 0, order.pk, Decimal("10.50"), Decimal("4.00")))
+                # the order's own debt is already in the order row
+                DebtToBePaid.objects.create(
+                    shop=self.shop, customer=self.customer, order=order, amount=Decimal("6.50"),
+                    remaining_amount=Decimal("6.50"), created_at=at,
+                )
+                if i % 3 == 0:
+                    debt = DebtToBePaid.objects.create(
+                        shop=self.shop, customer=self.customer, amount=Decimal("7.00"),
+                        remaining_amount=Decimal("7.00"), created_at=at,
+                    )
+                    entries.append((at, 1, debt.pk, Decimal("7.00"), Decimal("0.00")))
+                if i % 4 == 0:
+                    payment = CustomerPayment.objects.create(
+                        shop=self.shop, customer=self.customer, amount=Decimal("3.25"), created_at=at,
+                    )
+                    entries.append((at, 2, payment.pk, Decimal("0.00"), Decimal("3.25")))
+            Order.objects.create(shop=self.shop, customer=self.customer, total_price=Decimal("99.00"), status="Cancelled")
+            Order.objects.create(shop=self.shop, customer=other, total_price=Decimal("55.00"))
+
+        balance, self.expected = Decimal("0.00"), []
+        for at, rank, pk, debit, credit in sorted(entries, key=lambda entry: entry[:3]):
+            balance += debit - credit
+            self.expected.append((STATEMENT_KINDS[rank], pk, f"{balance:.2f}"))
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def walk(self, descending, limit=7):
+        url = f"/api/customers/{self.customer.pk}/statement/"
+        params = {"limit": limit, **({"order": "desc"} if descending else {})}
+        rows, pages = [], 0
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.data)
+            rows += [(row["type"], row["reference"], row["balance"]) for row in response.data["results"]]
+            pages += 1
+            if not response.data["next"]:
+                return rows, pages
+            params["cursor"] = response.data["next"]
+
+    def test_oldest_first_pages_carry_the_running_balance(self):
+        rows, pages = self.walk(descending=False)
+        self.assertEqual(rows, self.expected)
+        self.assertEqual(pages, -(-len(self.expected) // 7))
+
+    def test_newest_first_pages_count_down_from_the_closing_balance(self):
+        rows, _ = self.walk(descending=True)
+        self.assertEqual(rows, self.expected[::-1])
+
+    def test_cursor_is_bound_to_its_statement(self):
+        url = f"/api/customers/{self.customer.pk}/statement/"
+        self.assertEqual(self.client.get(url, {"cursor": "junk"}).status_code, 400)
+        cursor = self.client.get(url, {"limit": 3}).data["next"]
+        self.assertEqual(self.client.get(url, {"cursor": cursor, "order": "desc"}).status_code, 400)
+
+    def test_closing_balance_matches_total_debt_after_a_payment(self):
+        # the fixture's payments never touched the debts; only payments made through apply_payment do
+        CustomerPayment.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f"/api/customers/{self.customer.pk}/pay/", {"amount": "20"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        newest = self.client.get(
+            f"/api/customers/{self.customer.pk}/statement/", {"order": "desc", "limit": 1}
+        ).data
+        self.assertEqual((newest["results"][0]["type"], newest["results"][0]["credit"]), ("payment", "20.00"))
+        self.assertEqual(newest["results"][0]["balance"], newest["customer"]["total_debt"])
+
+
+def backfill_customer_payments():
+    # looked up by name, since migration modules cannot be imported directly
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    migration = next(
+        migration for (app, name), migration in loader.disk_migrations.items()
+        if app == "pos" and name.endswith("_backfill_customer_payments")
+    )
+    return sys.modules[type(migration).__module__].backfill_customer_payments(apps, None)
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class PaymentBackfillTests(TestCase):
+    def test_closing_balance_matches_total_debt(self):
+        shop = make_shop()
+        customer = Customer.objects.create(shop=shop, name="Customer", phone="1")
+        with self.captureOnCommitCallbacks(execute=True):
+            # a 100 order with 30 paid upfront, as checkout records it
+            order = Order.objects.create(shop=shop, customer=customer, total_price=Decimal("100.00"), paid_amount=Decimal("30.00"))
+            order_debt = DebtToBePaid.objects.create(
+                shop=shop, customer=customer, order=order, amount=Decimal("100.00"),
+                paid_amount=Decimal("30.00"), remaining_amount=Decimal("70.00"),
+            )
+            loose_debt = DebtToBePaid.objects.create(
+                shop=shop, customer=customer, amount=Decimal("50.00"), remaining_amount=Decimal("50.00"),
+            )
+        # paid before payments were recorded: 10 more on the order, 20 on the loose debt
+        DebtToBePaid.objects.filter(pk=order_debt.pk).update(
+            paid_amount=Decimal("40.00"), remaining_amount=Decimal("60.00"), status="PARTIAL"
+        )
+        DebtToBePaid.objects.filter(pk=loose_debt.pk).update(
+            paid_amount=Decimal("20.00"), remaining_amount=Decimal("30.00"), status="PARTIAL"
+        )
+        customer.recalculate_debt()
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.apply_payment("5")  # recorded already, so not backfilled again
+
+        backfill_customer_payments()
+        customer.refresh_from_db()
+        self.assertEqual(customer.total_debt, Decimal("85.00"))
+        self.assertEqual(
+            sorted(CustomerPayment.objects.values_list("amount", flat=True)), [Decimal("5.00"), Decimal("30.00")]
+        )
+        self.assertEqual(statement_opening(customer.pk), customer.total_debt)
+
+        backfill_customer_payments()
+        self.assertEqual(CustomerPayment.objects.count(), 2)
@@ -0,0 +1,104 @@
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos.models import LowStockEntry, Product, ProductVariant, StockMovement, User
+from pos.serializers import OrderSerializer
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+class StockEngineTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=3, stock=10)
+
+    def stock(self, variant):
+        return ProductVariant.objects.values_list("stock_quantity", flat=True).get(pk=variant.pk)
+
+    def total_stock(self):
+        return Product.objects.values_list("total_stock", flat=True).get(pk=self.product.pk)
+
+    def test_deltas_update_variants_total_stock_and_ledger(self):
+        a, b, c = self.variants
+        ProductVariant.objects.apply_stock_deltas({a.pk: -4, b.pk: 6, c.pk: 0}, reason="ADJUSTMENT", reference="t:1")
+
+        self.assertEqual((self.stock(a), self.stock(b), self.stock(c)), (6, 16, 10))
+        self.assertEqual(self.total_stock(), 32)
+        moves = StockMovement.objects.filter(reference="t:1")
+        self.assertEqual(sorted(moves.values_list("variant_id", "delta")), sorted([(a.pk, -4), (b.pk, 6)]))
+        self.assertEqual({m.shop_id for m in moves}, {self.shop.pk})
+
+    def test_decrement_below_zero_rolls_back(self):
+        a, b, _ = self.variants
+        with self.assertRaises(ValueError):
+            ProductVariant.objects.reduce_stock_bulk([(a, 3), (b, 11)])
+
+        self.assertEqual((self.stock(a), self.stock(b)), (10, 10))
+        self.assertEqual(self.total_stock(), 30)
+        self.assertFalse(StockMovement.objects.filter(reason="SALE").exists())
+
+    def test_pack_sale_reduces_linked_single(self):
+        single = self.variants[0]
+        pack = ProductVariant.objects.create(
+            product=self.product, color=single.color, is_pack=True, units_per_pack=6, stock_quantity=2,
+            purchase_price=Decimal("12.00"), sale_price=Decimal("1.00"), pack_sale_price=Decimal("25.00"), single_sale_price=Decimal("5.00"),
+            linked_single_variant=single,
+        )
+        serializer = OrderSerializer(data={"shop": self.shop.pk, "items": [{"variant": pack.pk, "quantity": 1}]})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+
+        self.assertEqual((self.stock(pack), self.stock(single)), (1, 4))
+        self.assertEqual(self.total_stock(), 30 + 2 - 1 - 6)
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(reference=f"order:{order.pk}").values_list("variant_id", "delta")),
+            sorted([(pack.pk, -1), (single.pk, -6)]),
+        )
+
+    def test_restock_and_low_stock_watchlist(self):
+        a = self.variants[0]
+        a.reduce_stock(10)
+        self.assertTrue(LowStockEntry.objects.filter(variant=a).exists())
+        a.increase_stock(20)
+        self.assertFalse(LowStockEntry.objects.filter(variant=a).exists())
+        self.assertEqual(self.stock(a), 20)
+        self.assertEqual(self.total_stock(), 40)
+        self.assertEqual(
+            list(StockMovement.objects.filter(variant=a).exclude(reason="INITIAL").values_list("reason", "delta")),
+            [("SALE", -10), ("RESTOCK", 20)],
+        )
+
+    def test_restock_reads_the_locked_row_not_a_stale_instance(self):
+        a = self.variants[0]
+        a.increase_stock(10)
+        stale = ProductVariant.objects.get(pk=a.pk)  # holds 20
+        a.reduce_stock(18)  # a sale elsewhere leaves 2, on the watchlist
+        self.assertTrue(LowStockEntry.objects.filter(variant=a).exists())
+
+        stale.increase_stock(15)
+        self.assertEqual((stale.stock_quantity, self.stock(a)), (17, 17))
+        self.assertFalse(LowStockEntry.objects.filter(variant=a).exists())
+
+
+class StockOnDateTests(TestCase):
+    def test_user_without_a_shop_is_refused(self):
+        shop = make_shop()
+        make_catalog(shop)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="m", password="x", role="FINANCE"))
+        response = client.get(f"/api/stock-movements/on-date/?date={timezone.localdate()}")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_shop_user_sees_own_stock(self):
+        shop = make_shop()
+        make_catalog(shop, n=2, stock=4)
+        make_catalog(make_shop("Other"), n=1, stock=50, name="Q")
+        client = APIClient()
+        client.force_authenticate(make_owner(shop))
+        response = client.get(f"/api/stock-movements/on-date/?date={timezone.localdate()}")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["total_units"], 8)
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pos.models import Customer, DebtToBePaid, Order, ProductVariant
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=2, stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(make_owner(self.shop))
+
+    def sync(self, orders, client=None, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post("/api/orders/sync/", {"orders": orders, **extra}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return [result["status"] for result in response.data["results"]]
+
+    def sale(self, ref, quantity=1, **fields):
+        return {"client_ref": ref, "items": [{"variant": self.variants[0].pk, "quantity": quantity}], **fields}
+
+    def test_refs_are_synced_once(self):
+        self.assertEqual(self.sync([self.sale("a"), self.sale("b"), self.sale("a")]), ["created", "created", "duplicate"])
+        self.assertEqual(self.sync([self.sale("a"), self.sale("c")]), ["duplicate", "created"])
+
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 7)
+
+    def test_refs_are_scoped_to_the_shop(self):
+        self.sync([self.sale("a")])
+        other_shop = make_shop("Other")
+        _, other_variants = make_catalog(other_shop, n=1, stock=5, name="Q")
+        other = APIClient()
+        other.force_authenticate(make_owner(other_shop, "other"))
+        sale = {"client_ref": "a", "items": [{"variant": other_variants[0].pk, "quantity": 1}]}
+
+        self.assertEqual(self.sync([sale], client=other), ["created"])
+        self.assertEqual(Order.objects.filter(shop=other_shop).count(), 1)
+
+    def test_conflicts_are_rejected_or_accepted(self):
+        self.assertEqual(self.sync([self.sale("a", 8), self.sale("b", 5)]), ["created", "conflict"])
+        self.assertEqual(self.sync([self.sale("b", 5)], on_conflict="accept"), ["created"])
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[0].pk).stock_quantity, 0)
+
+    def test_orders_keep_the_terminal_sale_time(self):
+        sold_at = timezone.now().replace(microsecond=0) - timedelta(days=3)
+        future = timezone.now() + timedelta(days=1)
+        customer = Customer.objects.create(shop=self.shop, name="c", phone="1")
+        self.sync([
+            self.sale("a", created_at=sold_at.isoformat(), customer_id=customer.pk),
+            self.sale("b", created_at=future.isoformat()),
+        ])
+
+        order = Order.objects.get(idempotency_keys__key="a")
+        self.assertEqual(order.created_at, sold_at)
+        self.assertEqual(DebtToBePaid.objects.get(order=order).created_at, sold_at)
+        self.assertLessEqual(Order.objects.get(idempotency_keys__key="b").created_at, timezone.now())
+        self.assertEqual(self.sync([self.sale("c", created_at="yesterday")]), ["invalid"])
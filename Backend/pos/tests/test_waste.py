@@ -0,0 +1,50 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from pos.models import ProductVariant, User, WasteProduct
+from pos.tests.helpers import make_catalog, make_owner, make_shop
+
+
+@override_settings(JOB_QUEUE_EAGER=True)
+class WasteBulkTests(TestCase):
+    def setUp(self):
+        self.shop = make_shop()
+        self.product, self.variants = make_catalog(self.shop, n=2, stock=10)
+        self.other_shop = make_shop("Other")
+        _, self.other_variants = make_catalog(self.other_shop, n=1, stock=10, name="Q")
+
+    def post(self, user, variants, **extra):
+        client = APIClient()
+        client.force_authenticate(user)
+        items = [{"variant_id": v.pk, "quantity": 2, "reason": "expired"} for v in variants]
+        return client.post("/api/waste-products/bulk/", {"items": items, **extra}, format="json")
+
+    def test_shop_user_records_own_variants_only(self):
+        owner = make_owner(self.shop)
+        self.assertEqual(self.post(owner, self.variants).status_code, 201)
+        self.assertEqual(self.post(owner, self.other_variants).status_code, 400)
+
+        self.assertEqual(WasteProduct.objects.filter(shop=self.shop).count(), 2)
+        self.assertEqual(ProductVariant.objects.get(pk=self.other_variants[0].pk).stock_quantity, 10)
+
+    def test_super_admin_must_name_the_shop(self):
+        admin = User.objects.create_user(username="root", password="x", role="SUPER_ADMIN")
+
+        self.assertEqual(self.post(admin, self.variants).status_code, 400)
+        self.assertEqual(self.post(admin, self.other_variants, shop_id=self.shop.pk).status_code, 400)
+        response = self.post(admin, self.variants, shop_id=self.shop.pk)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertFalse(WasteProduct.objects.filter(shop__isnull=True).exists())
+
+    def test_bulk_created_lines_edit_by_the_difference(self):
+        a, b = self.variants
+        wastes = WasteProduct.record_bulk(self.shop, [(a.pk, 2, "expired"), (b.pk, 3, "broken")])
+        first, second = wastes
+        self.assertEqual(ProductVariant.objects.get(pk=a.pk).stock_quantity, 8)
+
+        first.quantity = 5
+        first.save()
+        self.assertEqual(ProductVariant.objects.get(pk=a.pk).stock_quantity, 5)
+
+        second.delete()
+        self.assertEqual(ProductVariant.objects.get(pk=b.pk).stock_quantity, 10)
@@ -5,7 +5,8 @@ from .views import (
      LowStockVariantReportView, UserViewSet, ShopViewSet, CustomerViewSet, DebtToBePaidViewSet,
     ContentViewSet, BannerViewSet, MonthlyTotalPayrollView ,
     CategoryViewSet, BrandViewSet, ColorViewSet, SizeViewSet, SupplierViewSet,
-    ProductViewSet, WasteProductViewSet, OrderViewSet, ShopReportView, ProductVariantViewSet, ExpenseViewSet, AdjustmentViewSet
+    ProductViewSet, WasteProductViewSet, OrderViewSet, ShopReportView, ProductVariantViewSet, ExpenseViewSet, AdjustmentViewSet,
+    StockMovementViewSet, ReportJobViewSet, AgingReportView
 )
 from .views import ShopViewSet, UserViewSet, EmployeeViewSet, AttendanceViewSet, PerformanceViewSet, PayrollViewSet, SignupView, LoginView
 router = DefaultRouter()
@@ -26,6 +27,8 @@ router.register(r"orders", OrderViewSet, basename="orders")
 router.register(r'product-variants', ProductVariantViewSet)
 router.register(r'expenses', ExpenseViewSet, basename='expense')
 router.register(r'adjustments', AdjustmentViewSet, basename='adjustment')
+router.register(r'stock-movements', StockMovementViewSet, basename='stockmovement')
+router.register(r'report-jobs', ReportJobViewSet, basename='reportjob')
 ################### Employee #####################
 
 router.register(r'employees', EmployeeViewSet)
@@ -35,6 +38,7 @@ router.register(r'payrolls', PayrollViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('shop_report/', ShopReportView.as_view(), name='shop_report'),
+    path('aging/', AgingReportView.as_view(), name='aging-report'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('low-stock/', LowStockVariantReportView.as_view(), name='low-stock-list'),
     path('payrolls/total/', MonthlyTotalPayrollView.as_view(), name='total-monthly-payroll'),
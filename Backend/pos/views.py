@@ -5,6 +5,7 @@ from rest_framework import viewsets, permissions, generics, status
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from datetime import date, timedelta
+from django.utils.dateparse import parse_datetime
 import json
 from decimal import ROUND_UP, Decimal
 from rest_framework.views import APIView
@@ -15,6 +16,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import DebtToPaySerializer, LowStockVariantSerializer, UserSignupSerializer, UserLoginSerializer
 from rest_framework import viewsets, filters
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from django.db.models import F, Sum, DecimalField, Value, Case, When
 from django.db.models.functions import Coalesce  # ✅ THIS WAS MISSING
 from decimal import Decimal
@@ -23,7 +25,8 @@ from .models import (
     Shop, Content, Banner,
     Category, Brand, Color, Size, Supplier,
     Product, WasteProduct, OrderItem, Order,Holiday ,
-    Expense, Adjustment, DebtToBePaid, DebtToPay    # make sure these models exist in models.py
+    Expense, Adjustment, DebtToBePaid, DebtToPay,    # make sure these models exist in models.py
+    ProductVariant, StockMovement, StockSnapshot, CatalogTombstone, ReportJob, ForecastRun
 )
 from rest_framework.permissions import AllowAny
 from .serializers import (
@@ -31,11 +34,15 @@ from .serializers import (
     ContentSerializer, BannerSerializer,
     CategorySerializer, BrandSerializer, ColorSerializer, SizeSerializer,
     SupplierSerializer, ProductSerializer, WasteProductSerializer,
-    ShopReportSerializer, OrderSerializer, CustomerSerializer, DebtToBePaidSerializer
+    ShopReportSerializer, OrderSerializer, CustomerSerializer, DebtToBePaidSerializer,
+    StockMovementSerializer, WasteBulkLineSerializer,
+    CatalogProductSerializer, CatalogVariantSerializer, ReportJobSerializer, ForecastRunSerializer,
+    SupplierLedgerEntrySerializer
 )
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from .utils import get_tokens_for_user
 from .permissions import IsAdminOrHigher
+from .forecast import purchase_orders
 
 User = get_user_model()
 
@@ -128,11 +135,72 @@ class BrandViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
 
 
+class SupplierLedgerPagination(CursorPagination):
+    ordering = ("-created_at", "-id")
+    page_size = 50
+
+
 class SupplierViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
-    queryset = Supplier.objects.all()
+    queryset = Supplier.objects.select_related("shop")
     serializer_class = SupplierSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
 
+    def get_queryset(self):
+        # balances come from one grouped query; shop users only see their shop's debts
+        user = self.request.user
+        shop_id = None
+        if not (user.is_superuser or getattr(user, "is_super_admin", lambda: False)()):
+            shop_id = user.shop_id
+        return super().get_queryset().with_balances(shop_id=shop_id).order_by("name", "id")
+
+    @action(detail=True, methods=["get"])
+    def ledger(self, request, pk=None):
+        """The supplier's debts newest first (cursor-paginated), with its balances."""
+        supplier = self.get_object()
+        entries = DebtToPay.objects.filter(supplier=supplier).select_related("product")
+        user = request.user
+        if not (user.is_superuser or getattr(user, "is_super_admin", lambda: False)()):
+            entries = entries.filter(shop_id=user.shop_id)
+
+        paginator = SupplierLedgerPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        response = paginator.get_paginated_response(SupplierLedgerEntrySerializer(page, many=True).data)
+        response.data["supplier"] = self.get_serializer(supplier).data
+        return response
+
+    @action(detail=False, methods=["get"], url_path="purchase-suggestions")
+    def purchase_suggestions(self, request):
+        """
+        Draft purchase orders per supplier from the shop's latest forecast run:
+        packs ordered as suggested, singles rounded up to their linked pack size.
+        Narrow to one supplier with ?supplier=<id>.
+        """
+        user = request.user
+        shop_id = getattr(user, "shop_id", None)
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id") or None
+        if not shop_id:
+            return Response({"detail": "shop_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            shop_id = int(shop_id)
+            supplier_id = request.query_params.get("supplier")
+            supplier_id = int(supplier_id) if supplier_id else None
+        except ValueError:
+            return Response({"detail": "shop_id and supplier must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        run = ForecastRun.latest_for(shop_id)
+        if run is None:
+            if not Shop.objects.filter(pk=shop_id).exists():
+                return Response({"detail": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
+            run = ForecastRun.compute(shop_id)
+
+        orders = purchase_orders(run, supplier_id=supplier_id)
+        return Response({
+            "run": ForecastRunSerializer(run).data,
+            "total_estimated_cost": f"{sum((Decimal(o['estimated_cost']) for o in orders), Decimal('0.00')):.2f}",
+            "purchase_orders": orders,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=["post"])
     def pay(self, request, pk=None):
         supplier = self.get_object()
@@ -146,34 +214,27 @@ class SupplierViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
         except:
             return Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Find unpaid or partially paid debts for this supplier
-        debts = DebtToPay.objects.filter(supplier=supplier, remaining_amount__gt=0)
+        if amount <= 0:
+            return Response({"error": "Amount must be positive"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not debts.exists():
-            return Response({"message": "No outstanding debts"}, status=status.HTTP_200_OK)
+        user = request.user
+        shop_id = None
+        if not (user.is_superuser or getattr(user, "is_super_admin", lambda: False)()):
+            shop_id = user.shop_id
 
-        total_remaining = sum([d.remaining_amount for d in debts])
-        remaining = amount
-
-        for debt in debts:
-            if remaining <= 0:
-                break
-            if remaining >= debt.remaining_amount:
-                remaining -= debt.remaining_amount
-                debt.paid_amount += debt.remaining_amount
-                debt.remaining_amount = 0
-                debt.status = "PAID"
-            else:
-                debt.paid_amount += remaining
-                debt.remaining_amount -= remaining
-                debt.status = "PARTIAL"
-                remaining = 0
-            debt.save()
+        # locked, oldest-first allocation written with one bulk_update
+        allocations, remaining = supplier.apply_payment(amount, shop_id=shop_id)
+        if not allocations:
+            return Response({"message": "No outstanding debts"}, status=status.HTTP_200_OK)
 
         return Response({
             "supplier": supplier.name,
             "amount_paid": str(amount),
             "remaining_unallocated": str(remaining),
+            "allocations": [
+                {key: str(value) if isinstance(value, Decimal) else value for key, value in allocation.items()}
+                for allocation in allocations
+            ],
             "message": "Payment processed successfully"
         }, status=status.HTTP_200_OK)
     @action(detail=False, methods=["get"])
@@ -218,6 +279,10 @@ from rest_framework.exceptions import ValidationError
 from decimal import Decimal
 
 
+# Catalog sync re-sends rows this close behind the client's watermark
+CATALOG_SYNC_OVERLAP = timedelta(seconds=5)
+
+
 class ProductViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
     queryset = Product.objects.select_related(
         "category", "brand", "supplier", "shop"
@@ -269,6 +334,53 @@ class ProductViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
 
+    # ===========================================
+    # DELTA SYNC
+    # ===========================================
+    @action(detail=False, methods=["get"], url_path="sync")
+    def sync(self, request):
+        """
+        Catalog changes for terminals: GET /products/sync/?since=<watermark>.
+        Returns products and variants updated since the watermark plus the
+        ids deleted since then, and the watermark to send next time.
+        Without since (or once it is older than the tombstone TTL) the whole
+        catalog is returned with "full": true.
+        """
+        watermark = timezone.now()
+        since = request.query_params.get("since")
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error": "since must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        full = since is None or since < CatalogTombstone.retention_start()
+
+        products = self.get_queryset()
+        variants = ProductVariant.objects.select_related("color", "size").filter(product__in=products)
+        tombstones = CatalogTombstone.objects.none()
+        if not full:
+            # Overlap the window so rows committed just behind the last watermark are not missed
+            cutoff = since - CATALOG_SYNC_OVERLAP
+            products = products.filter(updated_at__gte=cutoff)
+            variants = variants.filter(updated_at__gte=cutoff)
+            tombstones = CatalogTombstone.objects.filter(deleted_at__gte=cutoff)
+            user = request.user
+            if not (user.is_superuser or getattr(user, "is_super_admin", lambda: False)()):
+                tombstones = tombstones.filter(shop=user.shop)
+
+        deleted = {"products": [], "variants": []}
+        for kind, object_id in tombstones.values_list("kind", "object_id"):
+            deleted[f"{kind}s"].append(object_id)
+
+        return Response({
+            "full": full,
+            "watermark": watermark,
+            "products": CatalogProductSerializer(products.prefetch_related(None).prefetch_related("colors", "sizes"), many=True).data,
+            "variants": CatalogVariantSerializer(variants, many=True).data,
+            "deleted": deleted,
+        }, status=status.HTTP_200_OK)
+
     # ===========================================
     # DEBT HANDLING
     # ===========================================
@@ -304,11 +416,130 @@ class ProductViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
 # =======================
 # Waste Product
 # =======================
+WASTE_BULK_MAX_LINES = 1000
+
+
 class WasteProductViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
     queryset = WasteProduct.objects.select_related("shop", "variant", "variant__product", "variant__color", "variant__size")
     serializer_class = WasteProductSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
 
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request):
+        """
+        Record an end-of-day waste count in one transaction:
+        {"shop_id": 1, "items": [{"variant_id": 5, "quantity": 2, "reason": "expired"}, ...]}
+        All lines are recorded or none are. shop_id is only read for super admins,
+        who must send it; every variant has to belong to that shop.
+        """
+        items = request.data.get("items")
+        if not isinstance(items, list) or not items:
+            return Response({"error": "items must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > WASTE_BULK_MAX_LINES:
+            return Response(
+                {"error": f"At most {WASTE_BULK_MAX_LINES} lines per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        lines = WasteBulkLineSerializer(data=items, many=True)
+        lines.is_valid(raise_exception=True)
+
+        user = request.user
+        shop = user.shop
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            try:
+                shop_id = int(request.data.get("shop_id"))
+            except (TypeError, ValueError):
+                return Response({"error": "shop_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+            shop = Shop.objects.filter(pk=shop_id).first()
+            if shop is None:
+                return Response({"error": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
+        elif shop is None:
+            return Response({"error": "User is not associated with a shop."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            wastes = WasteProduct.record_bulk(shop, [
+                (line["variant_id"], line["quantity"], line.get("reason"))
+                for line in lines.validated_data
+            ])
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(WasteProductSerializer(wastes, many=True).data, status=status.HTTP_201_CREATED)
+
+
+# =======================
+# Stock ledger
+# =======================
+class StockMovementPagination(CursorPagination):
+    ordering = ("-created_at", "-id")
+    page_size = 100
+
+
+class StockMovementViewSet(ShopRestrictedMixin, viewsets.ReadOnlyModelViewSet):
+    """Append-only stock journal. Filter with ?variant=<id>."""
+    queryset = StockMovement.objects.select_related("variant__product")
+    serializer_class = StockMovementSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
+    pagination_class = StockMovementPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        variant_id = self.request.query_params.get("variant")
+        if variant_id:
+            queryset = queryset.filter(variant_id=variant_id)
+        return queryset
+
+    @action(detail=False, methods=["get"], url_path="on-date")
+    def on_date(self, request):
+        """
+        Stock and inventory value at the close of ?date=YYYY-MM-DD:
+        one snapshot lookup plus the movements recorded after it.
+        """
+        try:
+            day = date.fromisoformat(request.query_params.get("date", ""))
+        except ValueError:
+            return Response({"error": "date is required (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        shop_id = getattr(user, "shop_id", None)
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id") or None
+            if shop_id is not None:
+                try:
+                    shop_id = int(shop_id)
+                except ValueError:
+                    return Response({"error": "Invalid shop_id format."}, status=status.HTTP_400_BAD_REQUEST)
+        elif shop_id is None:
+            # stock_on(shop_id=None) covers every shop
+            return Response({"error": "User is not associated with a shop."}, status=status.HTTP_403_FORBIDDEN)
+
+        levels = StockSnapshot.stock_on(day, shop_id=shop_id)
+        variants = ProductVariant.objects.filter(pk__in=levels).values_list(
+            "pk", "product__name", "purchase_price"
+        )
+
+        rows = []
+        total_value = Decimal("0.00")
+        for pk, product_name, cost in variants:
+            quantity = levels[pk]
+            value = quantity * (cost or Decimal("0.00"))
+            total_value += value
+            rows.append({
+                "variant_id": pk,
+                "product_name": product_name,
+                "quantity": quantity,
+                "unit_cost": f"{cost or 0:.2f}",
+                "value": f"{value:.2f}",
+            })
+
+        return Response({
+            "date": day,
+            "total_units": sum(r["quantity"] for r in rows),
+            "total_value": f"{total_value:.2f}",
+            "variants": rows,
+        }, status=status.HTTP_200_OK)
+
 
 #======================Low Stock ==============
 import pandas as pd
@@ -316,77 +547,69 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import HttpResponse
-from .models import ProductVariant
+from django.db.models import Avg, Count, FloatField
+from .exports import export_response
+from .models import ProductVariant, LowStockEntry
 from .serializers import LowStockVariantSerializer
 
 class LowStockVariantReportView(APIView):
     """
-    Returns low-stock variants with analytics.
-    Optional CSV or Excel export via ?export=csv or ?export=excel
+    Returns low-stock variants with analytics, read from the per-shop watchlist
+    (variants at or below their own low_stock_threshold).
+    ?threshold=N narrows the list further to stock <= N.
+    Optional CSV or Excel export via ?export=csv or ?export=excel, streamed row by row
     """
 
     def get(self, request):
-        # Threshold
-        threshold = request.query_params.get("threshold", 10)
-        try:
-            threshold = int(threshold)
-        except ValueError:
-            threshold = 10
+        user = request.user
+        entries = LowStockEntry.objects.all()
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id")
+            if shop_id:
+                entries = entries.filter(shop_id=shop_id)
+        else:
+            entries = entries.filter(shop=user.shop)
+
+        threshold = request.query_params.get("threshold")
+        if threshold:
+            try:
+                entries = entries.filter(variant__stock_quantity__lte=int(threshold))
+            except ValueError:
+                pass
 
         # Export type
         export_type = request.query_params.get("export", None)  # "csv" or "excel"
 
-        # Fetch variants
-        variants_qs = ProductVariant.objects.filter(
-            stock_quantity__lte=threshold
-        ).select_related("product", "color", "size")
+        # Analytics in SQL
+        totals = entries.aggregate(
+            total_stock_value=Coalesce(
+                Sum(F("variant__stock_quantity") * F("variant__purchase_price"), output_field=DecimalField()),
+                Value(Decimal("0")),
+                output_field=DecimalField(),
+            ),
+            average_stock_quantity=Coalesce(Avg("variant__stock_quantity"), Value(0.0), output_field=FloatField()),
+            low_stock_count=Count("id"),
+        )
+        analytics = {
+            "total_stock_value": float(totals["total_stock_value"]),
+            "average_stock_quantity": float(totals["average_stock_quantity"]),
+            "low_stock_count": totals["low_stock_count"],
+        }
 
-        serializer = LowStockVariantSerializer(variants_qs, many=True)
-        variant_list = serializer.data
+        entries = entries.select_related("variant__product", "variant__color", "variant__size").order_by("since")
 
-        # Load into Pandas
-        df = pd.DataFrame(variant_list)
+        if export_type in ("csv", "excel", "xlsx"):
+            columns = list(LowStockVariantSerializer.Meta.fields)
+            header = [*columns, 'suggested_restock']
 
-        # Ensure numeric columns exist and are clean
-        for col in ['stock_quantity', 'purchase_price']:
-            if col not in df.columns:
-                df[col] = 0
-            else:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-        # Analytics calculation
-        if not df.empty:
-            analytics = {
-                "total_stock_value": float((df['stock_quantity'] * df['purchase_price']).sum()),
-                "average_stock_quantity": float(df['stock_quantity'].mean()),
-                "low_stock_count": len(df)
-            }
-        else:
-            analytics = {
-                "total_stock_value": 0,
-                "average_stock_quantity": 0,
-                "low_stock_count": 0
-            }
+            def rows():
+                for entry in entries.iterator(chunk_size=2000):
+                    data = LowStockVariantSerializer(entry.variant).data
+                    yield [('' if data[c] is None else data[c]) for c in columns] + [0]
+
+            return export_response(export_type, "low_stock_report", "Low Stock Variants", header, rows())
 
-        # Suggested restock (optional)
-        df['suggested_restock'] = (df['stock_quantity'].apply(int) * 0)  # default 0
-        # Fill any remaining NaN/None for JSON export
-        df = df.fillna('')
-
-        # Export CSV
-        if export_type == "csv":
-            response = HttpResponse(content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="low_stock_report.csv"'
-            df.to_csv(response, index=False)
-            return response
-
-        # Export Excel
-        if export_type == "excel":
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = 'attachment; filename="low_stock_report.xlsx"'
-            with pd.ExcelWriter(response, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Low Stock Variants')
-            return response
+        variant_list = LowStockVariantSerializer([entry.variant for entry in entries], many=True).data
 
         # Default JSON response
         return Response({
@@ -403,11 +626,31 @@ from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Order, Shop, Customer, DebtToBePaid, OrderItem, ProductVariant
-from .serializers import OrderSerializer
+from django.db import IntegrityError
+from .models import Order, Shop, Customer, DebtToBePaid, OrderItem, ProductVariant, IdempotencyKey, ForecastRun
+from .serializers import OrderSerializer, ForecastRunSerializer, VariantForecastSerializer
+from .jobs import enqueue
+from .reports import schedule_rollup
+from rest_framework.pagination import PageNumberPagination
 from django.db import models
 import pandas as pd
 from datetime import timedelta
+from collections import Counter
+
+# Offline sync: orders accepted per request, and orders committed per transaction
+SYNC_MAX_ORDERS = 1000
+SYNC_CHUNK_SIZE = 50
+
+# Best-selling forecast: longest history window and longest best/low lists
+FORECAST_MAX_MONTHS = 12
+FORECAST_MAX_TOP = 100
+
+
+class ForecastPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all().prefetch_related('items__variant')
@@ -427,20 +670,80 @@ class OrderViewSet(viewsets.ModelViewSet):
             return base_queryset.filter(shop=user.shop)
         return Order.objects.none()
 
+    def create(self, request, *args, **kwargs):
+        """
+        Honors an optional Idempotency-Key header: a retried POST with the same
+        key replays the stored response without touching stock or debt again.
+        """
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"detail": "Idempotency-Key is too long."}, status=status.HTTP_400_BAD_REQUEST)
+
+        request_hash = IdempotencyKey.hash_payload(request.data)
+        user = request.user if request.user.is_authenticated else None
+        shop = self._order_shop(user)
+        if shop is None:
+            return Response({"detail": "No shop to record the order for."}, status=status.HTTP_400_BAD_REQUEST)
+        keys = IdempotencyKey.objects.filter(shop=shop, key=key)
+
+        record = keys.first()
+        if record and record.expires_at <= timezone.now():
+            record.delete()
+            record = None
+        if record:
+            return self._replay_idempotent(record, request_hash)
+
+        try:
+            with transaction.atomic():
+                # Inserted first so a concurrent retry blocks on the unique (shop, key)
+                record = IdempotencyKey.objects.create(
+                    shop=shop,
+                    key=key,
+                    user=user,
+                    request_hash=request_hash,
+                    expires_at=IdempotencyKey.default_expiry(),
+                )
+                response = super().create(request, *args, **kwargs)
+                record.order_id = response.data.get("id")
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.save(update_fields=["order", "response_status", "response_body"])
+        except IntegrityError:
+            record = keys.first()
+            if record is None:
+                raise
+            return self._replay_idempotent(record, request_hash)
+
+        return response
+
+    def _replay_idempotent(self, record, request_hash):
+        if record.request_hash != request_hash:
+            return Response(
+                {"detail": "Idempotency-Key was already used with a different payload."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return Response(
+            record.response_body,
+            status=record.response_status,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    @staticmethod
+    def _order_shop(user):
+        # Ensure shop is handled correctly (e.g., from user or default)
+        return getattr(user, "shop", None) or Shop.objects.first()
+
     @transaction.atomic
     def perform_create(self, serializer):
+        """
+        Only stock and order rows are written under lock here. The customer's
+        total debt is rolled up by a post-commit job (see pos.jobs).
+        """
         user = self.request.user
-        # Ensure shop is handled correctly (e.g., from user or default)
-        shop = getattr(user, "shop", None) or Shop.objects.first()
-
-        # 1. Execute the serializer's create method
-        # This creates Order, OrderItems, calculates total_price, and REDUCES STOCK.
-        order = serializer.save(user=user, shop=shop)
+        shop = self._order_shop(user)
 
-        # 2. Get finalized total price from the order object
-        total_price = order.total_price
-
-        # 3. Handle paid_amount and customer logic
         paid_amount = self.request.data.get("paid_amount", 0)
         customer_id = self.request.data.get("customer_id")
 
@@ -449,144 +752,329 @@ class OrderViewSet(viewsets.ModelViewSet):
         except:
             paid_amount = Decimal('0')
 
-        order.paid_amount = paid_amount
-
-        # 4. Handle Debt creation if necessary
-        if customer_id and paid_amount < total_price:
-            try:
-                customer = Customer.objects.get(id=customer_id, shop=shop)
-                remaining = total_price - paid_amount
-                DebtToBePaid.objects.create(
-                    shop=shop,
-                    customer=customer,
-                    order=order,
-                    amount=total_price,
-                    paid_amount=paid_amount,
-                    remaining_amount=remaining,
-                )
-                order.customer = customer
-            except Customer.DoesNotExist:
-                # Handle case where customer ID is invalid
-                pass
-
-        # 5. Final save for paid_amount and customer linkage
-        update_fields = ['paid_amount']
+        customer = None
         if customer_id:
-             update_fields.append('customer')
+            customer = Customer.objects.filter(id=customer_id, shop=shop).first()
 
-        order.save(update_fields=update_fields)
+        # Creates Order + OrderItems, calculates total_price and REDUCES STOCK in one write per table
+        order = serializer.save(user=user, shop=shop, paid_amount=paid_amount, customer=customer)
+
+        # Debt record for the unpaid part; its signal queues the customer rollup
+        if customer and paid_amount < order.total_price:
+            DebtToBePaid.objects.create(
+                shop=shop,
+                customer=customer,
+                order=order,
+                amount=order.total_price,
+                paid_amount=paid_amount,
+                remaining_amount=order.total_price - paid_amount,
+            )
 
         return order
 
+    # ===========================================
+    # OFFLINE SYNC
+    # ===========================================
+    @action(detail=False, methods=["post"], url_path="sync")
+    def sync(self, request):
+        """
+        Replays sales queued by an offline terminal in one request.
 
-    @action(detail=False, methods=["get"], url_path="best-selling")
-    def get_best_selling_products(self, months_back: int = 2, top_n: int = 10):
-        start_date = timezone.now() - timedelta(days=30 * months_back)
+        Body: {"orders": [{"client_ref", "items": [{"variant", "quantity"}],
+                           "paid_amount", "customer_id", "created_at"}, ...],
+               "on_conflict": "reject" | "accept"}
 
-        qs = (
-            OrderItem.objects
-            .filter(order__created_at__gte=start_date)
-            .values('variant', 'order__created_at')
-            .annotate(quantity_sold=Sum('quantity'))
-            .order_by('variant')
-        )
+        created_at is the terminal's ISO 8601 sale time (default: now; times in
+        the future are clamped to now). client_ref is unique per shop.
 
-        if not qs:
-            return []
+        Stock is checked for the whole batch in one pass and orders are committed
+        in chunks of SYNC_CHUNK_SIZE. With "reject" an order that would oversell is
+        skipped and reported; with "accept" it is recorded anyway (the goods already
+        left the shop) and the oversold variants are floored at zero.
+        """
+        orders = request.data.get("orders")
+        if not isinstance(orders, list) or not orders:
+            return Response({"detail": "orders must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(orders) > SYNC_MAX_ORDERS:
+            return Response({"detail": f"At most {SYNC_MAX_ORDERS} orders per sync."}, status=status.HTTP_400_BAD_REQUEST)
 
-        df = pd.DataFrame(list(qs))
-        df['order__created_at'] = pd.to_datetime(df['order__created_at'])
-        df = df.sort_values(by=['variant', 'order__created_at'])
+        on_conflict = request.data.get("on_conflict", "reject")
+        if on_conflict not in ("reject", "accept"):
+            return Response({"detail": "on_conflict must be 'reject' or 'accept'."}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-        grouped = df.groupby('variant')
+        user = request.user if request.user.is_authenticated else None
+        shop = getattr(user, "shop", None) or Shop.objects.first()
 
-        for variant_id, group in grouped:
-            variant = ProductVariant.objects.filter(id=variant_id).first()
-            if not variant:
-                continue
+        results = [None] * len(orders)
+        parsed = []
+        for idx, raw in enumerate(orders):
+            entry, error = self._parse_sync_order(raw)
+            if error:
+                client_ref = raw.get("client_ref") if isinstance(raw, dict) else None
+                results[idx] = {"index": idx, "client_ref": client_ref, "status": "invalid", "errors": error}
+            else:
+                parsed.append((idx, entry))
 
-            # Aggregate daily sales
-            group = group.groupby(pd.Grouper(key='order__created_at', freq='D'))['quantity_sold'].sum().reset_index()
-            if group.empty:
+        # --- One pass over everything the batch references ---
+        variant_ids = {vid for _, entry in parsed for vid, _ in entry["items"]}
+        known_variants = set(
+            ProductVariant.objects.filter(pk__in=variant_ids, product__shop=shop).values_list("pk", flat=True)
+        )
+        customer_ids = {entry["customer_id"] for _, entry in parsed if entry["customer_id"]}
+        customers = Customer.objects.filter(shop=shop).in_bulk(customer_ids)
+        refs = [entry["client_ref"] for _, entry in parsed if entry["client_ref"]]
+        synced = dict(IdempotencyKey.objects.filter(shop=shop, key__in=refs).values_list("key", "order_id"))
+
+        pending = []
+        for idx, entry in parsed:
+            ref = entry["client_ref"]
+            if ref and ref in synced:
+                results[idx] = {"index": idx, "client_ref": ref, "status": "duplicate", "order_id": synced[ref]}
+                continue
+            unknown = sorted({vid for vid, _ in entry["items"] if vid not in known_variants})
+            if unknown:
+                results[idx] = {"index": idx, "client_ref": ref, "status": "invalid",
+                                "errors": f"Unknown variants for this shop: {unknown}"}
                 continue
+            if ref:
+                synced[ref] = None  # guards against the same ref twice in one batch
+            pending.append((idx, entry))
 
-            group['rolling_mean'] = group['quantity_sold'].rolling(window=7, min_periods=1).mean()
-            group['rolling_std'] = group['quantity_sold'].rolling(window=7, min_periods=1).std().fillna(0)
-
-            last_7_avg = group['rolling_mean'].tail(7).mean()
-            last_30_avg = group['rolling_mean'].tail(30).mean() if len(group) >= 30 else group['rolling_mean'].mean()
-
-            trend_factor = (last_7_avg - last_30_avg) / max(1, last_30_avg)
-            trend_factor = max(min(trend_factor, 0.5), -0.5)  # cap ±50%
-
-            daily_avg = group['quantity_sold'].mean()
-            predicted_next_month = (daily_avg * 30) * (1 + trend_factor)
-
-            volatility = min(group['rolling_std'].mean() / max(1, daily_avg), 0.2)
-            safety_buffer = Decimal(predicted_next_month * volatility)
-
-            total_sold = group['quantity_sold'].sum()
-            avg_monthly_sold = total_sold / months_back
-            current_stock = Decimal(variant.stock_quantity or 0)
-
-            suggested_restock = Decimal(predicted_next_month) + safety_buffer - current_stock
-            upper_cap = Decimal(avg_monthly_sold * 3)
-            suggested_restock = max(Decimal(0), min(suggested_restock, upper_cap))
-            suggested_restock = suggested_restock.quantize(Decimal('1.'), rounding=ROUND_UP)
-
-            # 🧠 Economic intelligence
-            last_sale_date = group['order__created_at'].max()
-            days_since_last_sale = (timezone.now() - last_sale_date).days
-
-            notes = []
-            if total_sold < 10:
-                notes.append("Low Demand")
-            if current_stock > avg_monthly_sold * 2:
-                notes.append("Overstocked")
-            if days_since_last_sale > 45:
-                notes.append("Consider Clearance / Discount")
-            if suggested_restock < 3 and total_sold > 0:
-                suggested_restock = Decimal(3)  # maintain visibility
-
-            results.append({
-                "variant_id": variant.id,
-                "product_name": variant.product.name,
-                "variant_name": str(variant),
-                "current_stock": int(current_stock),
-                f"total_sold_last_{months_back}_months": int(total_sold),
-                "avg_monthly_sold": float(avg_monthly_sold),
-                "predicted_next_month_sales": float(predicted_next_month),
-                "suggested_restock": int(suggested_restock),
-                "notes": notes,
-            })
+        for start in range(0, len(pending), SYNC_CHUNK_SIZE):
+            chunk = pending[start:start + SYNC_CHUNK_SIZE]
+            try:
+                chunk_results = self._sync_chunk(chunk, shop, user, customers, on_conflict)
+            except IntegrityError:
+                # A concurrent sync committed one of these refs first; the client can safely resend
+                chunk_results = [
+                    (idx, {"index": idx, "client_ref": entry["client_ref"], "status": "retry"})
+                    for idx, entry in chunk
+                ]
+            for idx, result in chunk_results:
+                results[idx] = result
 
-        results_sorted = sorted(
-            results,
-            key=lambda x: x[f"total_sold_last_{months_back}_months"],
-            reverse=True
-        )
+        return Response({
+            "results": results,
+            "summary": dict(Counter(r["status"] for r in results)),
+        }, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def _parse_sync_order(raw):
+        """Normalizes one queued order; returns (entry, None) or (None, error)."""
+        if not isinstance(raw, dict):
+            return None, "Order must be an object."
+        items = raw.get("items")
+        if not isinstance(items, list) or not items:
+            return None, "items must be a non-empty list."
 
-        top_selling = results_sorted[:top_n]
-        low_selling = results_sorted[-top_n:]  # bottom N slow movers
+        try:
+            lines = []
+            for item in items:
+                qty = int(item["quantity"])
+                if qty <= 0:
+                    return None, "quantity must be positive."
+                lines.append((int(item["variant"]), qty))
+            paid_amount = Decimal(str(raw.get("paid_amount") or 0))
+            customer_id = int(raw["customer_id"]) if raw.get("customer_id") else None
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            return None, "Malformed order payload."
+
+        created_at = None
+        if raw.get("created_at"):
+            try:
+                created_at = parse_datetime(str(raw["created_at"]))
+            except ValueError:
+                created_at = None
+            if created_at is None:
+                return None, "created_at must be an ISO 8601 datetime."
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+
+        client_ref = raw.get("client_ref")
+        if client_ref is not None:
+            client_ref = str(client_ref)
+            if len(client_ref) > 255:
+                return None, "client_ref is too long."
 
         return {
-            "best_selling": top_selling,
-            "low_selling": low_selling
-        }
+            "client_ref": client_ref,
+            "items": lines,
+            "paid_amount": paid_amount,
+            "customer_id": customer_id,
+            "created_at": created_at,
+            "raw": raw,
+        }, None
+
+    @transaction.atomic
+    def _sync_chunk(self, chunk, shop, user, customers, on_conflict):
+        """Validates a chunk against locked stock and commits it with bulk writes."""
+        locked = ProductVariant.objects.lock_for_stock(
+            {vid for _, entry in chunk for vid, _ in entry["items"]}
+        )
+        available = {pk: v.stock_quantity for pk, v in locked.items()}
+        deltas = defaultdict(int)
+        results = []
+        accepted = []
+
+        for idx, entry in chunk:
+            need = defaultdict(int)
+            for vid, qty in entry["items"]:
+                variant = locked[vid]
+                need[vid] += qty
+                if variant.is_pack and variant.linked_single_variant_id:
+                    need[variant.linked_single_variant_id] += qty * variant.units_per_pack
+
+            conflicts = [
+                {"variant_id": pk, "requested": qty, "available": available[pk]}
+                for pk, qty in need.items() if qty > available[pk]
+            ]
+            if conflicts and on_conflict == "reject":
+                results.append((idx, {"index": idx, "client_ref": entry["client_ref"],
+                                      "status": "conflict", "conflicts": conflicts}))
+                continue
+
+            for pk, qty in need.items():
+                taken = min(qty, available[pk])
+                available[pk] -= taken
+                deltas[pk] -= taken
+            accepted.append((idx, entry, conflicts))
+
+        if not accepted:
+            return results
+
+        ProductVariant.objects.apply_stock_deltas(deltas, locked, reason="SALE", reference="offline-sync")
+
+        orders, items, keys, debts = [], [], [], []
+        touched_customers = set()
+        now = timezone.now()
+        for idx, entry, conflicts in accepted:
+            # dated when the terminal made the sale, so reports and rollups land on the right day
+            created_at = min(entry["created_at"] or now, now)
+            order = Order(shop=shop, user=user, paid_amount=entry["paid_amount"], created_at=created_at)
+            customer = customers.get(entry["customer_id"])
+            if customer:
+                order.customer = customer
+
+            total_price = Decimal("0")
+            for vid, qty in entry["items"]:
+                variant = locked[vid]
+                price, line_total = OrderSerializer.price_line(variant, qty)
+                items.append(OrderSerializer.build_item(order, variant, qty, price))
+                total_price += line_total
+            order.total_price = total_price
+            orders.append(order)
+
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create(items)
+        sold_on = defaultdict(list)
+        for item in items:
+            sold_on[timezone.localdate(item.order.created_at)].append(item.variant_id)
+        for day, variant_ids in sold_on.items():
+            schedule_rollup(shop.pk, day, variant_ids)
+
+        expires_at = IdempotencyKey.default_expiry()
+        for order, (idx, entry, conflicts) in zip(orders, accepted):
+            if entry["client_ref"]:
+                keys.append(IdempotencyKey(
+                    shop=shop,
+                    key=entry["client_ref"],
+                    user=user,
+                    order=order,
+                    request_hash=IdempotencyKey.hash_payload(entry["raw"]),
+                    expires_at=expires_at,
+                ))
+            if order.customer and order.paid_amount < order.total_price:
+                debts.append(DebtToBePaid(
+                    shop=shop,
+                    customer=order.customer,
+                    order=order,
+                    amount=order.total_price,
+                    paid_amount=order.paid_amount,
+                    remaining_amount=order.total_price - order.paid_amount,
+                    created_at=order.created_at,
+                ))
+                touched_customers.add(order.customer.pk)
+
+            result = {"index": idx, "client_ref": entry["client_ref"], "status": "created",
+                      "order_id": order.pk, "total_price": f"{order.total_price:.2f}"}
+            if conflicts:
+                result["conflicts"] = conflicts
+            results.append((idx, result))
+
+        IdempotencyKey.objects.bulk_create(keys)
+        DebtToBePaid.objects.bulk_create(debts)
+        # bulk_create skips the post_save signal, so queue one rollup per affected customer
+        for customer_id in touched_customers:
+            enqueue("customer.recalculate_debt", customer_id=customer_id)
+
+        return results
 
     @action(detail=False, methods=['get'], url_path='best-selling')
     def best_selling(self, request):
-        months_back = int(request.query_params.get('months', 2))
-        top_n = int(request.query_params.get('top', 10))
+        """
+        The shop's latest precomputed forecast (`manage.py compute_forecasts`)
+        over ?months= of history (default 2), best sellers first, or slow movers
+        first with ?order=low. Paginated with ?page= and ?page_size=. A shop
+        without a run for that window yet gets one computed now.
 
-        data = self.get_best_selling_products(months_back=months_back, top_n=top_n)
-        return Response(data, status=status.HTTP_200_OK)
+        The response also keeps the original "best_selling" and "low_selling"
+        lists (?top= rows each, default 10) for clients that read them.
+        """
+        user = request.user
+        shop_id = getattr(user, "shop_id", None)
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id") or None
+        if not shop_id:
+            return Response({"detail": "shop_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            shop_id = int(shop_id)
+        except ValueError:
+            return Response({"detail": "Invalid shop_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            months_back = int(request.query_params.get("months", 2))
+            top_n = int(request.query_params.get("top", 10))
+        except ValueError:
+            return Response({"detail": "months and top must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= months_back <= FORECAST_MAX_MONTHS or not 1 <= top_n <= FORECAST_MAX_TOP:
+            return Response(
+                {"detail": f"months must be 1-{FORECAST_MAX_MONTHS} and top 1-{FORECAST_MAX_TOP}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        run = ForecastRun.latest_for(shop_id, months_back)
+        if run is None:
+            if not Shop.objects.filter(pk=shop_id).exists():
+                return Response({"detail": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
+            run = ForecastRun.compute(shop_id, months_back)
+
+        best_first = ("-total_sold", "variant_id")
+        low_first = ("total_sold", "-variant_id")
+        forecasts = run.forecasts.select_related("variant__product")
+        context = {"months_back": run.months_back}
+
+        paginator = ForecastPagination()
+        ordering = low_first if request.query_params.get("order") == "low" else best_first
+        page = paginator.paginate_queryset(forecasts.order_by(*ordering), request, view=self)
+        response = paginator.get_paginated_response(VariantForecastSerializer(page, many=True, context=context).data)
+        response.data["run"] = ForecastRunSerializer(run).data
+        # slow movers listed the way the original endpoint did: bottom N, highest seller first
+        response.data["best_selling"] = VariantForecastSerializer(
+            forecasts.order_by(*best_first)[:top_n], many=True, context=context
+        ).data
+        response.data["low_selling"] = VariantForecastSerializer(
+            reversed(forecasts.order_by(*low_first)[:top_n]), many=True, context=context
+        ).data
+        return response
 
 
 # =======================
 # Shop Report
 # =======================
+from . import reports
+from .models import DailySalesRollup
+
+
 class ShopReportView(ShopRestrictedMixin, generics.GenericAPIView):
     serializer_class = ShopReportSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
@@ -611,251 +1099,159 @@ class ShopReportView(ShopRestrictedMixin, generics.GenericAPIView):
 
         # --- DATE RANGE ---
         period = request.query_params.get('period', 'monthly')
-        end_date = date.today()
-        start_date = end_date
         try:
-            if period == 'daily':
-                start_date = end_date
-            elif period == 'monthly':
-                start_date = end_date.replace(day=1)
-            elif period == 'yearly':
-                start_date = end_date.replace(month=1, day=1)
-            elif period == 'custom':
-                start_str = request.query_params.get('start_date')
-                end_str = request.query_params.get('end_date')
-                if start_str and end_str:
-                    start_date = date.fromisoformat(start_str)
-                    end_date = date.fromisoformat(end_str)
-                else:
-                    return Response({"error": "Custom requires start_date and end_date."}, status=400)
-            else:
-                return Response({"error": "Invalid period."}, status=400)
-        except ValueError:
-            return Response({"error": "Invalid date format."}, status=400)
+            start_date, end_date = reports.report_range(
+                period, request.query_params.get('start_date'), request.query_params.get('end_date')
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
-        # --- FETCH ORDERS & ITEMS ---
-        completed_orders = Order.objects.filter(
-            shop_id=shop_id, status='COMPLETED', created_at__date__range=(start_date, end_date)
+        try:
+            months = min(max(int(request.query_params.get('months', 6)), 1), 36)
+        except ValueError:
+            months = 6
+
+        # --- EXPORT (?export=csv|xlsx&table=pl|waste), streamed from the database, never cached ---
+        export_type = request.query_params.get('export')
+        if export_type:
+            if export_type not in ('csv', 'xlsx', 'excel'):
+                return Response({"error": "Invalid export type."}, status=400)
+            table = request.query_params.get('table', 'pl')
+            if table == 'pl':
+                header, rows = reports.PL_COLUMNS, reports.pl_rows(shop_id, start_date, end_date)
+            elif table == 'waste':
+                header, rows = reports.WASTE_COLUMNS, reports.waste_rows(shop_id, start_date, end_date)
+            else:
+                return Response({"error": "Invalid table."}, status=400)
+            basename = f"shop_{shop_id}_{table}_{start_date}_{end_date}"
+            return export_response(export_type, basename, table.upper() if table == 'pl' else 'Waste', header, rows)
+
+        # --- CACHED PAYLOAD (keyed on the shop's data_version, so any write invalidates it,
+        # and on today's date, which the monthly comparison runs up to) ---
+        today = timezone.localdate()
+        key = reports.report_cache_key(shop_id, period, start_date, end_date, months, today)
+        payload = reports.cached_report(
+            key, lambda: reports.build_shop_report(shop_id, start_date, end_date, months, today=today)
         )
-        order_items = OrderItem.objects.filter(order__in=completed_orders).select_related('variant__product')
-
-        # --- FETCH WASTE ---
-        waste_records = WasteProduct.objects.filter(
-            shop_id=shop_id, recorded_at__date__range=(start_date, end_date)
-        ).select_related('variant__product')
-
-        # --- FETCH EXPENSES & ADJUSTMENTS ---
-        total_expenses = Expense.objects.filter(
-            shop_id=shop_id, date__range=(start_date, end_date)
-        ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
-
-        total_adjustments = Adjustment.objects.filter(
-            shop_id=shop_id, date__range=(start_date, end_date)
-        ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
-
-        # --- AGGREGATE PER PRODUCT ---
-        pl_data_map = defaultdict(lambda: {
-            'sold': 0,
-            'revenue': Decimal('0.00'),
-            'cogs': Decimal('0.00'),
-            'waste_qty': 0,
-            'waste_loss': Decimal('0.00'),
-            'product': None,
-            'unit_sale_price': Decimal('0.00'),
-            'unit_cogs': Decimal('0.00'),
-        })
+        return Response(payload, status=200)
 
-        for item in order_items:
-            variant = getattr(item, 'variant', None)
-            product = getattr(variant, 'product', None) if variant else None
-            if not variant or not product:
-                continue
 
-            pid = product.id
-            sold_units = item.quantity
+class AgingReportView(APIView):
+    """
+    Receivables (customer debts) and payables (supplier debts) aged into
+    0-30 / 31-60 / 61-90 / 90+ day buckets past due. ?side=receivables or
+    ?side=payables returns one side only; super admins pick ?shop_id=.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
 
-            if variant.is_pack and variant.units_per_pack:
-                num_packs = sold_units // variant.units_per_pack
-                leftover_units = sold_units % variant.units_per_pack
+    def get(self, request):
+        user = request.user
+        shop_id = getattr(user, "shop_id", None)
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id") or None
+            if shop_id is not None:
+                try:
+                    shop_id = int(shop_id)
+                except ValueError:
+                    return Response({"error": "Invalid Shop ID format."}, status=status.HTTP_400_BAD_REQUEST)
+        elif shop_id is None:
+            return Response({"error": "User is not associated with a shop."}, status=status.HTTP_403_FORBIDDEN)
+
+        side = request.query_params.get("side")
+        sides = [side] if side else ["receivables", "payables"]
+        today = timezone.localdate()
+        try:
+            data = {name: reports.aging(name, shop_id=shop_id, today=today) for name in sides}
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"as_of": today, **data}, status=status.HTTP_200_OK)
 
-                revenue = (num_packs * variant.pack_sale_price) + (leftover_units * variant.single_sale_price)
-                unit_sale_price = revenue / sold_units  # average price per unit
-            else:
-                revenue = sold_units * (variant.single_sale_price or variant.sale_price or Decimal('0.00'))
-                unit_sale_price = variant.single_sale_price or variant.sale_price or Decimal('0.00')
-
-            # Cost per unit
-            cogs_per_unit = variant.purchase_price or Decimal('0.00')
-
-            # Update PL map
-            pl_data_map[pid]['sold'] += sold_units
-            pl_data_map[pid]['revenue'] += revenue
-            pl_data_map[pid]['cogs'] += sold_units * cogs_per_unit
-            pl_data_map[pid]['product'] = product
-            pl_data_map[pid]['unit_sale_price'] = unit_sale_price
-            pl_data_map[pid]['unit_cogs'] = cogs_per_unit
-
-
-        # --- CALCULATE TOTALS FROM PL MAP ---
-        total_revenue = sum(d['revenue'] for d in pl_data_map.values())
-        total_cogs = sum(d['cogs'] for d in pl_data_map.values())
-        total_waste_loss = sum(d['waste_loss'] for d in pl_data_map.values())
-        gross_profit = total_revenue - total_cogs - total_waste_loss
-        net_profit = gross_profit - total_expenses + total_adjustments
-
-        # --- PROFIT & PL DETAILS ---
-        pl_details = []
-        for d in pl_data_map.values():
-            product = d.get('product')
-            if not product:
-                continue
-            revenue = d['revenue']
-            cogs = d['cogs']
-            waste_loss = d['waste_loss']
-            profit = revenue - (cogs + waste_loss)
-
-            pl_details.append({
-                'product_name': product.name,
-                'sku': str(product.id),
-                'quantity_sold': d['sold'],
-                'unit_sale_price': f"{d['unit_sale_price']:.2f}",
-                'unit_cogs': f"{d['unit_cogs']:.2f}",
-                'waste_qty': d['waste_qty'],
-                'waste_loss': f"{waste_loss:.2f}",
-                'revenue': f"{revenue:.2f}",
-                'cogs': f"{cogs:.2f}",
-                'profit': f"{profit:.2f}",
-            })
 
-        best_selling = sorted(pl_details, key=lambda x: x['quantity_sold'], reverse=True)[:10]
-        low_selling = sorted(pl_details, key=lambda x: x['quantity_sold'])[:10]
-
-        # --- WASTE DETAILS ---
-        waste_details = []
-        for r in waste_records:
-            variant = getattr(r, 'variant', None)
-            product = getattr(variant, 'product', None) if variant else None
-            unit_price = getattr(product, 'purchase_price', Decimal('0.00')) if product else Decimal('0.00')
-            waste_details.append({
-                'date': r.recorded_at.date(),
-                'product_name': product.name if product else f"Variant {variant.id}",
-                'sku': product.id if product else f"variant_{variant.id}",
-                'category': getattr(getattr(product, 'category', None), 'name', 'N/A') if product else 'N/A',
-                'quantity': r.quantity,
-                'unit_purchase_price': f"{unit_price:.2f}",
-                'loss_value': f"{r.quantity * unit_price:.2f}",
-                'reason': r.reason,
-            })
+class ReportJobViewSet(ShopRestrictedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Shop reports built in the background, for ranges too long for a request.
 
-        # --- MONTHLY COMPARISON (last 6 months) ---
-        monthly_comparison = []
-        for i in range(5, -1, -1):
-            month_start = (date.today().replace(day=1) - relativedelta(months=i)).replace(day=1)
-            month_end = (month_start + relativedelta(months=1)) - timedelta(days=1)
-            month_items = OrderItem.objects.filter(
-                order__shop_id=shop_id,
-                order__status='COMPLETED',
-                order__created_at__date__range=(month_start, month_end)
-            ).select_related('variant__product')
-
-            month_pl_map = defaultdict(lambda: {'revenue': Decimal('0.00'), 'cogs': Decimal('0.00'), 'waste_loss': Decimal('0.00')})
-            for item in month_items:
-                variant = getattr(item, 'variant', None)
-                product = getattr(variant, 'product', None) if variant else None
-                if not variant or not product:
-                    continue
-                sold_units = item.quantity
-
-                if variant.is_pack and variant.units_per_pack:
-                    num_packs = sold_units // variant.units_per_pack
-                    leftover_units = sold_units % variant.units_per_pack
-                    revenue = (num_packs * variant.pack_sale_price) + (leftover_units * (variant.single_sale_price or variant.sale_price or Decimal('0.00')))
-                else:
-                    revenue = sold_units * (variant.single_sale_price or variant.sale_price or Decimal('0.00'))
-
-                cogs = sold_units * (variant.purchase_price or Decimal('0.00'))
-
-                month_pl_map[product.id]['revenue'] += revenue
-                month_pl_map[product.id]['cogs'] += cogs
-
-
-            month_revenue = sum(d['revenue'] for d in month_pl_map.values())
-            month_cogs = sum(d['cogs'] for d in month_pl_map.values())
-            month_waste = sum(d['waste_loss'] for d in month_pl_map.values())
-            month_gross = month_revenue - month_cogs - month_waste
-            month_net = month_gross  # can subtract expenses if needed
-
-            monthly_comparison.append({
-                'month_name': month_start.strftime('%b'),
-                'revenue': float(month_revenue),
-                'gross_profit': float(month_gross),
-                'net_profit': float(month_net),
-            })
+    POST {shop_id, period, start_date, end_date, months} queues a build and
+    returns the job (202, or 200 when an identical up-to-date job exists);
+    poll GET /report-jobs/<id>/ until status is DONE, then fetch
+    /report-jobs/<id>/download/. Stored results are kept for REPORT_JOB_TTL.
+    """
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrHigher]
 
-        # --- RESPONSE ---
-        response_data = {
-            'start_date': start_date,
-            'end_date': end_date,
-            'total_revenue': f"{total_revenue:.2f}",
-            'total_cogs': f"{total_cogs:.2f}",
-            'total_waste_loss': f"{total_waste_loss:.2f}",
-            'total_expenses': f"{total_expenses:.2f}",
-            'total_adjustments': f"{total_adjustments:.2f}",
-            'gross_profit': f"{gross_profit:.2f}",
-            'net_profit': f"{net_profit:.2f}",
-            'waste_details': waste_details,
-            'pl_details': pl_details,
-            'best_selling': best_selling,
-            'low_selling': low_selling,
-            'monthly_comparison': monthly_comparison,
-        }
+    def create(self, request, *args, **kwargs):
+        user = request.user
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.data.get('shop_id')
+            if not shop_id:
+                return Response({"error": "Shop ID is required."}, status=status.HTTP_400_BAD_REQUEST)
+        elif getattr(user, 'shop_id', None) is None:
+            return Response({"error": "User is not associated with a shop."}, status=status.HTTP_403_FORBIDDEN)
+        else:
+            shop_id = user.shop_id
+
+        period = request.data.get('period', 'custom')
+        try:
+            start_date, end_date = reports.report_range(
+                period, request.data.get('start_date'), request.data.get('end_date')
+            )
+            months = min(max(int(request.data.get('months', 6)), 1), 36)
+            job, created = ReportJob.submit(
+                int(shop_id), start_date, end_date, months=months, period=period, user=user
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK,
+        )
 
-        serializer = self.get_serializer(response_data)
-        return Response(serializer.data, status=200)
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status == "FAILED":
+            return Response({"error": job.error}, status=status.HTTP_409_CONFLICT)
+        if job.status != "DONE":
+            return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        response = Response(job.result, status=status.HTTP_200_OK)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shop_{job.shop_id}_report_{job.start_date}_{job.end_date}.json"'
+        )
+        return response
 
 from datetime import date
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 from decimal import Decimal
+from django.db.models.functions import TruncMonth
 
 def get_monthly_comparison(shop_id, months=6):
     end_date = date.today()
     start_date = (end_date - relativedelta(months=months-1)).replace(day=1)
 
-    # --- FETCH DATA ---
-    orders = Order.objects.filter(
-        shop_id=shop_id, status='COMPLETED', created_at__date__range=(start_date, end_date)
-    )
-    items = OrderItem.objects.filter(order__in=orders).select_related('variant')
-    expenses = Expense.objects.filter(shop_id=shop_id, date__range=(start_date, end_date))
-    waste = WasteProduct.objects.filter(
-        shop_id=shop_id, recorded_at__date__range=(start_date, end_date)
-    ).select_related('variant')
+    # --- FETCH DATA (sales and waste from the daily rollup, grouped by month in SQL) ---
+    rollups = DailySalesRollup.objects.filter(
+        shop_id=shop_id, date__range=(start_date, end_date)
+    ).annotate(month=TruncMonth('date')).values('month').annotate(
+        revenue=Sum('revenue'), cogs=Sum('cogs'), waste_loss=Sum('waste_loss')
+    ).order_by()
+    expenses = Expense.objects.filter(
+        shop_id=shop_id, date__range=(start_date, end_date)
+    ).annotate(month=TruncMonth('date')).values('month').annotate(total=Sum('amount')).order_by()
 
-    # --- AGGREGATE PER ITEM BY MONTH ---
     monthly_data = {}
-    for item in items:
-        month_key = item.order.created_at.strftime('%Y-%m')
-        revenue = Decimal(item.quantity) * Decimal(getattr(item, 'price', 0) or 0)
-        cogs = Decimal(item.quantity) * Decimal(getattr(item.variant, 'purchase_price', 0) or 0)
-
-        if month_key not in monthly_data:
-            monthly_data[month_key] = {'revenue': Decimal('0.00'), 'cogs': Decimal('0.00'), 'waste_loss': Decimal('0.00'), 'expenses': Decimal('0.00')}
-        monthly_data[month_key]['revenue'] += revenue
-        monthly_data[month_key]['cogs'] += cogs
-
-    for w in waste:
-        month_key = w.recorded_at.strftime('%Y-%m')
-        loss = Decimal(w.quantity) * Decimal(getattr(w.variant, 'purchase_price', 0) or 0)
-        if month_key not in monthly_data:
-            monthly_data[month_key] = {'revenue': Decimal('0.00'), 'cogs': Decimal('0.00'), 'waste_loss': Decimal('0.00'), 'expenses': Decimal('0.00')}
-        monthly_data[month_key]['waste_loss'] += loss
-
-    for e in expenses:
-        month_key = e.date.strftime('%Y-%m')
+    for row in rollups:
+        monthly_data[row['month'].strftime('%Y-%m')] = {
+            'revenue': row['revenue'], 'cogs': row['cogs'], 'waste_loss': row['waste_loss'], 'expenses': Decimal('0.00')
+        }
+    for row in expenses:
+        month_key = row['month'].strftime('%Y-%m')
         if month_key not in monthly_data:
             monthly_data[month_key] = {'revenue': Decimal('0.00'), 'cogs': Decimal('0.00'), 'waste_loss': Decimal('0.00'), 'expenses': Decimal('0.00')}
-        monthly_data[month_key]['expenses'] += Decimal(e.amount or 0)
+        monthly_data[month_key]['expenses'] += Decimal(row['total'] or 0)
 
     # --- ENSURE LAST N MONTHS EXIST ---
     month_list = [(end_date - relativedelta(months=i)).strftime('%Y-%m') for i in reversed(range(months))]
@@ -876,6 +1272,7 @@ def get_monthly_comparison(shop_id, months=6):
 from rest_framework import viewsets, permissions
 from .models import ProductVariant
 from .serializers import ProductVariantSerializer
+from .scan import lookup as scan_lookup
 
 class ProductVariantViewSet(viewsets.ModelViewSet):
     queryset = ProductVariant.objects.select_related("product", "color", "size")
@@ -895,6 +1292,30 @@ class ProductVariantViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @action(detail=False, methods=["get"], url_path="scan")
+    def scan(self, request):
+        """
+        Scanner lookup: GET /product-variants/scan/?barcode=... resolves the
+        barcode within the user's shop and returns a compact line-item record.
+        """
+        barcode = (request.query_params.get("barcode") or "").strip()
+        if not barcode:
+            return Response({"error": "barcode is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        shop_id = user.shop_id
+        if user.is_superuser or getattr(user, "is_super_admin", lambda: False)():
+            shop_id = request.query_params.get("shop_id") or shop_id
+        try:
+            shop_id = int(shop_id)
+        except (TypeError, ValueError):
+            return Response({"error": "shop_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        record = scan_lookup(shop_id, barcode)
+        if record is None:
+            return Response({"detail": "No product with this barcode."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(record, status=status.HTTP_200_OK)
+
 #============================
 # Employee
 #=============================
@@ -1317,8 +1738,12 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status, viewsets
 from decimal import Decimal
+from django.core import signing
 from .models import Customer, DebtToBePaid
 
+STATEMENT_CURSOR_SALT = "pos.customer-statement"
+
+
 class CustomerViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
     # Adjust queryset and permissions as necessary for your application
     queryset = Customer.objects.all()
@@ -1337,59 +1762,60 @@ class CustomerViewSet(ShopRestrictedMixin, viewsets.ModelViewSet):
         except (TypeError, InvalidOperation):
             return Response({"detail": "Invalid amount format"}, status=status.HTTP_400_BAD_REQUEST)
 
-        remaining_payment = amount
-
-        # Only consider debts that are not fully paid, ordered by creation time (FIFO)
-        debts = DebtToBePaid.objects.filter(
-            customer=customer
-        ).exclude(
-            status="PAID"
-        ).order_by('created_at')
+        # FIFO allocation over the open debts: one locked read, one bulk write, one balance update
+        applied = customer.apply_payment(amount)
 
-        # Apply payment to debts
-        for debt in debts:
-            if remaining_payment <= Decimal("0.00"):
-                break
-
-            # Calculate the amount to apply to this specific debt
-            apply_amount = min(remaining_payment, debt.remaining_amount)
-
-            # Update debt record fields
-            debt.paid_amount += apply_amount
-            debt.remaining_amount -= apply_amount
-            remaining_payment -= apply_amount
-
-            # Update status
-            if debt.remaining_amount <= Decimal("0.00"):
-                debt.status = "PAID"
-                debt.remaining_amount = Decimal("0.00") # Ensure no negative balance
-            else:
-                debt.status = "PARTIAL"
-
-            debt.save()
-
-        # --- CRITICAL FIX: Update customer's total debt using DB aggregate ---
-
-        # Calculate the new total debt by summing remaining_amount of all unsettled debts
-        total_remaining = DebtToBePaid.objects.filter(
-            customer=customer
-        ).exclude(
-            status="PAID"
-        ).aggregate(
-            total=Sum('remaining_amount')
-        )['total'] or Decimal('0.00')
+        return Response({
+            "detail": "Payment recorded successfully",
+            "payment_applied": str(applied),
+            "remaining_debt": str(customer.total_debt)
+        }, status=status.HTTP_200_OK)
 
-        customer.total_debt = total_remaining
-        customer.save(update_fields=["total_debt"])
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        """
+        Orders, debts and payments with a running balance, oldest first
+        (?order=desc for newest first). Keyset paginated: pass the returned
+        "next" back as ?cursor= for the following page.
+        """
+        customer = self.get_object()
+        descending = request.query_params.get("order") == "desc"
+        try:
+            limit = min(max(int(request.query_params.get("limit", 50)), 1), 200)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Note: If you implemented customer.recalculate_debt() you could replace
-        # the aggregation block above with: customer.recalculate_debt()
+        cursor = None
+        token = request.query_params.get("cursor")
+        if token:
+            try:
+                cursor = signing.loads(token, salt=STATEMENT_CURSOR_SALT)
+            except signing.BadSignature:
+                return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+            if cursor.get("customer") != customer.pk or cursor.get("desc") != descending:
+                return Response({"detail": "Cursor does not match this statement"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows, next_cursor = reports.customer_statement(customer.pk, cursor, limit, descending)
+        if next_cursor:
+            next_cursor = signing.dumps(
+                {**next_cursor, "customer": customer.pk, "desc": descending}, salt=STATEMENT_CURSOR_SALT
+            )
 
         return Response({
-            "detail": "Payment recorded successfully",
-            "payment_applied": str(amount - remaining_payment),
-            "remaining_debt": str(customer.total_debt)
+            "customer": {"id": customer.pk, "name": customer.name, "total_debt": f"{customer.total_debt or 0:.2f}"},
+            "next": next_cursor,
+            "results": [
+                {
+                    **row,
+                    "debit": f"{row['debit']:.2f}",
+                    "credit": f"{row['credit']:.2f}",
+                    "balance": f"{row['balance']:.2f}",
+                }
+                for row in rows
+            ],
         }, status=status.HTTP_200_OK)
+
+
 class DebtToBePaidViewSet(viewsets.ModelViewSet):
     queryset = DebtToBePaid.objects.all()
     serializer_class = DebtToBePaidSerializer
@@ -144,4 +144,29 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
-}
\ No newline at end of file
+}
+
+# How long a checkout Idempotency-Key (and its stored response) stays replayable
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+# Post-commit job queue (pos.jobs): worker threads per process, or run inline after commit
+JOB_QUEUE_WORKERS = 2
+JOB_QUEUE_EAGER = False
+# Worker threads for named job pools; long report builds run apart from checkout follow-ups
+JOB_QUEUE_POOLS = {"reports": 1}
+
+# Per-process barcode scan cache (pos.scan): max records, and seconds before another worker's changes show up
+SCAN_CACHE_SIZE = 2048
+SCAN_CACHE_TTL = 60
+
+# How long deleted products/variants are remembered for delta catalog sync; older watermarks get a full resync
+CATALOG_TOMBSTONE_TTL = timedelta(days=30)
+
+# Seconds a cached shop report payload is kept; entries are keyed on Shop.data_version, so this only bounds memory
+REPORT_CACHE_TTL = 3600
+
+# How long background report jobs and their stored payloads are kept
+REPORT_JOB_TTL = timedelta(days=7)
+
+# Worker processes for the nightly per-shop forecast (compute_forecasts); None uses one per core
+FORECAST_WORKERS = None